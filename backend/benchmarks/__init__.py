@@ -0,0 +1,3 @@
+"""
+    API benchmarks: synthetic dataset generator and endpoint timings
+"""
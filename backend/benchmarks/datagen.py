@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Synthetic dataset generator for API benchmarks
+
+Creates projects, programs, users, observations (with medias), sites and
+visits (with medias) spread over real communes of ``ref_geo.l_areas``.
+Every generated row is tagged with the ``bench_`` prefix so that it can be
+removed with ``--clean``.
+
+Usage::
+
+    python -m benchmarks.datagen --observations 1000000 --sites 100000
+    python -m benchmarks.datagen --clean
+"""
+
+import argparse
+import logging
+import time
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+BENCH_PREFIX = "bench_"
+DEFAULT_BATCH_SIZE = 100000
+
+
+def _execute(db, sql, **params):
+    return db.session.execute(text(sql), params)
+
+
+def _scalars(db, sql, **params):
+    return [row[0] for row in _execute(db, sql, **params)]
+
+
+def _batches(total, batch_size):
+    done = 0
+    while done < total:
+        size = min(batch_size, total - done)
+        yield done, size
+        done += size
+
+
+def prepare_points(db, communes):
+    """Sample communes and store one point on surface for each of them"""
+    _execute(db, "DROP TABLE IF EXISTS bench_points")
+    _execute(
+        db,
+        """
+        CREATE TEMPORARY TABLE bench_points AS
+        SELECT row_number() OVER () AS rn, c.id_area,
+               ST_Transform(ST_PointOnSurface(c.geom), 4326) AS geom
+        FROM (
+            SELECT a.id_area, a.geom
+            FROM ref_geo.l_areas a
+            JOIN ref_geo.bib_areas_types t ON t.id_type = a.id_type
+            WHERE t.type_name = 'Communes'
+            ORDER BY random()
+            LIMIT :communes
+        ) c
+        """,
+        communes=communes,
+    )
+    count = _scalars(db, "SELECT count(*) FROM bench_points")[0]
+    if not count:
+        raise RuntimeError("No commune found in ref_geo.l_areas")
+    return count
+
+
+def create_programs(db, nb_projects, nb_programs, taxonomy_list):
+    geom_id = _scalars(
+        db,
+        """
+        INSERT INTO gnc_core.t_geometries (name, geom, timestamp_create)
+        SELECT 'bench_extent', ST_Envelope(ST_Collect(geom)), now()
+        FROM bench_points
+        RETURNING id_geom
+        """,
+    )[0]
+    project_ids = _scalars(
+        db,
+        """
+        INSERT INTO gnc_core.t_projects
+            (unique_id_project, name, short_desc, long_desc, timestamp_create)
+        SELECT uuid_generate_v4(), 'bench_project_' || i, 'bench', 'bench', now()
+        FROM generate_series(1, :n) i
+        RETURNING id_project
+        """,
+        n=nb_projects,
+    )
+    program_ids = {}
+    for id_module, module in ((1, "observations"), (2, "sites")):
+        program_ids[module] = _scalars(
+            db,
+            """
+            INSERT INTO gnc_core.t_programs
+                (unique_id_program, id_project, title, short_desc, long_desc,
+                 id_module, taxonomy_list, is_active, id_geom, timestamp_create)
+            SELECT uuid_generate_v4(), (:projects)[1 + i % array_length(:projects, 1)],
+                   'bench_' || :module || '_' || i, 'bench', 'bench',
+                   :id_module, :taxonomy_list, true, :id_geom, now()
+            FROM generate_series(1, :n) i
+            RETURNING id_program
+            """,
+            projects=project_ids,
+            module=module,
+            id_module=id_module,
+            taxonomy_list=taxonomy_list,
+            id_geom=geom_id,
+            n=nb_programs,
+        )
+    return program_ids
+
+
+def create_users(db, nb_users):
+    return _scalars(
+        db,
+        """
+        INSERT INTO gnc_core.t_users
+            (name, surname, username, password, email, active, admin, timestamp_create)
+        SELECT 'bench', 'user', 'bench_user_' || i, 'not-a-hash',
+               'bench_user_' || i || '@bench.invalid', true, false,
+               now() - (random() * 1000 || ' days')::interval
+        FROM generate_series(1, :n) i
+        RETURNING id_user
+        """,
+        n=nb_users,
+    )
+
+
+def get_cd_noms(db, taxonomy_list, nb_taxa):
+    if taxonomy_list is not None:
+        cd_noms = _scalars(
+            db,
+            """
+            SELECT n.cd_nom FROM taxonomie.cor_nom_liste c
+            JOIN taxonomie.bib_noms n ON n.id_nom = c.id_nom
+            WHERE c.id_liste = :id_liste AND n.cd_nom IS NOT NULL
+            """,
+            id_liste=taxonomy_list,
+        )
+        if cd_noms:
+            return cd_noms
+    return _scalars(
+        db,
+        """
+        SELECT cd_nom FROM taxonomie.taxref
+        WHERE cd_nom = cd_ref AND id_rang = 'ES'
+        ORDER BY random() LIMIT :n
+        """,
+        n=nb_taxa,
+    )
+
+
+def create_observations(db, total, programs, users, cd_noms, nb_points, batch_size):
+    for done, size in _batches(total, batch_size):
+        _execute(
+            db,
+            """
+            WITH g AS (
+                SELECT i, 1 + floor(random() * :nb_points)::int AS rn,
+                       (:users)[1 + floor(random() * array_length(:users, 1))::int]
+                           AS id_role
+                FROM generate_series(1, :n) i
+            )
+            INSERT INTO gnc_obstax.t_obstax
+                (uuid_sinp, id_program, cd_nom, date, count, comment,
+                 municipality, geom, id_role, obs_txt, email,
+                 timestamp_create, timestamp_update)
+            SELECT uuid_generate_v4(),
+                   (:programs)[1 + floor(random() * array_length(:programs, 1))::int],
+                   (:cd_noms)[1 + floor(random() * array_length(:cd_noms, 1))::int],
+                   current_date - floor(random() * 1500)::int,
+                   1 + floor(random() * 5)::int, 'bench', p.id_area,
+                   ST_Translate(p.geom, (random() - 0.5) / 100, (random() - 0.5) / 100),
+                   g.id_role, 'bench_user', 'bench@bench.invalid',
+                   now() - (random() * 1500 || ' days')::interval, now()
+            FROM g JOIN bench_points p ON p.rn = g.rn
+            """,
+            nb_points=nb_points,
+            users=users,
+            programs=programs,
+            cd_noms=cd_noms,
+            n=size,
+        )
+        db.session.commit()
+        logger.info("observations: %s/%s", done + size, total)
+
+
+def create_sites(db, total, programs, users, nb_points, batch_size):
+    id_type = _scalars(
+        db,
+        """
+        INSERT INTO gnc_sites.t_typesite (category, type, timestamp_create)
+        VALUES ('bench', 'bench_type', now())
+        RETURNING id_typesite
+        """,
+    )[0]
+    for done, size in _batches(total, batch_size):
+        _execute(
+            db,
+            """
+            WITH g AS (
+                SELECT i, 1 + floor(random() * :nb_points)::int AS rn,
+                       (:users)[1 + floor(random() * array_length(:users, 1))::int]
+                           AS id_role
+                FROM generate_series(1, :n) i
+            )
+            INSERT INTO gnc_sites.t_sites
+                (uuid_sinp, id_program, name, id_type, geom, id_role, obs_txt,
+                 timestamp_create, timestamp_update)
+            SELECT uuid_generate_v4(),
+                   (:programs)[1 + floor(random() * array_length(:programs, 1))::int],
+                   'bench_site_' || (:offset + g.i), :id_type,
+                   ST_Translate(p.geom, (random() - 0.5) / 100, (random() - 0.5) / 100),
+                   g.id_role, 'bench_user', now(), now()
+            FROM g JOIN bench_points p ON p.rn = g.rn
+            """,
+            nb_points=nb_points,
+            users=users,
+            programs=programs,
+            id_type=id_type,
+            offset=done,
+            n=size,
+        )
+        db.session.commit()
+        logger.info("sites: %s/%s", done + size, total)
+
+
+def create_visits(db, visits_per_site, programs, users):
+    _execute(
+        db,
+        """
+        INSERT INTO gnc_sites.t_visit
+            (id_site, date, json_data, id_role, obs_txt, timestamp_create)
+        SELECT s.id_site, current_date - floor(random() * 1500)::int,
+               jsonb_build_object('bench', true, 'count', floor(random() * 10)),
+               (:users)[1 + floor(random() * array_length(:users, 1))::int],
+               'bench_user', now()
+        FROM gnc_sites.t_sites s, generate_series(1, :n) i
+        WHERE s.id_program = ANY(:programs)
+        """,
+        users=users,
+        programs=programs,
+        n=visits_per_site,
+    )
+    db.session.commit()
+
+
+def create_medias(db, ratio, obs_programs, site_programs):
+    """Attach a (fake) media to a ``ratio`` of observations and visits"""
+    _execute(
+        db,
+        """
+        WITH m AS (
+            INSERT INTO gnc_core.t_medias (filename, timestamp_create)
+            SELECT 'bench_obs_' || id_observation || '.jpg', now()
+            FROM gnc_obstax.t_obstax
+            WHERE id_program = ANY(:programs) AND random() < :ratio
+            RETURNING id_media, filename
+        )
+        INSERT INTO gnc_obstax.cor_obstax_media
+            (id_data_source, id_media, timestamp_create)
+        SELECT substring(filename FROM 'bench_obs_(\\d+)')::int, id_media, now()
+        FROM m
+        """,
+        programs=obs_programs,
+        ratio=ratio,
+    )
+    _execute(
+        db,
+        """
+        WITH m AS (
+            INSERT INTO gnc_core.t_medias (filename, timestamp_create)
+            SELECT 'bench_visit_' || v.id_visit || '.jpg', now()
+            FROM gnc_sites.t_visit v
+            JOIN gnc_sites.t_sites s ON s.id_site = v.id_site
+            WHERE s.id_program = ANY(:programs) AND random() < :ratio
+            RETURNING id_media, filename
+        )
+        INSERT INTO gnc_sites.cor_visites_media
+            (id_data_source, id_media, timestamp_create)
+        SELECT substring(filename FROM 'bench_visit_(\\d+)')::int, id_media, now()
+        FROM m
+        """,
+        programs=site_programs,
+        ratio=ratio,
+    )
+    db.session.commit()
+
+
+def clean(db):
+    """Remove every generated row (cascades to observations, sites, visits...)"""
+    _execute(
+        db,
+        "DELETE FROM gnc_core.t_medias WHERE filename LIKE 'bench\\_%' ESCAPE '\\'",
+    )
+    for sql in (
+        "DELETE FROM gnc_obstax.t_obstax WHERE id_program IN "
+        "(SELECT id_program FROM gnc_core.t_programs WHERE title LIKE 'bench\\_%')",
+        "DELETE FROM gnc_sites.t_sites WHERE id_program IN "
+        "(SELECT id_program FROM gnc_core.t_programs WHERE title LIKE 'bench\\_%')",
+        "DELETE FROM gnc_sites.t_typesite WHERE type = 'bench_type'",
+        "DELETE FROM gnc_core.t_programs WHERE title LIKE 'bench\\_%'",
+        "DELETE FROM gnc_core.t_projects WHERE name LIKE 'bench\\_%'",
+        "DELETE FROM gnc_core.t_geometries WHERE name = 'bench_extent'",
+        "DELETE FROM gnc_core.t_users WHERE username LIKE 'bench\\_user\\_%'",
+    ):
+        _execute(db, sql)
+    db.session.commit()
+
+
+def generate(db, args):
+    start = time.perf_counter()
+    nb_points = prepare_points(db, args.communes)
+    programs = create_programs(db, args.projects, args.programs, args.taxonomy_list)
+    users = create_users(db, args.users)
+    cd_noms = get_cd_noms(db, args.taxonomy_list, args.taxa)
+    db.session.commit()
+    create_observations(
+        db,
+        args.observations,
+        programs["observations"],
+        users,
+        cd_noms,
+        nb_points,
+        args.batch_size,
+    )
+    create_sites(db, args.sites, programs["sites"], users, nb_points, args.batch_size)
+    create_visits(db, args.visits_per_site, programs["sites"], users)
+    create_medias(db, args.media_ratio, programs["observations"], programs["sites"])
+    _execute(db, "ANALYZE gnc_obstax.t_obstax")
+    _execute(db, "ANALYZE gnc_sites.t_sites")
+    _execute(db, "ANALYZE gnc_sites.t_visit")
+    db.session.commit()
+    logger.info("dataset generated in %.1fs", time.perf_counter() - start)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--projects", type=int, default=3)
+    parser.add_argument("--programs", type=int, default=5, help="per module")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--observations", type=int, default=1000000)
+    parser.add_argument("--sites", type=int, default=100000)
+    parser.add_argument("--visits-per-site", type=int, default=3)
+    parser.add_argument("--media-ratio", type=float, default=0.3)
+    parser.add_argument("--communes", type=int, default=5000)
+    parser.add_argument("--taxa", type=int, default=500)
+    parser.add_argument("--taxonomy-list", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--clean", action="store_true", help="remove bench data")
+    return parser
+
+
+def main():
+    from gncitizen.utils.env import load_config
+    from server import db, get_app
+
+    logging.basicConfig(level=logging.INFO)
+    args = get_parser().parse_args()
+    app = get_app(load_config())
+    with app.app_context():
+        if args.clean:
+            clean(db)
+        else:
+            generate(db, args)
+
+
+if __name__ == "__main__":
+    main()
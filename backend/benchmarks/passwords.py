@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark password hashing schemes (logins per second per core)
+
+Each scheme available in this environment is measured in a single thread
+with the settings of the ``[PASSWORDS]`` config section, a login costing one
+hash verification.
+
+Usage::
+
+    python -m benchmarks.passwords --duration 5
+"""
+
+import argparse
+import json
+import time
+
+from gncitizen.utils.env import app_conf
+from gncitizen.utils.passwords import DEFAULT_SCHEMES, build_crypt_context
+
+PASSWORD = "bench-Passw0rd"
+
+
+def bench_scheme(handler, duration):
+    """Return verifications per second of a configured passlib handler"""
+    start = time.perf_counter()
+    hash = handler.hash(PASSWORD)
+    hash_time = time.perf_counter() - start
+    count = 0
+    start = time.perf_counter()
+    while count == 0 or time.perf_counter() - start < duration:
+        handler.verify(PASSWORD, hash)
+        count += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "logins_per_second": round(count / elapsed, 2),
+        "verify_ms": round(elapsed / count * 1000, 3),
+        "hash_ms": round(hash_time * 1000, 3),
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--duration", type=float, default=3, help="seconds spent per scheme"
+    )
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    conf = dict(app_conf.get("PASSWORDS", {}))
+    conf.setdefault("SCHEMES", DEFAULT_SCHEMES)
+    context = build_crypt_context(conf)
+    results = {}
+    for scheme in context.schemes():
+        results[scheme] = bench_scheme(context.handler(scheme), args.duration)
+        print(
+            "{:<16} {:>10.2f} logins/s/core  verify {:>9.3f} ms".format(
+                scheme,
+                results[scheme]["logins_per_second"],
+                results[scheme]["verify_ms"],
+            )
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark hot API endpoints through the Flask test client
+
+For each endpoint, the benchmark reports latency percentiles, the number of
+SQL statements and the peak Python memory of one call. Results are written
+as JSON (``benchmarks/results/<git revision>.json`` by default) so that two
+runs can be compared with ``--compare``.
+
+Usage::
+
+    python -m benchmarks.run --iterations 20
+    python -m benchmarks.run --compare benchmarks/results/abc1234.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from pathlib import Path
+
+from sqlalchemy import event, text
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = Path(__file__).absolute().parent / "results"
+
+"""Benchmarked endpoints, ``{program}``, ``{sites_program}``, ``{user}`` and
+``{taxonomy_list}`` are replaced by ids of the generated dataset"""
+ENDPOINTS = {
+    "program_observations": "/api/programs/{program}/observations",
+    "all_observations": "/api/programs/all/observations",
+    "user_observations": "/api/observations/users/{user}",
+    "program_sites": "/api/sites/programs/{sites_program}",
+    "stats": "/api/stats",
+    "rewards": "/api/rewards/{user}",
+    "taxonomy_lists": "/api/taxonomy/lists",
+    "taxonomy_list_species": "/api/taxonomy/lists/{taxonomy_list}/species",
+}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * pct / 100
+    f, c = int(k), min(int(k) + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+class QueryCounter(object):
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args, **kwargs):
+        self.count += 1
+
+
+def get_git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:
+        return "unknown"
+
+
+def get_dataset_ids(db):
+    """Pick the busiest bench program, sites program and user"""
+
+    def first(sql):
+        row = db.session.execute(text(sql)).first()
+        return row[0] if row else None
+
+    return {
+        "program": first(
+            """SELECT o.id_program FROM gnc_obstax.t_obstax o
+            JOIN gnc_core.t_programs p ON p.id_program = o.id_program
+            WHERE p.title LIKE 'bench\\_%' GROUP BY o.id_program
+            ORDER BY count(*) DESC LIMIT 1"""
+        ),
+        "sites_program": first(
+            """SELECT s.id_program FROM gnc_sites.t_sites s
+            JOIN gnc_core.t_programs p ON p.id_program = s.id_program
+            WHERE p.title LIKE 'bench\\_%' GROUP BY s.id_program
+            ORDER BY count(*) DESC LIMIT 1"""
+        ),
+        "user": first(
+            """SELECT o.id_role FROM gnc_obstax.t_obstax o
+            JOIN gnc_core.t_users u ON u.id_user = o.id_role
+            WHERE u.username LIKE 'bench\\_user\\_%' GROUP BY o.id_role
+            ORDER BY count(*) DESC LIMIT 1"""
+        ),
+        "taxonomy_list": first(
+            """SELECT taxonomy_list FROM gnc_core.t_programs
+            WHERE title LIKE 'bench\\_%' AND taxonomy_list IS NOT NULL LIMIT 1"""
+        ),
+    }
+
+
+def get_dataset_size(db):
+    sizes = {}
+    for name, table in (
+        ("observations", "gnc_obstax.t_obstax"),
+        ("sites", "gnc_sites.t_sites"),
+        ("visits", "gnc_sites.t_visit"),
+        ("medias", "gnc_core.t_medias"),
+        ("users", "gnc_core.t_users"),
+    ):
+        sizes[name] = db.session.execute(
+            text("SELECT count(*) FROM {}".format(table))
+        ).scalar()
+    return sizes
+
+
+def bench_endpoint(client, url, iterations, warmup, counter):
+    for _ in range(warmup):
+        client.get(url)
+
+    # One traced call for memory and query count
+    counter.count = 0
+    tracemalloc.start()
+    response = client.get(url)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    queries = counter.count
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "url": url,
+        "status": response.status_code,
+        "response_bytes": len(response.get_data()),
+        "queries": queries,
+        "peak_memory_kb": round(peak / 1024, 1),
+        "iterations": iterations,
+        "min": round(min(timings), 3),
+        "mean": round(statistics.mean(timings), 3),
+        "p50": round(percentile(timings, 50), 3),
+        "p90": round(percentile(timings, 90), 3),
+        "p99": round(percentile(timings, 99), 3),
+        "max": round(max(timings), 3),
+    }
+
+
+def compare(results, reference):
+    """Print p50/queries/memory deltas against a previous result file"""
+    print(
+        "{:<24} {:>10} {:>10} {:>8} {:>10} {:>10}".format(
+            "endpoint", "p50 ref", "p50", "delta", "queries", "mem (kb)"
+        )
+    )
+    for name, res in results["results"].items():
+        ref = reference["results"].get(name)
+        if not ref or "p50" not in res or "p50" not in ref:
+            continue
+        delta = (res["p50"] - ref["p50"]) / ref["p50"] * 100 if ref["p50"] else 0
+        print(
+            "{:<24} {:>10} {:>10} {:>7.1f}% {:>4}->{:<5} {:>10}".format(
+                name,
+                ref["p50"],
+                res["p50"],
+                delta,
+                ref["queries"],
+                res["queries"],
+                res["peak_memory_kb"],
+            )
+        )
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument(
+        "--endpoints",
+        nargs="*",
+        choices=sorted(ENDPOINTS),
+        default=sorted(ENDPOINTS),
+    )
+    parser.add_argument("--output", help="result file (JSON)")
+    parser.add_argument("--compare", help="previous result file (JSON)")
+    return parser
+
+
+def main():
+    from gncitizen.utils.env import load_config
+    from server import db, get_app
+
+    logging.basicConfig(level=logging.INFO)
+    args = get_parser().parse_args()
+    app = get_app(load_config())
+    results = {
+        "meta": {
+            "git_revision": get_git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+        },
+        "results": {},
+    }
+    with app.app_context():
+        ids = get_dataset_ids(db)
+        results["meta"]["dataset"] = get_dataset_size(db)
+        results["meta"]["ids"] = ids
+        counter = QueryCounter(db.engine)
+        client = app.test_client()
+        for name in args.endpoints:
+            try:
+                url = ENDPOINTS[name].format(**ids)
+            except KeyError:
+                continue
+            if "None" in url:
+                logger.warning("skip %s: no matching bench data", name)
+                continue
+            logger.info("benchmarking %s", url)
+            results["results"][name] = bench_endpoint(
+                client, url, args.iterations, args.warmup, counter
+            )
+            db.session.remove()
+
+    output = args.output or str(
+        RESULTS_DIR / "{}.json".format(results["meta"]["git_revision"])
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info("results written to %s", output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
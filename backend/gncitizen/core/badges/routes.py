@@ -1,4 +1,5 @@
 from flask import Flask, request, Blueprint, Response, jsonify, current_app
+from gncitizen.utils.preload import load_badges_config
 from gncitizen.utils.sqlalchemy import json_resp
 from gncitizen.core.observations.models import ObservationModel
 from gncitizen.core.commons.models import ProgramsModel
@@ -19,7 +20,7 @@ def get_rewards(id):
     program_scores = []
     taxon_scores = []
     awarded_badges = []
-    current_app.config.from_pyfile("../config/badges_config.py")
+    load_badges_config(current_app)
     rewards = current_app.config["REWARDS"]
 
     scores_query = (
@@ -57,9 +58,8 @@ def get_rewards(id):
         taxon_scores.append({"famille": item.famille, "nb_obs": item.nb_obs})
 
     user = UserModel.query.filter(UserModel.id_user == id).one()
-    result = user.as_secured_dict(True)
-    user_date_create = result["timestamp_create"]
-    user_date_create = datetime.strptime(user_date_create, "%Y-%m-%dT%H:%M:%S.%f")
+    # Not parsed back from a serialized date (isoformat omits .%f when 0)
+    user_date_create = user.timestamp_create
 
     for reward in rewards:
 
@@ -13,6 +13,7 @@ from flask_admin.form.upload import FileUploadField
 from flask_ckeditor import CKEditorField 
 
 from geoalchemy2.shape import from_shape
+from sqlalchemy import inspect
 from geojson import FeatureCollection
 from shapely.geometry import MultiPolygon, asShape
 from wtforms import SelectField
@@ -25,6 +26,8 @@ from gncitizen.core.users.models import UserModel
 from gncitizen.core.sites.models import CorProgramSiteTypeModel
 from gncitizen.utils.env import admin, MEDIA_DIR
 from gncitizen.utils.errors import GeonatureApiError
+from gncitizen.utils.geometry_import import start_geometry_import
+from gncitizen.utils.partitioning import ensure_all_partitions
 from gncitizen.utils.sqlalchemy import json_resp
 from server import db
 
@@ -39,6 +42,23 @@ def json_formatter(view, context, model, name):
     return Markup("<pre>{}</pre>".format(json_value))
 
 
+IMPORT_STATUS_LABELS = {
+    "pending": "En attente",
+    "running": "En cours ({} %)",
+    "done": "Terminé",
+    "error": "Erreur : {}",
+}
+
+
+def import_status_formatter(view, context, model, name):
+    if model.import_status is None:
+        return ""
+    label = IMPORT_STATUS_LABELS.get(model.import_status, model.import_status)
+    if model.import_status == "running":
+        return label.format(model.import_progress)
+    return label.format(model.import_error)
+
+
 def taxonomy_lists():
     taxonomy_lists = []
     if current_app.config.get("API_TAXHUB") is None:
@@ -49,7 +69,11 @@ def taxonomy_lists():
     else:
         from gncitizen.utils.env import taxhub_lists_url
 
-        rtlists = requests.get(taxhub_lists_url)
+        try:
+            rtlists = requests.get(taxhub_lists_url, timeout=10)
+        except requests.RequestException as e:
+            current_app.logger.critical(str(e))
+            return taxonomy_lists
         # current_app.logger.warning(rtlists)
         if rtlists.status_code == 200:
             try:
@@ -83,7 +107,8 @@ class ProjectView(ModelView):
 class ProgramView(ModelView):
     # form_base_class = SecureForm
     form_overrides = {"long_desc": CKEditorField, "taxonomy_list": SelectField}
-    form_args = {"taxonomy_list": {"choices": taxonomy_lists(), "coerce": int}}
+    # choices are loaded at request time (see _set_taxonomy_list_choices)
+    form_args = {"taxonomy_list": {"choices": [], "coerce": int}}
     create_template = "edit.html"
     edit_template = "edit.html"
     form_excluded_columns = ["timestamp_create", "timestamp_update"]
@@ -98,6 +123,24 @@ class ProgramView(ModelView):
         )
     ]
 
+    def _set_taxonomy_list_choices(self, form):
+        form.taxonomy_list.choices = taxonomy_lists()
+        return form
+
+    def create_form(self, obj=None):
+        return self._set_taxonomy_list_choices(super().create_form(obj))
+
+    def edit_form(self, obj=None):
+        return self._set_taxonomy_list_choices(super().edit_form(obj))
+
+    def after_model_change(self, form, model, is_created):
+        if is_created:
+            # Partition of the program observations
+            try:
+                ensure_all_partitions()
+            except Exception as e:
+                current_app.logger.error("[admin] partitions: %s", str(e))
+
 
 class CustomFormView(ModelView):
     column_formatters = {
@@ -115,15 +158,38 @@ def get_geom_file_path(obj, file_data):
 
 
 class GeometryView(ModelView):
-    column_exclude_list = ["geom"]
-    form_excluded_columns = ["timestamp_create", "timestamp_update"]
+    column_exclude_list = [
+        "geom",
+        "geom_low",
+        "geom_medium",
+        "geom_high",
+        "bbox",
+        "centroid",
+        "import_progress",
+        "import_error",
+    ]
+    column_labels = {"import_status": "Import du fichier"}
+    column_formatters = {"import_status": import_status_formatter}
+    form_excluded_columns = [
+        "timestamp_create",
+        "timestamp_update",
+        "geom_low",
+        "geom_medium",
+        "geom_high",
+        "bbox",
+        "centroid",
+        "import_status",
+        "import_progress",
+        "import_error",
+    ]
     form_overrides = dict(geom_file=FileUploadField)
     form_args = dict(
         geom_file=dict(
             label="Fichier zone",
             description="""
                 Le fichier contenant la géométrie de la zone doit être au format geojson ou kml.<br>
-                Seules les types Polygon et MultiPolygon (ou MultiGeometry pour kml) sont acceptées.<br>
+                Tous les Polygon et MultiPolygon du fichier (ou Polygon, dans une MultiGeometry ou non, pour kml) sont fusionnés,
+                les autres géométries sont ignorées.<br>
                 Les fichiers GeoJson fournis devront être en projection WGS84 (donc SRID 4326) 
                 et respecter le format "FeatureCollection" tel que présenté ici :
                 https://tools.ietf.org/html/rfc7946#section-1.5.
@@ -135,7 +201,21 @@ class GeometryView(ModelView):
     )
 
     def on_model_change(self, form, model, is_created):
-        model.set_geom_from_geom_file()
+        # New file: imported in background once the geometry is saved
+        if model.geom_file and (
+            is_created or inspect(model).attrs.geom_file.history.has_changes()
+        ):
+            model.import_status = "pending"
+            model.import_progress = 0
+            model.import_error = None
+
+    def after_model_change(self, form, model, is_created):
+        if model.import_status == "pending":
+            start_geometry_import(model.id_geom)
+            flash(
+                "Import du fichier en cours, "
+                "sa progression est affichée dans la liste des zones"
+            )
 
     def handle_view_exception(self, exc):
         flash("Une erreur s'est produite ({})".format(exc), "error")
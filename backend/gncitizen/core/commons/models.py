@@ -5,7 +5,7 @@ from datetime import datetime
 import uuid
 
 from geoalchemy2 import Geometry
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, event, text
 from sqlalchemy.sql import expression
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship
@@ -65,9 +65,18 @@ class CustomFormModel(TimestampMixinModel, db.Model):
         return self.name
 
 
-from geoalchemy2.functions import ST_GeomFromKML, ST_GeomFromGeoJSON, ST_SetSRID
-import json
-import xml.etree.ElementTree as ET
+from sqlalchemy import func, inspect
+
+"""Versions simplifiées des géométries : (niveau, tolérance en degrés, zoom max)
+
+0.01° (~1 km) suffit jusqu'au zoom 8, 0.001° (~100 m) jusqu'au zoom 11 et
+0.0001° (~10 m) jusqu'au zoom 14, au-delà la géométrie complète est servie.
+"""
+GEOM_VARIANTS = (
+    ("low", 0.01, 8),
+    ("medium", 0.001, 11),
+    ("high", 0.0001, 14),
+)
 
 
 @serializable
@@ -81,51 +90,83 @@ class GeometryModel(TimestampMixinModel, db.Model):
     description = db.Column(db.Text(), nullable=True)
     geom = db.Column(Geometry("GEOMETRY", 4326))
     geom_file = db.Column(db.String(250), nullable=True)
+    # Calculés par la base à partir de geom (update_geom_variants)
+    geom_low = db.Column(Geometry("GEOMETRY", 4326, spatial_index=False))
+    geom_medium = db.Column(Geometry("GEOMETRY", 4326, spatial_index=False))
+    geom_high = db.Column(Geometry("GEOMETRY", 4326, spatial_index=False))
+    bbox = db.Column(Geometry("GEOMETRY", 4326, spatial_index=False))
+    centroid = db.Column(Geometry("POINT", 4326, spatial_index=False))
+    # Import du fichier en tâche de fond (gncitizen.utils.geometry_import) :
+    # pending, running, done ou error, progression en %
+    import_status = db.Column(db.String(10))
+    import_progress = db.Column(db.Integer)
+    import_error = db.Column(db.Text)
+
+    @classmethod
+    def geom_variant(cls, simplify=None, zoom=None):
+        """Colonne de la géométrie à servir pour un niveau ou un zoom de carte
+
+        :param simplify: niveau (low, medium, high ou full)
+        :type simplify: str
+        :param zoom: zoom de la carte (ignoré si ``simplify`` est donné)
+        :type zoom: int
+
+        :return: colonne géométrie, complète par défaut
+        """
+        if simplify is not None:
+            if simplify == "full":
+                return cls.geom
+            for level, _tolerance, _max_zoom in GEOM_VARIANTS:
+                if simplify == level:
+                    return getattr(cls, "geom_" + level)
+            raise ValueError("Unknown simplify level {}".format(simplify))
+        if zoom is not None:
+            for level, _tolerance, max_zoom in GEOM_VARIANTS:
+                if zoom <= max_zoom:
+                    return getattr(cls, "geom_" + level)
+        return cls.geom
+
+    @staticmethod
+    def variants_values(geom):
+        """Valeurs des versions simplifiées, de l'emprise et du centroïde
+
+        :param geom: colonne géométrie source
+        """
+        values = {
+            "geom_" + level: func.ST_SimplifyPreserveTopology(geom, tolerance)
+            for level, tolerance, _max_zoom in GEOM_VARIANTS
+        }
+        values["bbox"] = func.ST_Envelope(geom)
+        values["centroid"] = func.ST_Centroid(geom)
+        return values
 
     def get_geom_file_path(self):
         return os.path.join(str(MEDIA_DIR), self.geom_file)
 
-    def set_geom_from_geom_file(self):
-        gnc_invalid_err_message = "Géométrie non valide pour GNC"
-        name, ext = os.path.splitext(self.geom_file)
-        with open(self.get_geom_file_path()) as geom_file:
-            geo_data = geom_file.read()
-            if ext in [".geojson", ".json"]:
-                json_geom = json.loads(geo_data)["features"][0]["geometry"]
-                # Validate geometry type
-                if not json_geom["type"] in ["Polygon", "MultiPolygon"]:
-                    raise Exception(gnc_invalid_err_message)
-                else:
-                    # Minimal coordinate system check
-                    coords = json_geom["coordinates"][0][0]
-                    if json_geom["type"] == "MultiPolygon":
-                        coords = coords[0]
-                    x, y = coords
-                    if abs(x) > 180 or abs(y) > 180:
-                        raise Exception("Mauvais système de projection")
-                # Convert Geo
-                self.geom = ST_SetSRID(ST_GeomFromGeoJSON(json.dumps(json_geom)), 4326)
-            elif ext == ".kml":
-                kml_root = ET.fromstring(geo_data)
-                kml_geom_elt = None
-                # Find first MultiGeometry or Polygon node
-                for child in kml_root.iter():
-                    if "MultiGeometry" in child.tag or "Polygon" in child.tag:
-                        kml_geom_elt = child
-                        if "MultiGeometry" in child.tag:
-                            # We want only Polygon nodes inside the geometry
-                            for elt in kml_geom_elt.getchildren():
-                                if not "Polygon" in elt.tag:
-                                    raise Exception(gnc_invalid_err_message)
-                if kml_geom_elt is None:
-                    raise Exception(gnc_invalid_err_message)
-                kml_geom = ET.tostring(kml_geom_elt, encoding="unicode", method="xml")
-                self.geom = ST_GeomFromKML(kml_geom)  # KML is always 4326 srid
-
     def __repr__(self):
         return self.name
 
 
+def update_geom_variants(mapper, connection, target):
+    """Calcule les versions simplifiées d'une géométrie modifiée par l'ORM
+
+    Calculées par PostGIS à partir de la géométrie stockée. L'import d'un
+    fichier (gncitizen.utils.geometry_import) les calcule dans sa requête.
+    """
+    if not inspect(target).attrs.geom.history.has_changes():
+        return
+    table = GeometryModel.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.id_geom == target.id_geom)
+        .values(**GeometryModel.variants_values(table.c.geom))
+    )
+
+
+event.listen(GeometryModel, "after_insert", update_geom_variants)
+event.listen(GeometryModel, "after_update", update_geom_variants)
+
+
 from geoalchemy2.shape import to_shape
 from geojson import Feature
 
@@ -208,3 +249,112 @@ class MediaModel(TimestampMixinModel, db.Model):
 
     def __repr__(self):
         return self.filename
+
+
+class MailOutboxModel(TimestampMixinModel, db.Model):
+    """File d'attente des emails envoyés par l'expéditeur en tâche de fond"""
+
+    __tablename__ = "t_mail_outbox"
+    __table_args__ = (
+        db.Index("idx_t_mail_outbox_pending", "status", "next_attempt"),
+        {"schema": "gnc_core"},
+    )
+    id_mail = db.Column(db.Integer, primary_key=True)
+    mail_from = db.Column(db.String(150), nullable=False)
+    mail_to = db.Column(db.String(150), nullable=False)
+    subject = db.Column(db.String(250))
+    message = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return "{} -> {} ({})".format(self.subject, self.mail_to, self.status)
+
+
+@serializable
+class DeletionModel(db.Model):
+    """Journal des suppressions d'observations, de sites et de visites
+
+    Rempli par le trigger ``gnc_core.log_deletion`` des tables journalisées
+    (suppressions par l'API, l'admin ou en cascade), lu par l'API de
+    synchronisation des clients hors ligne.
+    """
+
+    __tablename__ = "t_deletions"
+    __table_args__ = (
+        db.Index(
+            "idx_t_deletions_id_program_timestamp_delete",
+            "id_program",
+            "timestamp_delete",
+        ),
+        {"schema": "gnc_core"},
+    )
+    id_deletion = db.Column(db.BigInteger, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    id_entity = db.Column(db.Integer, nullable=False)
+    id_program = db.Column(db.Integer)
+    timestamp_delete = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=text("(now() AT TIME ZONE 'utc')"),
+    )
+
+    def __repr__(self):
+        return "<Deletion {} {}>".format(self.entity, self.id_entity)
+
+
+"""Tables journalisées dans t_deletions: (table, entité, clé primaire)"""
+LOGGED_DELETIONS = (
+    ("gnc_obstax.t_obstax", "observation", "id_observation"),
+    ("gnc_sites.t_sites", "site", "id_site"),
+    ("gnc_sites.t_visit", "visit", "id_visit"),
+)
+
+LOG_DELETION_FUNCTION = """
+CREATE OR REPLACE FUNCTION gnc_core.log_deletion() RETURNS trigger AS $$
+DECLARE
+    old_row jsonb := to_jsonb(OLD);
+    program integer := (old_row ->> 'id_program')::integer;
+BEGIN
+    -- Rows moved to a new partition are not deleted
+    IF current_setting('gnc.log_deletions', true) = 'off' THEN
+        RETURN OLD;
+    END IF;
+    IF program IS NULL AND TG_ARGV[0] = 'visit' THEN
+        SELECT s.id_program INTO program FROM gnc_sites.t_sites s
+        WHERE s.id_site = (old_row ->> 'id_site')::integer;
+        IF NOT FOUND THEN
+            -- Deleted with its site, the site deletion is logged
+            RETURN OLD;
+        END IF;
+    END IF;
+    INSERT INTO gnc_core.t_deletions (entity, id_entity, id_program)
+    VALUES (TG_ARGV[0], (old_row ->> TG_ARGV[1])::integer, program);
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql"""
+
+LOG_DELETION_TRIGGER = """
+DROP TRIGGER IF EXISTS {name}_log_deletion ON {table};
+CREATE TRIGGER {name}_log_deletion AFTER DELETE ON {table}
+FOR EACH ROW EXECUTE PROCEDURE gnc_core.log_deletion('{entity}', '{pk}')"""
+
+
+def install_deletion_log(target, connection, **kw):
+    """Create the function and triggers filling ``t_deletions``"""
+    connection.execute(text(LOG_DELETION_FUNCTION))
+    for table, entity, pk in LOGGED_DELETIONS:
+        connection.execute(
+            text(
+                LOG_DELETION_TRIGGER.format(
+                    name=table.split(".")[1], table=table, entity=entity, pk=pk
+                )
+            )
+        )
+
+
+# Tables created by create_all (new database), see migration 0003 otherwise
+event.listen(db.metadata, "after_create", install_deletion_log)
@@ -2,21 +2,25 @@
 # -*- coding:utf-8 -*-
 
 import json
+import os
 import urllib.parse
-from flask import Blueprint, request, current_app, send_from_directory
+from flask import Blueprint, request, current_app, redirect, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_admin.form import SecureForm
 from flask_admin.contrib.geoa import ModelView
 from sqlalchemy.sql import func
-from sqlalchemy import distinct, and_
+from sqlalchemy import cast, distinct, and_
+from sqlalchemy.dialects.postgresql import JSON
 from geoalchemy2.shape import from_shape
 from geojson import FeatureCollection
 from shapely.geometry import MultiPolygon, asShape
 from flask_ckeditor import CKEditorField
 
 from gncitizen.utils.errors import GeonatureApiError
-from gncitizen.utils.sqlalchemy import json_resp
-from gncitizen.utils.env import admin
+from gncitizen.utils.bundles import get_current_bundle, start_bundle_build
+from gncitizen.utils.media import send_media_file
+from gncitizen.utils.sqlalchemy import json_resp, to_json_resp
+from gncitizen.utils.env import admin, MEDIA_DIR
 from server import db
 
 from .models import (
@@ -39,7 +43,6 @@ from gncitizen.core.commons.admin import (
 )
 from gncitizen.core.sites.models import CorProgramSiteTypeModel, SiteTypeModel
 from gncitizen.core.sites.admin import SiteTypeView
-from gncitizen.utils.env import MEDIA_DIR
 
 commons_api = Blueprint("commons", __name__)
 
@@ -66,9 +69,9 @@ admin.add_view(
 )
 
 
-@commons_api.route("media/<item>")
+@commons_api.route("media/<path:item>")
 def get_media(item):
-    return send_from_directory(str(MEDIA_DIR), item)
+    return send_media_file(item)
 
 
 @commons_api.route("/modules/<int:pk>", methods=["GET"])
@@ -262,29 +265,141 @@ def get_program(pk):
         description: A list of all programs
     """
     # try:
+    try:
+        geom_column = get_geom_column()
+    except ValueError as e:
+        return {"message": str(e)}, 400
     datas = ProgramsModel.query.filter_by(id_program=pk, is_active=True).limit(1)
     if datas.count() != 1:
         current_app.logger.warning("[get_program] Program not found")
         return {"message": "Program not found"}, 400
     else:
-        features = []
-        for data in datas:
-            feature = data.get_geofeature()
-            # Get sites types for sites programs. TODO condition
-            if feature["properties"]["module"]["name"] == "sites":
-                site_types_qs = CorProgramSiteTypeModel.query.filter_by(id_program=pk)
-                site_types = [
-                    {"value": st.site_type.id_typesite, "text": st.site_type.type}
-                    for st in site_types_qs
-                ]
-                feature["site_types"] = site_types
-            features.append(feature)
+        features = [get_program_feature(data, geom_column) for data in datas]
         return {"features": features}, 200
     # except Exception as e:
     #     current_app.logger.critical("[get_program] error : %s", str(e))
     #     return {"message": str(e)}, 400
 
 
+def get_geom_column():
+    """Geometry column of the ``simplify`` (low, medium, high, full) or
+    ``zoom`` request parameter, full resolution by default
+
+    :raise ValueError: unknown simplify level
+    """
+    return GeometryModel.geom_variant(
+        request.args.get("simplify"), request.args.get("zoom", type=int)
+    )
+
+
+def get_programs_geometries(id_geoms, geom_column=None, with_geom=True):
+    """GeoJSON geometry, bbox and centroid of program geometries
+
+    Encoded by PostGIS, from the precomputed simplified versions.
+
+    :param id_geoms: geometry ids
+    :type id_geoms: list
+    :param geom_column: geometry column (``GeometryModel.geom_variant``)
+    :param with_geom: geometry desired (true) or only bbox and centroid
+    :type with_geom: bool
+
+    :return: ``{"geometry", "bbox", "centroid"}`` by geometry id
+    :rtype: dict
+    """
+    # Geometries saved before their versions were computed
+    bbox = func.coalesce(GeometryModel.bbox, GeometryModel.geom)
+    centroid = func.coalesce(
+        GeometryModel.centroid, func.ST_Centroid(GeometryModel.geom)
+    )
+    columns = [
+        GeometryModel.id_geom,
+        func.ST_XMin(bbox),
+        func.ST_YMin(bbox),
+        func.ST_XMax(bbox),
+        func.ST_YMax(bbox),
+        cast(func.ST_AsGeoJSON(centroid), JSON),
+    ]
+    if with_geom:
+        geom = GeometryModel.geom if geom_column is None else geom_column
+        geom = func.coalesce(geom, GeometryModel.geom)
+        columns.append(cast(func.ST_AsGeoJSON(geom), JSON))
+    geometries = {}
+    for row in db.session.query(*columns).filter(GeometryModel.id_geom.in_(id_geoms)):
+        geometries[row[0]] = {"bbox": list(row[1:5]), "centroid": row[5]}
+        if with_geom:
+            geometries[row[0]]["geometry"] = row[6]
+    return geometries
+
+
+def get_program_feature(program, geom_column=None):
+    """Feature of a program, with the site types of sites programs
+
+    :param program: program
+    :type program: ProgramsModel
+    :param geom_column: geometry column (``GeometryModel.geom_variant``)
+
+    :return: program feature
+    :rtype: dict
+    """
+    feature = {"type": "Feature", "id": program.id_program}
+    feature.update(
+        get_programs_geometries([program.id_geom], geom_column)[program.id_geom]
+    )
+    feature["properties"] = program.as_dict(True)
+    # Get sites types for sites programs. TODO condition
+    if feature["properties"]["module"]["name"] == "sites":
+        site_types_qs = CorProgramSiteTypeModel.query.filter_by(
+            id_program=program.id_program
+        )
+        site_types = [
+            {"value": st.site_type.id_typesite, "text": st.site_type.type}
+            for st in site_types_qs
+        ]
+        feature["site_types"] = site_types
+    return feature
+
+
+@commons_api.route("/programs/<int:pk>/bundle", methods=["GET"])
+def get_program_bundle(pk):
+    """Get the offline bundle of a program (zip archive)
+
+    Redirects to the current bundle, an immutable media rebuilt only when
+    the program, its custom form or its taxa changed.
+    ---
+    tags:
+     - Core
+    parameters:
+     - name: pk
+       in: path
+       type: integer
+       required: true
+       example: 1
+    responses:
+      302:
+        description: Program, custom form, taxa and taxa thumbnails (zip)
+      202:
+        description: Bundle being built, retry later
+    """
+    program = ProgramsModel.query.filter_by(id_program=pk, is_active=True).first()
+    if program is None:
+        current_app.logger.warning("[get_program_bundle] Program not found")
+        return to_json_resp({"message": "Program not found"}, 404)
+    try:
+        filename, _version, _documents = get_current_bundle(program)
+    except Exception as e:
+        current_app.logger.critical("[get_program_bundle] error : %s", str(e))
+        return to_json_resp({"message": str(e)}, 400)
+    if not os.path.isfile(os.path.join(MEDIA_DIR, filename)):
+        start_bundle_build(pk)
+        response = to_json_resp({"message": "Bundle is being built"}, 202)
+        response.headers["Retry-After"] = "10"
+        return response
+    # The stable URL must not be cached, the bundle URL is immutable
+    response = redirect(url_for("commons.get_media", item=filename))
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 @commons_api.route("/customform/<int:pk>", methods=["GET"])
 @json_resp
 def get_custom_form(pk):
@@ -349,6 +464,15 @@ def get_programs():
         in: query
         type: boolean
         description: geom desired (true) or not (false, default)
+      - name: simplify
+        in: query
+        type: string
+        enum: [low, medium, high, full]
+        description: simplified geom (full resolution by default)
+      - name: zoom
+        in: query
+        type: integer
+        description: map zoom, geom simplified for this zoom
     responses:
       200:
         description: A list of all programs
@@ -360,14 +484,22 @@ def get_programs():
             with_geom = json.loads(arg_with_geom.lower())
         else:
             with_geom = False
-        programs = ProgramsModel.query.filter_by(is_active=True).all()
+        geom_column = get_geom_column()
+        programs = (
+            ProgramsModel.query.options(*ProgramsModel.as_dict_options(True))
+            .filter_by(is_active=True)
+            .all()
+        )
         count = len(programs)
+        geometries = get_programs_geometries(
+            {program.id_geom for program in programs}, geom_column, with_geom
+        )
         features = []
         for program in programs:
+            # Without geom, bbox and centroid to place programs on a map
+            feature = dict(geometries.get(program.id_geom, {}))
             if with_geom:
-                feature = program.get_geofeature()
-            else:
-                feature = {}
+                feature.update(type="Feature", id=program.id_program)
             feature["properties"] = program.as_dict(True)
             features.append(feature)
         feature_collection = FeatureCollection(features)
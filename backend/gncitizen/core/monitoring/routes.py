@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Internal monitoring endpoints (not meant to be exposed publicly)"""
+
+from functools import wraps
+
+from flask import Blueprint, Response, current_app, request
+
+from gncitizen.utils.db_pool import get_pool_status
+from gncitizen.utils.metrics import generate_metrics, is_enabled as metrics_enabled
+from gncitizen.utils.profiling import route_histograms
+from gncitizen.utils.sqlalchemy import json_resp
+from gncitizen.utils.startup import import_times
+from server import db
+
+monitoring_api = Blueprint("monitoring", __name__)
+
+
+def internal_only(func):
+    """Restrict a view to ``MONITORING.ALLOWED_IPS``
+
+    Requests forwarded by a reverse proxy (``X-Forwarded-For`` header) are
+    refused unless the original client address is allowed too.
+
+    :param func: decorated function
+    :type func: func
+
+    :return: decorated function
+    :rtype: func
+    """
+
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        allowed_ips = current_app.config.get("MONITORING", {}).get(
+            "ALLOWED_IPS", ["127.0.0.1", "::1"]
+        )
+        forwarded_for = [
+            ip.strip()
+            for ip in request.headers.get("X-Forwarded-For", "").split(",")
+            if ip.strip()
+        ]
+        for ip in [request.remote_addr] + forwarded_for:
+            if ip not in allowed_ips:
+                current_app.logger.warning(
+                    "[internal_only] %s refused for %s", request.path, ip
+                )
+                return {"message": "Forbidden"}, 403
+        return func(*args, **kwargs)
+
+    return decorated_function
+
+
+@monitoring_api.route("/internal/metrics/db", methods=["GET"])
+@json_resp
+@internal_only
+def get_db_pool_metrics():
+    """Database connection pool metrics
+    ---
+    tags:
+      - Monitoring
+    responses:
+      200:
+        description: Pool size, checked out connections, overflow and wait times
+    """
+    return get_pool_status(db.engine), 200
+
+
+@monitoring_api.route("/internal/metrics/requests", methods=["GET"])
+@json_resp
+@internal_only
+def get_requests_metrics():
+    """Per route request duration histograms (ms), needs PROFILING.ENABLED
+    ---
+    tags:
+      - Monitoring
+    responses:
+      200:
+        description: Request count, durations, SQL and serialization times per route
+    """
+    return (
+        {
+            "enabled": current_app.config.get("PROFILING", {}).get("ENABLED", False),
+            "routes": route_histograms.as_dict(),
+        },
+        200,
+    )
+
+
+@monitoring_api.route("/internal/metrics/startup", methods=["GET"])
+@json_resp
+@internal_only
+def get_startup_metrics():
+    """Blueprint import times (ms) measured at startup
+    ---
+    tags:
+      - Monitoring
+    responses:
+      200:
+        description: Total and per module import times
+    """
+    return import_times.as_dict(), 200
+
+
+@monitoring_api.route("/metrics", methods=["GET"])
+@internal_only
+def get_prometheus_metrics():
+    """Prometheus metrics (text exposition format), needs METRICS.ENABLED
+    ---
+    tags:
+      - Monitoring
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Requests, latencies, caches, TaxHub, uploads and DB pool metrics
+    """
+    if not metrics_enabled():
+        return {"message": "Metrics are disabled"}, 404
+    data, content_type = generate_metrics()
+    return Response(data, content_type=content_type)
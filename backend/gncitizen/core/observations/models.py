@@ -22,7 +22,22 @@ class ObservationModel(ObserverMixinModel, TimestampMixinModel, db.Model):
     """Table des observations"""
 
     __tablename__ = "t_obstax"
-    __table_args__ = {"schema": "gnc_obstax"}
+    __table_args__ = (
+        db.Index(
+            "idx_t_obstax_id_program_timestamp_create", "id_program", "timestamp_create"
+        ),
+        db.Index(
+            "idx_t_obstax_id_role_timestamp_create", "id_role", "timestamp_create"
+        ),
+        db.Index("idx_t_obstax_cd_nom", "cd_nom"),
+        db.Index("idx_t_obstax_timestamp_create", "timestamp_create"),
+        db.Index(
+            "idx_t_obstax_id_program_timestamp_update", "id_program", "timestamp_update"
+        ),
+        {"schema": "gnc_obstax"},
+    )
+    # Partition keys, see [PARTITIONING] and gncitizen.utils.partitioning
+    __partitioning__ = {"program": "id_program", "year": "timestamp_create"}
     id_observation = db.Column(db.Integer, primary_key=True, unique=True)
     uuid_sinp = db.Column(UUID(as_uuid=True), nullable=False, unique=True)
     id_program = db.Column(
@@ -44,7 +59,11 @@ class ObservationMediaModel(TimestampMixinModel, db.Model):
     """Table de correspondances des médias (photos) avec les observations"""
 
     __tablename__ = "cor_obstax_media"
-    __table_args__ = {"schema": "gnc_obstax"}
+    __table_args__ = (
+        db.Index("idx_cor_obstax_media_id_data_source", "id_data_source"),
+        db.Index("idx_cor_obstax_media_id_media", "id_media"),
+        {"schema": "gnc_obstax"},
+    )
     id_match = db.Column(db.Integer, primary_key=True, unique=True)
     id_data_source = db.Column(
         db.Integer,
@@ -3,19 +3,20 @@
 
 
 import uuid
+from datetime import datetime
 from typing import Union, Tuple, Dict
 
 # from sqlalchemy import func
 
 # from datetime import datetime
-import requests
 from flask import Blueprint, current_app, request, json, send_from_directory
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from geojson import FeatureCollection
 from geoalchemy2.shape import from_shape
 from shapely.geometry import Point, asShape
-from sqlalchemy import desc
+from sqlalchemy import and_, desc, select
 from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from gncitizen.core.commons.models import MediaModel, ProgramsModel
 from gncitizen.core.ref_geo.models import LAreas
 from .models import ObservationMediaModel, ObservationModel
@@ -26,13 +27,25 @@ from gncitizen.core.taxonomy.models import Taxref, TMedias
 # DOING: TaxRef REST as alternative
 # from gncitizen.core.taxonomy.routes import get_list
 
-from gncitizen.utils.env import taxhub_lists_url, MEDIA_DIR
+from gncitizen.utils.env import MEDIA_DIR
 from gncitizen.utils.errors import GeonatureApiError
-from gncitizen.utils.jwt import get_id_role_if_exists
+from gncitizen.utils.jwt import get_current_user_claims
 from gncitizen.utils.geo import get_municipality_id_from_wkb  # , get_area_informations
 from gncitizen.utils.media import save_upload_files
-from gncitizen.utils.sqlalchemy import get_geojson_feature, json_resp
-from gncitizen.utils.taxonomy import get_specie_from_cd_nom, mkTaxonRepository
+from gncitizen.utils.partitioning import partition_clauses
+from gncitizen.utils.snapshots import UserSnapshots
+from gncitizen.utils.sqlalchemy import (
+    Projection,
+    get_geojson_feature,
+    get_page_args,
+    json_resp,
+    paginate,
+)
+from gncitizen.utils.taxonomy import (
+    get_list_cd_noms,
+    get_species_from_cd_noms,
+    mkTaxonRepository,
+)
 from server import db
 
 
@@ -53,6 +66,58 @@ obs_keys = (
     "json_data",
 )
 
+"""Observation columns selected by the listings (obs_keys, without relations)"""
+observation_projection = Projection(
+    {
+        key: getattr(ObservationModel, key)
+        for key in obs_keys
+        if key not in ("observer", "municipality")
+    },
+    geometry=ObservationModel.geom,
+)
+
+
+def observation_medias(*columns):
+    """Correlated subquery selecting ``columns`` of the observation medias
+
+    :return: select to aggregate or limit, then ``as_scalar()``
+    """
+    return select(columns).where(
+        and_(
+            ObservationMediaModel.id_data_source == ObservationModel.id_observation,
+            ObservationMediaModel.id_media == MediaModel.id_media,
+        )
+    )
+
+
+def paginate_observations(*criterion):
+    """Page of observations matching ``criterion``, most recent first
+
+    Taxonomy of the page is read in one query (``get_species_from_cd_noms``).
+
+    :param criterion: ObservationModel filters
+
+    :return: observations with pagination (page, per_page, has_next)
+    :rtype: FeatureCollection
+    """
+    observations, pagination = paginate(
+        db.session.query(*observation_projection.columns, ObservationModel.municipality)
+        .filter(*criterion)
+        .order_by(desc(ObservationModel.timestamp_create))
+    )
+    species = get_species_from_cd_noms(
+        observation.cd_nom for observation in observations
+    )
+    features = []
+    for observation in observations:
+        feature = observation_projection.feature(observation)
+        feature["properties"]["municipality"] = observation.municipality
+        feature["properties"].update(species.get(observation.cd_nom, {}))
+        features.append(feature)
+    data = FeatureCollection(features)
+    data.update(pagination)
+    return data
+
 
 def generate_observation_geojson(id_observation):
     """generate observation in geojson format from observation id
@@ -281,12 +346,11 @@ def post_observation():
             current_app.logger.warning("[post_observation] json_data ", e)
             raise GeonatureApiError(e)
 
-        id_role = get_id_role_if_exists()
-        if id_role:
-            newobs.id_role = id_role
-            role = UserModel.query.get(id_role)
-            newobs.obs_txt = role.username
-            newobs.email = role.email
+        user = get_current_user_claims()
+        if user is not None:
+            newobs.id_role = user["id_user"]
+            newobs.obs_txt = user["username"]
+            newobs.email = user["email"]
         else:
             if newobs.obs_txt is None or len(newobs.obs_txt) == 0:
                 newobs.obs_txt = "Anonyme"
@@ -295,6 +359,7 @@ def post_observation():
         newobs.uuid_sinp = uuid.uuid4()
         db.session.add(newobs)
         db.session.commit()
+        user_observations.invalidate(newobs.id_role)
         current_app.logger.debug(newobs.as_dict())
         # Réponse en retour
         features = generate_observation_geojson(newobs.id_observation)
@@ -329,10 +394,36 @@ def post_observation():
 @obstax_api.route("/observations", methods=["GET"])
 @json_resp
 def get_observations():
-    """Get all observations
+    """Get observations, most recent first, by pages
         ---
         tags:
           - observations
+        parameters:
+          - name: page
+            in: query
+            type: integer
+            default: 1
+          - name: per_page
+            in: query
+            type: integer
+          - name: id_program
+            in: query
+            type: integer
+          - name: cd_nom
+            in: query
+            type: integer
+            description: taxref id, repeatable
+          - name: id_role
+            in: query
+            type: integer
+          - name: date_min
+            in: query
+            type: string
+            example: 2021-01-31
+          - name: date_max
+            in: query
+            type: string
+            example: 2021-12-31
         definitions:
           cd_nom:
             type: integer
@@ -346,25 +437,26 @@ def get_observations():
             type: geometry
         responses:
           200:
-            description: A list of all observations
+            description: A page of observations
         """
     try:
-        observations = ObservationModel.query.order_by(
-            desc(ObservationModel.timestamp_create)
-        ).all()
-        features = []
-        for observation in observations:
-            feature = get_geojson_feature(observation.geom)
-            observation_dict = observation.as_dict(True)
-            for k in observation_dict:
-                if k in obs_keys:
-                    feature["properties"][k] = observation_dict[k]
-
-            taxref = get_specie_from_cd_nom(feature["properties"]["cd_nom"])
-            for k in taxref:
-                feature["properties"][k] = taxref[k]
-            features.append(feature)
-        return FeatureCollection(features)
+        filters = []
+        if "id_program" in request.args:
+            filters.append(
+                ObservationModel.id_program == request.args.get("id_program", type=int)
+            )
+        cd_noms = request.args.getlist("cd_nom", type=int)
+        if cd_noms:
+            filters.append(ObservationModel.cd_nom.in_(cd_noms))
+        if "id_role" in request.args:
+            filters.append(
+                ObservationModel.id_role == request.args.get("id_role", type=int)
+            )
+        for arg, operator in (("date_min", "__ge__"), ("date_max", "__le__")):
+            if arg in request.args:
+                value = datetime.strptime(request.args[arg], "%Y-%m-%d").date()
+                filters.append(getattr(ObservationModel.date, operator)(value))
+        return paginate_observations(*filters)
     except Exception as e:
         current_app.logger.critical("[get_observations] Error: %s", str(e))
         return {"message": str(e)}, 400
@@ -373,7 +465,7 @@ def get_observations():
 @obstax_api.route("/observations/lists/<int:id>", methods=["GET"])
 @json_resp
 def get_observations_from_list(id):  # noqa: A002
-    """Get all observations from a taxonomy list
+    """Get observations of the taxa of a taxonomy list, by pages
     GET
         ---
         tags:
@@ -384,6 +476,13 @@ def get_observations_from_list(id):  # noqa: A002
             type: integer
             required: true
             example: 1
+          - name: page
+            in: query
+            type: integer
+            default: 1
+          - name: per_page
+            in: query
+            type: integer
         definitions:
           cd_nom:
             type: integer
@@ -399,37 +498,11 @@ def get_observations_from_list(id):  # noqa: A002
           200:
             description: A list of all species lists
         """
-    # taxhub_url = load_config()['TAXHUB_API_URL']
-    taxhub_lists_taxa_url = taxhub_lists_url + "taxons/" + str(id)
-    rtaxa = requests.get(taxhub_lists_taxa_url)
-    if rtaxa.status_code == 200:
-        try:
-            taxa = rtaxa.json()["items"]
-            current_app.logger.debug(taxa)
-            features = []
-            for t in taxa:
-                current_app.logger.debug("R", t["cd_nom"])
-                datas = (
-                    ObservationModel.query.filter_by(cd_nom=t["cd_nom"])
-                    .order_by(desc(ObservationModel.timestamp_create))
-                    .all()
-                )
-                for d in datas:
-                    feature = get_geojson_feature(d.geom)
-                    observation_dict = d.as_dict(True)
-                    for k in observation_dict:
-                        if k in obs_keys:
-                            feature["properties"][k] = observation_dict[k]
-                    taxref = get_specie_from_cd_nom(feature["properties"]["cd_nom"])
-                    for k in taxref:
-                        feature["properties"][k] = taxref[k]
-                    features.append(feature)
-            return FeatureCollection(features)
-        except Exception as e:
-            current_app.logger.critical(
-                "[get_observations_from_list] Error: %s", str(e)
-            )
-            return {"message": str(e)}, 400
+    try:
+        return paginate_observations(ObservationModel.cd_nom.in_(get_list_cd_noms(id)))
+    except Exception as e:
+        current_app.logger.critical("[get_observations_from_list] Error: %s", str(e))
+        return {"message": str(e)}, 400
 
 
 @obstax_api.route("/programs/<int:program_id>/observations", methods=["GET"])
@@ -466,13 +539,17 @@ def get_program_observations(
     try:
         observations = (
             db.session.query(
-                ObservationModel,
+                *observation_projection.columns,
                 UserModel.username,
                 UserModel.avatar,
-                func.array_agg(MediaModel.filename).label("images"),
+                observation_medias(MediaModel.filename)
+                .limit(1)
+                .as_scalar()
+                .label("image"),
                 LAreas.area_name,
                 LAreas.area_code,
             )
+            .select_from(ObservationModel)
             .filter(ObservationModel.id_program == program_id, ProgramsModel.is_active)
             .join(LAreas, LAreas.id_area == ObservationModel.municipality, isouter=True)
             .join(
@@ -480,24 +557,7 @@ def get_program_observations(
                 ProgramsModel.id_program == ObservationModel.id_program,
                 isouter=True,
             )
-            .join(
-                ObservationMediaModel,
-                ObservationMediaModel.id_data_source == ObservationModel.id_observation,
-                isouter=True,
-            )
-            .join(
-                MediaModel,
-                ObservationMediaModel.id_media == MediaModel.id_media,
-                isouter=True,
-            )
             .join(UserModel, ObservationModel.id_role == UserModel.id_user, full=True)
-            .group_by(
-                ObservationModel.id_observation,
-                UserModel.username,
-                UserModel.avatar,
-                LAreas.area_name,
-                LAreas.area_code,
-            )
         )
 
         observations = observations.order_by(desc(ObservationModel.timestamp_create))
@@ -511,7 +571,8 @@ def get_program_observations(
 
         features = []
         for observation in observations:
-            feature = get_geojson_feature(observation.ObservationModel.geom)
+            feature = observation_projection.feature(observation)
+            # Municipality
             feature["properties"]["municipality"] = {
                 "name": observation.area_name,
                 "code": observation.area_code,
@@ -526,28 +587,22 @@ def get_program_observations(
             # Observer submitted media
             feature["properties"]["image"] = (
                 "/".join(
-                    ["/api", current_app.config["MEDIA_FOLDER"], observation.images[0]]
+                    ["/api", current_app.config["MEDIA_FOLDER"], observation.image]
                 )
-                if observation.images and observation.images != [None]
+                if observation.image
                 else None
             )
 
-            # Municipality
-            observation_dict = observation.ObservationModel.as_dict(True)
-            for k in observation_dict:
-                if k in obs_keys and k != "municipality":
-                    feature["properties"][k] = observation_dict[k]
-
             # TaxRef
             if current_app.config.get("API_TAXHUB") is None:
                 taxref = Taxref.query.filter(
-                    Taxref.cd_nom == observation.ObservationModel.cd_nom
+                    Taxref.cd_nom == feature["properties"]["cd_nom"]
                 ).first()
                 if taxref:
                     feature["properties"]["taxref"] = taxref.as_dict(True)
 
                 medias = TMedias.query.filter(
-                    TMedias.cd_ref == observation.ObservationModel.cd_nom
+                    TMedias.cd_ref == feature["properties"]["cd_nom"]
                 ).all()
                 if medias:
                     feature["properties"]["medias"] = [
@@ -600,12 +655,16 @@ def get_all_observations() -> Union[FeatureCollection, Tuple[Dict, int]]:
     try:
         observations = (
             db.session.query(
-                ObservationModel,
+                *observation_projection.columns,
                 UserModel.username,
-                MediaModel.filename.label("image"),
+                observation_medias(MediaModel.filename)
+                .limit(1)
+                .as_scalar()
+                .label("image"),
                 LAreas.area_name,
                 LAreas.area_code,
             )
+            .select_from(ObservationModel)
             .filter(ProgramsModel.is_active)
             .join(LAreas, LAreas.id_area == ObservationModel.municipality, isouter=True)
             .join(
@@ -613,16 +672,6 @@ def get_all_observations() -> Union[FeatureCollection, Tuple[Dict, int]]:
                 ProgramsModel.id_program == ObservationModel.id_program,
                 isouter=True,
             )
-            .join(
-                ObservationMediaModel,
-                ObservationMediaModel.id_data_source == ObservationModel.id_observation,
-                isouter=True,
-            )
-            .join(
-                MediaModel,
-                ObservationMediaModel.id_media == MediaModel.id_media,
-                isouter=True,
-            )
             .join(UserModel, ObservationModel.id_role == UserModel.id_user, full=True)
         )
 
@@ -650,7 +699,8 @@ def get_all_observations() -> Union[FeatureCollection, Tuple[Dict, int]]:
 
         features = []
         for observation in observations:
-            feature = get_geojson_feature(observation.ObservationModel.geom)
+            feature = observation_projection.feature(observation)
+            # Municipality
             feature["properties"]["municipality"] = {
                 "name": observation.area_name,
                 "code": observation.area_code,
@@ -668,22 +718,16 @@ def get_all_observations() -> Union[FeatureCollection, Tuple[Dict, int]]:
                 else None
             )
 
-            # Municipality
-            observation_dict = observation.ObservationModel.as_dict(True)
-            for k in observation_dict:
-                if k in obs_keys and k != "municipality":
-                    feature["properties"][k] = observation_dict[k]
-
             # TaxRef
             if current_app.config.get("API_TAXHUB") is None:
                 taxref = Taxref.query.filter(
-                    Taxref.cd_nom == observation.ObservationModel.cd_nom
+                    Taxref.cd_nom == feature["properties"]["cd_nom"]
                 ).first()
                 if taxref:
                     feature["properties"]["taxref"] = taxref.as_dict(True)
 
                 medias = TMedias.query.filter(
-                    TMedias.cd_ref == observation.ObservationModel.cd_nom
+                    TMedias.cd_ref == feature["properties"]["cd_nom"]
                 ).all()
                 if medias:
                     feature["properties"]["medias"] = [
@@ -739,142 +783,180 @@ def get_rewards(id):
     )
 
 
-@obstax_api.route("/observations/users/<int:user_id>", methods=["GET"])
-@json_resp
-def get_observations_by_user_id(user_id):
-    try:
-        observations = (
-            db.session.query(
-                ObservationModel,
-                ProgramsModel,
-                UserModel.username,
-                func.json_agg(
-                    func.json_build_array(MediaModel.filename, MediaModel.id_media)
-                ).label("images"),
-                LAreas.area_name,
-                LAreas.area_code,
-            )
-            .filter(ObservationModel.id_role == user_id)
-            .join(LAreas, LAreas.id_area == ObservationModel.municipality, isouter=True)
-            .join(
-                ProgramsModel,
-                ProgramsModel.id_program == ObservationModel.id_program,
-                isouter=True,
-                full=True,
-            )
-            .join(
-                ObservationMediaModel,
-                ObservationMediaModel.id_data_source == ObservationModel.id_observation,
-                isouter=True,
-            )
-            .join(
-                MediaModel,
-                ObservationMediaModel.id_media == MediaModel.id_media,
-                isouter=True,
-            )
-            .join(UserModel, ObservationModel.id_role == UserModel.id_user, full=True)
-            .group_by(
-                ObservationModel.id_observation,
-                ProgramsModel.id_program,
-                UserModel.username,
-                LAreas.area_name,
-                LAreas.area_code,
-            )
+"""Formatted observations of each user, for the dashboard"""
+user_observations = UserSnapshots("user_observations")
+
+
+def user_observations_fingerprint(user_id):
+    """State of the observations of a user, changed by any of their writes"""
+    return tuple(
+        db.session.query(
+            func.count(ObservationModel.id_observation),
+            func.sum(ObservationModel.id_observation),
+            func.max(ObservationModel.timestamp_update),
         )
+        .filter(ObservationModel.id_role == user_id)
+        .one()
+    )
 
-        observations = observations.order_by(desc(ObservationModel.timestamp_create))
-        # current_app.logger.debug(str(observations))
-        observations = observations.all()
 
-        try:
-            if current_app.config.get("API_TAXHUB") is not None:
-                taxon_repository = []
-                taxhub_list_id = []
-                for observation in observations:
-                    if observation.ProgramsModel.taxonomy_list not in taxhub_list_id:
-                        taxhub_list_id.append(observation.ProgramsModel.taxonomy_list)
-                for tax_list in taxhub_list_id:
-                    taxon_repository.append(mkTaxonRepository(tax_list))
-
-            features = []
-        except Exception as e:
-            return {"message": str(e)}, 500
+def get_taxa_by_cd_nom(cd_noms, taxonomy_lists):
+    """Taxonomy properties of the observed taxa
 
-        for observation in observations:
-            feature = get_geojson_feature(observation.ObservationModel.geom)
-            feature["properties"]["municipality"] = {
-                "name": observation.area_name,
-                "code": observation.area_code,
-            }
+    :param cd_noms: observed taxref ids
+    :type cd_noms: set
+    :param taxonomy_lists: taxonomy lists of the observation programs
+    :type taxonomy_lists: set
 
-            # Observer
-            feature["properties"]["observer"] = {"username": observation.username}
-            # Observer submitted media
-            feature["properties"]["image"] = (
-                "/".join(
-                    [
-                        "/api",
-                        current_app.config["MEDIA_FOLDER"],
-                        observation.images[0][0],
-                    ]
+    :return: taxref, medias (and nom_francais with TaxHub) by cd_nom
+    :rtype: dict
+    """
+    taxa = {}
+    if current_app.config.get("API_TAXHUB") is not None:
+        for taxonomy_list in taxonomy_lists:
+            if taxonomy_list is None:
+                continue
+            for taxon in mkTaxonRepository(taxonomy_list):
+                if taxon:
+                    taxa.setdefault(
+                        taxon["taxref"]["cd_nom"],
+                        {
+                            "nom_francais": taxon["nom_francais"],
+                            "taxref": taxon["taxref"],
+                            "medias": taxon["medias"],
+                        },
+                    )
+        return taxa
+    for taxref in Taxref.query.filter(Taxref.cd_nom.in_(cd_noms)):
+        taxa[taxref.cd_nom] = {"taxref": taxref.as_dict(True)}
+    for media in TMedias.query.filter(TMedias.cd_ref.in_(cd_noms)):
+        taxa.setdefault(media.cd_ref, {}).setdefault("medias", []).append(
+            media.as_dict(True)
+        )
+    return taxa
+
+
+def build_user_observations(user_id):
+    """Observations of a user as features, most recent first
+
+    :param user_id: user id
+    :type user_id: int
+
+    :return: features
+    :rtype: list
+    """
+    images = (
+        observation_medias(
+            func.json_agg(
+                aggregate_order_by(
+                    func.json_build_array(MediaModel.filename, MediaModel.id_media),
+                    MediaModel.id_media,
                 )
-                if observation.images and observation.images != [[None, None]]
-                else None
             )
-            # Photos
-            feature["properties"]["photos"] = [
-                {"url": "/media/{}".format(filename), "id_media": id_media}
-                for filename, id_media in observation.images
-                if id_media is not None
-            ]
-            # Municipality
-            observation_dict = observation.ObservationModel.as_dict(True)
-            for k in observation_dict:
-                if k in obs_keys and k != "municipality":
-                    feature["properties"][k] = observation_dict[k]
-            # Program
-            program_dict = observation.ProgramsModel.as_dict(True)
-            for program in program_dict:
-                if program == "title":
-                    feature["properties"]["program_title"] = program_dict[program]
-            # TaxRef
-            if current_app.config.get("API_TAXHUB") is None:
-                taxref = Taxref.query.filter(
-                    Taxref.cd_nom == observation.ObservationModel.cd_nom
-                ).first()
-                if taxref:
-                    feature["properties"]["taxref"] = taxref.as_dict(True)
+        )
+        .as_scalar()
+        .label("images")
+    )
+    observations = (
+        db.session.query(
+            *observation_projection.columns,
+            ProgramsModel.title.label("program_title"),
+            ProgramsModel.taxonomy_list,
+            UserModel.username,
+            images,
+            LAreas.area_name,
+            LAreas.area_code,
+        )
+        .select_from(ObservationModel)
+        .filter(ObservationModel.id_role == user_id)
+        .join(LAreas, LAreas.id_area == ObservationModel.municipality, isouter=True)
+        .join(
+            ProgramsModel,
+            ProgramsModel.id_program == ObservationModel.id_program,
+            isouter=True,
+        )
+        .join(UserModel, ObservationModel.id_role == UserModel.id_user, isouter=True)
+        .order_by(desc(ObservationModel.timestamp_create))
+        .all()
+    )
+    taxa = get_taxa_by_cd_nom(
+        {observation.cd_nom for observation in observations},
+        {observation.taxonomy_list for observation in observations},
+    )
 
-                medias = TMedias.query.filter(
-                    TMedias.cd_ref == observation.ObservationModel.cd_nom
-                ).all()
-                if medias:
-                    feature["properties"]["medias"] = [
-                        media.as_dict(True) for media in medias
-                    ]
-            else:
-                try:
-                    for taxon_rep in taxon_repository:
-                        for taxon in taxon_rep:
-                            if (
-                                taxon["taxref"]["cd_nom"]
-                                == observation.ObservationModel.cd_nom
-                            ):
-                                feature["properties"]["nom_francais"] = taxon[
-                                    "nom_francais"
-                                ]
-                                feature["properties"]["taxref"] = taxon["taxref"]
-                                feature["properties"]["medias"] = taxon["medias"]
+    features = []
+    for observation in observations:
+        feature = observation_projection.feature(observation)
+        # Municipality
+        feature["properties"]["municipality"] = {
+            "name": observation.area_name,
+            "code": observation.area_code,
+        }
+        # Observer
+        feature["properties"]["observer"] = {"username": observation.username}
+        # Observer submitted media
+        images = observation.images or []
+        feature["properties"]["image"] = (
+            "/".join(["/api", current_app.config["MEDIA_FOLDER"], images[0][0]])
+            if images
+            else None
+        )
+        # Photos
+        feature["properties"]["photos"] = [
+            {"url": "/media/{}".format(filename), "id_media": id_media}
+            for filename, id_media in images
+        ]
+        # Program
+        feature["properties"]["program_title"] = observation.program_title
+        # TaxRef
+        feature["properties"].update(taxa.get(observation.cd_nom, {}))
+        features.append(feature)
+    return features
 
-                except StopIteration:
-                    pass
-            features.append(feature)
 
-        return FeatureCollection(features), 200
+@obstax_api.route("/observations/users/<int:user_id>", methods=["GET"])
+@json_resp
+def get_observations_by_user_id(user_id):
+    """Get the observations of a user, for their dashboard
+    GET
+        ---
+        tags:
+          - observations
+        parameters:
+          - name: user_id
+            in: path
+            type: integer
+            required: true
+          - name: page
+            in: query
+            type: integer
+            description: all observations if not set
+          - name: per_page
+            in: query
+            type: integer
+        responses:
+          200:
+            description: Observations of the user, most recent first
+        """
+    try:
+        features = user_observations.get(
+            user_id,
+            user_observations_fingerprint(user_id),
+            lambda: build_user_observations(user_id),
+        )
+        if "page" not in request.args:
+            data = FeatureCollection(features)
+        else:
+            page, per_page = get_page_args()
+            data = FeatureCollection(features[(page - 1) * per_page : page * per_page])
+            data.update(
+                page=page, per_page=per_page, has_next=page * per_page < len(features)
+            )
+        data["count"] = len(features)
+        return data, 200
 
     except Exception as e:
-        raise e
-        current_app.logger.critical("[get_program_observations] Error: %s", str(e))
+        current_app.logger.critical("[get_observations_by_user_id] Error: %s", str(e))
         return {"message": str(e)}, 400
 
 
@@ -884,6 +966,12 @@ def get_observations_by_user_id(user_id):
 def update_observation():
     try:
         update_data = request.form
+        observation = ObservationModel.query.get(update_data.get("id_observation"))
+        if observation is None:
+            return {"message": "Observation not found"}, 404
+        claims = get_current_user_claims()
+        if claims is None or claims["id_user"] != observation.id_role:
+            return ("update unauthorized"), 403
         update_obs = {}
         for prop in ["cd_nom", "count", "comment", "date"]:
             update_obs[prop] = update_data[prop]
@@ -907,9 +995,10 @@ def update_observation():
             current_app.logger.warning("[update_observation] json_data ", e)
             raise GeonatureApiError(e)
 
-        ObservationModel.query.filter_by(
-            id_observation=update_data.get("id_observation")
-        ).update(update_obs, synchronize_session="fetch")
+        ObservationModel.query.filter(
+            ObservationModel.id_observation == observation.id_observation,
+            *partition_clauses(observation)
+        ).update(update_obs, synchronize_session="evaluate")
 
         try:
             # Delete selected existing media
@@ -946,6 +1035,7 @@ def update_observation():
             # raise GeonatureApiError(e)
 
         db.session.commit()
+        user_observations.invalidate(observation.id_role)
 
         return ("observation updated successfully"), 200
     except Exception as e:
@@ -966,8 +1056,12 @@ def delete_observation(idObs):
             .first()
         )
         if current_user == observation.UserModel.email:
-            ObservationModel.query.filter_by(id_observation=idObs).delete()
+            ObservationModel.query.filter(
+                ObservationModel.id_observation == idObs,
+                *partition_clauses(observation.ObservationModel)
+            ).delete()
             db.session.commit()
+            user_observations.invalidate(observation.ObservationModel.id_role)
             return ("observation deleted successfully"), 200
         else:
             return ("delete unauthorized"), 403
@@ -8,7 +8,10 @@ from server import db
 @geoserializable
 class LAreas(db.Model):
     __tablename__ = "l_areas"
-    __table_args__ = {"schema": "ref_geo"}
+    __table_args__ = (
+        db.Index("idx_l_areas_id_type_enable", "id_type", "enable"),
+        {"schema": "ref_geo"},
+    )
     id_area = db.Column(db.Integer, primary_key=True)
     id_type = db.Column(db.Integer, db.ForeignKey("ref_geo.bib_areas_types.id_type"))
     area_name = db.Column(db.Unicode)
@@ -25,7 +28,10 @@ class LAreas(db.Model):
 @geoserializable
 class BibAreasTypes(db.Model):
     __tablename__ = "bib_areas_types"
-    __table_args__ = {"schema": "ref_geo"}
+    __table_args__ = (
+        db.Index("idx_bib_areas_types_type_name", "type_name"),
+        {"schema": "ref_geo"},
+    )
     id_type = db.Column(db.Integer, primary_key=True)
     type_name = db.Column(db.Unicode)
     type_code = db.Column(db.Unicode)
@@ -5,6 +5,7 @@ from geojson import FeatureCollection, Feature
 
 from gncitizen.utils.env import db
 from gncitizen.utils.env import load_config
+from gncitizen.utils.geo import get_municipality_features
 from gncitizen.utils.sqlalchemy import json_resp, get_geojson_feature
 from .models import LAreas
 
@@ -32,19 +33,7 @@ def get_municipalities():
             description: A list of municipalities
         """
     try:
-        q = db.session.query(
-            LAreas.area_name,
-            LAreas.area_code,
-            func.ST_Transform(LAreas.geom, 4326).label("geom"),
-        ).filter(LAreas.enable, LAreas.id_type == 101)
-        datas = q.all()
-        features = []
-        for data in datas:
-            feature = get_geojson_feature(data.geom)
-            feature["properties"]["area_name"] = data.area_name
-            feature["properties"]["area_code"] = data.area_code
-            features.append(feature)
-        return FeatureCollection(features)
+        return FeatureCollection(list(get_municipality_features()))
     except Exception as e:
         return {"message": str(e)}, 400
 
@@ -52,7 +52,14 @@ class SiteModel(TimestampMixinModel, ObserverMixinModel, db.Model):
     """Table des sites"""
 
     __tablename__ = "t_sites"
-    __table_args__ = {"schema": "gnc_sites"}
+    __table_args__ = (
+        db.Index("idx_t_sites_id_program", "id_program"),
+        db.Index("idx_t_sites_id_role", "id_role"),
+        db.Index(
+            "idx_t_sites_id_program_timestamp_update", "id_program", "timestamp_update"
+        ),
+        {"schema": "gnc_sites"},
+    )
     id_site = db.Column(db.Integer, primary_key=True, unique=True)
     uuid_sinp = db.Column(UUID(as_uuid=True), nullable=False, unique=True)
     id_program = db.Column(
@@ -90,7 +97,14 @@ class VisitModel(TimestampMixinModel, ObserverMixinModel, db.Model):
     """Table des sessions de suivis des sites"""
 
     __tablename__ = "t_visit"
-    __table_args__ = {"schema": "gnc_sites"}
+    __table_args__ = (
+        db.Index("idx_t_visit_id_site_date", "id_site", "date"),
+        db.Index("idx_t_visit_id_role", "id_role"),
+        db.Index("idx_t_visit_timestamp_update", "timestamp_update"),
+        {"schema": "gnc_sites"},
+    )
+    # Partition keys, see [PARTITIONING] and gncitizen.utils.partitioning
+    __partitioning__ = {"year": "timestamp_create"}
     id_visit = db.Column(db.Integer, primary_key=True, unique=True)
     id_site = db.Column(
         db.Integer, db.ForeignKey(SiteModel.id_site, ondelete="CASCADE")
@@ -107,7 +121,11 @@ class MediaOnVisitModel(TimestampMixinModel, db.Model):
     """Table de correspondance des médias avec les visites de sites"""
 
     __tablename__ = "cor_visites_media"
-    __table_args__ = {"schema": "gnc_sites"}
+    __table_args__ = (
+        db.Index("idx_cor_visites_media_id_data_source", "id_data_source"),
+        db.Index("idx_cor_visites_media_id_media", "id_media"),
+        {"schema": "gnc_sites"},
+    )
     id_match = db.Column(db.Integer, primary_key=True, unique=True)
     id_data_source = db.Column(
         db.Integer,
@@ -125,7 +143,11 @@ class ObservationsOnSiteModel(TimestampMixinModel, db.Model):
     """Table de correspondance des observations avec les sites"""
 
     __tablename__ = "cor_sites_obstax"
-    __table_args__ = {"schema": "gnc_sites"}
+    __table_args__ = (
+        db.Index("idx_cor_sites_obstax_id_site", "id_site"),
+        db.Index("idx_cor_sites_obstax_id_obstax", "id_obstax"),
+        {"schema": "gnc_sites"},
+    )
     id_cor_site_obstax = db.Column(db.Integer, primary_key=True, unique=True)
     id_site = db.Column(
         db.Integer,
@@ -1,9 +1,9 @@
 from flask import Blueprint, request, current_app, make_response
-from sqlalchemy import or_
+from sqlalchemy import and_, exists, func, or_, select
 from .models import SiteModel, SiteTypeModel, VisitModel, MediaOnVisitModel
 from .admin import SiteTypeView
 from gncitizen.core.users.models import UserModel
-from gncitizen.core.commons.models import MediaModel
+from gncitizen.core.commons.models import MediaModel, ProgramsModel
 import uuid
 import datetime
 import json
@@ -13,10 +13,10 @@ from geojson import FeatureCollection
 from geoalchemy2.shape import from_shape
 from shapely.geometry import Point
 from shapely.geometry import asShape
-from gncitizen.utils.jwt import get_id_role_if_exists
+from gncitizen.utils.jwt import get_current_user_claims, get_id_role_if_exists
 from gncitizen.utils.media import save_upload_files
 from gncitizen.utils.errors import GeonatureApiError
-from gncitizen.utils.sqlalchemy import get_geojson_feature, json_resp
+from gncitizen.utils.sqlalchemy import Projection, get_geojson_feature, json_resp
 from gncitizen.utils.env import admin
 from server import db
 from flask_jwt_extended import jwt_required, get_jwt_identity
@@ -24,6 +24,28 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 
 sites_api = Blueprint("sites", __name__)
 
+"""Site columns selected by the listings, with type and program summaries"""
+site_projection = Projection(
+    dict(
+        {
+            column.key: getattr(SiteModel, column.key)
+            for column in SiteModel.__table__.columns
+            if column.key != "geom"
+        },
+        site_type={
+            "id_typesite": SiteTypeModel.id_typesite,
+            "category": SiteTypeModel.category,
+            "type": SiteTypeModel.type,
+            "pictogram": SiteTypeModel.pictogram,
+        },
+        program={
+            "id_program": ProgramsModel.id_program,
+            "title": ProgramsModel.title,
+        },
+    ),
+    geometry=SiteModel.geom,
+)
+
 
 @sites_api.route("/types", methods=["GET"])
 @json_resp
@@ -115,37 +137,88 @@ def get_site_photos(site_id):
     ]
 
 
-def format_site(site, dashboard=False):
+def format_site(site):
     feature = get_geojson_feature(site.geom)
     site_dict = site.as_dict(True)
     for k in site_dict:
         if k not in ("geom",):
             feature["properties"][k] = site_dict[k]
-    if dashboard:
-        # Site creator can delete it only if no visit have been added by others
-        feature["properties"]["creator_can_delete"] = (
-            site.id_role
-            and VisitModel.query.filter_by(id_site=site.id_site)
-            .filter(
-                or_(VisitModel.id_role != site.id_role, VisitModel.id_role.is_(None))
-            )
-            .count()
-            == 0
-        )
     return feature
 
 
-def prepare_sites(sites, dashboard=False):
-    count = len(sites)
+def prepare_sites(*criterion, dashboard=False):
+    """Sites matching ``criterion`` as a FeatureCollection
+
+    Sites are read as rows of ``site_projection`` with their first photo (and
+    whether their creator can delete them on the dashboard) in the same query.
+
+    :param criterion: SiteModel filters
+    :param dashboard: add ``creator_can_delete``
+    :type dashboard: bool
+
+    :return: sites
+    :rtype: FeatureCollection
+    """
+    photo = (
+        select(
+            [
+                func.json_build_object(
+                    "url",
+                    func.concat("/media/", MediaModel.filename),
+                    "date",
+                    VisitModel.date,
+                    "author",
+                    VisitModel.obs_txt,
+                )
+            ]
+        )
+        .where(
+            and_(
+                VisitModel.id_site == SiteModel.id_site,
+                MediaOnVisitModel.id_data_source == VisitModel.id_visit,
+                MediaModel.id_media == MediaOnVisitModel.id_media,
+            )
+        )
+        .limit(1)
+        .as_scalar()
+        .label("photo")
+    )
+    columns = [*site_projection.columns, photo]
+    if dashboard:
+        # Site creator can delete it only if no visit have been added by others
+        columns.append(
+            and_(
+                SiteModel.id_role.isnot(None),
+                ~exists().where(
+                    and_(
+                        VisitModel.id_site == SiteModel.id_site,
+                        or_(
+                            VisitModel.id_role != SiteModel.id_role,
+                            VisitModel.id_role.is_(None),
+                        ),
+                    )
+                ),
+            ).label("creator_can_delete")
+        )
+    sites = (
+        db.session.query(*columns)
+        .select_from(SiteModel)
+        .join(SiteTypeModel, SiteTypeModel.id_typesite == SiteModel.id_type)
+        .join(ProgramsModel, ProgramsModel.id_program == SiteModel.id_program)
+        .filter(*criterion)
+        .order_by(SiteModel.timestamp_create.desc())
+        .all()
+    )
     features = []
     for site in sites:
-        formatted = format_site(site, dashboard)
-        photos = get_site_photos(site.id_site)
-        if len(photos) > 0:
-            formatted["properties"]["photo"] = photos[0]
-        features.append(formatted)
+        feature = site_projection.feature(site)
+        if site.photo is not None:
+            feature["properties"]["photo"] = site.photo
+        if dashboard:
+            feature["properties"]["creator_can_delete"] = site.creator_can_delete
+        features.append(feature)
     data = FeatureCollection(features)
-    data["count"] = count
+    data["count"] = len(features)
     return data
 
 
@@ -169,8 +242,7 @@ def get_sites():
         description: List of all sites
     """
     try:
-        sites = SiteModel.query.all()
-        return prepare_sites(sites)
+        return prepare_sites()
     except Exception as e:
         return {"error_message": str(e)}, 400
 
@@ -195,15 +267,25 @@ def get_program_sites(id):
         description: List of all sites
     """
     try:
-        sites = SiteModel.query.filter_by(id_program=id).all()
-        return prepare_sites(sites)
+        return prepare_sites(SiteModel.id_program == id)
     except Exception as e:
         return {"error_message": str(e)}, 400
 
 
+def _user_sites_filter(user_id):
+    """Sites created or visited by the user"""
+    return or_(
+        SiteModel.id_role == user_id,
+        SiteModel.id_site.in_(
+            select([VisitModel.id_site]).where(VisitModel.id_role == user_id)
+        ),
+    )
+
+
 def _get_user_sites(user_id):
     created_sites = (
-        SiteModel.query.filter_by(id_role=user_id)
+        SiteModel.query.options(*SiteModel.as_dict_options(True))
+        .filter_by(id_role=user_id)
         .order_by(SiteModel.timestamp_create.desc())
         .all()
     )
@@ -223,7 +305,7 @@ def _get_user_sites(user_id):
 @json_resp
 def get_user_sites(user_id):
     try:
-        return prepare_sites(_get_user_sites(user_id), dashboard=True)
+        return prepare_sites(_user_sites_filter(user_id), dashboard=True)
     except Exception as e:
         return {"error_message": str(e)}, 400
 
@@ -293,12 +375,11 @@ def post_site():
             current_app.logger.debug(e)
             raise GeonatureApiError(e)
 
-        id_role = get_id_role_if_exists()
-        if id_role is not None:
-            newsite.id_role = id_role
-            role = UserModel.query.get(id_role)
-            newsite.obs_txt = role.username
-            newsite.email = role.email
+        user = get_current_user_claims()
+        if user is not None:
+            newsite.id_role = user["id_user"]
+            newsite.obs_txt = user["username"]
+            newsite.email = user["email"]
         else:
             if newsite.obs_txt is None or len(newsite.obs_txt) == 0:
                 newsite.obs_txt = "Anonyme"
@@ -320,7 +401,6 @@ def post_site():
 @jwt_required()
 def update_site():
     try:
-        current_user = get_jwt_identity()
         update_data = dict(request.get_json())
         update_site = {}
         for prop in ["name", "id_type"]:
@@ -333,7 +413,7 @@ def update_site():
             raise GeonatureApiError(e)
 
         site = SiteModel.query.filter_by(id_site=update_data.get("id_site"))
-        if current_user != UserModel.query.get(site.first().id_role).email:
+        if site.first().id_role != get_id_role_if_exists():
             return ("unauthorized"), 403
         site.update(update_site, synchronize_session="fetch")
         db.session.commit()
@@ -354,12 +434,11 @@ def post_visit(site_id):
             id_site=site_id, date=request_data["date"], json_data=request_data["data"]
         )
 
-        id_role = get_id_role_if_exists()
-        if id_role is not None:
-            new_visit.id_role = id_role
-            role = UserModel.query.get(id_role)
-            new_visit.obs_txt = role.username
-            new_visit.email = role.email
+        user = get_current_user_claims()
+        if user is not None:
+            new_visit.id_role = user["id_user"]
+            new_visit.obs_txt = user["username"]
+            new_visit.email = user["email"]
         else:
             if new_visit.obs_txt is None or len(new_visit.obs_txt) == 0:
                 new_visit.obs_txt = "Anonyme"
@@ -418,9 +497,8 @@ def delete_site(site_id):
 @sites_api.route("/export/<int:user_id>", methods=["GET"])
 @jwt_required()
 def export_sites_xls(user_id):
-    current_user = get_jwt_identity()
     try:
-        if current_user != UserModel.query.get(user_id).email:
+        if user_id != get_id_role_if_exists():
             return ("unauthorized"), 403
         title_style = xlwt.easyxf("font: bold on")
         date_style = xlwt.easyxf(num_format_str="D/M/YY")
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Delta-sync API of the offline (mobile, field) clients
+
+``GET /programs/<id>/changes?since=<version>`` returns the observations,
+sites and visits of a program created or updated after ``version``, and the
+ids of those deleted since (read from ``gnc_core.t_deletions``, filled by
+trigger). The response ``version`` is the token of the next call.
+
+Clients upsert the returned rows by id then remove the deleted ones (and the
+visits of deleted sites). A call without ``since``, or with a version older
+than ``[SYNC] RETENTION_DAYS``, returns all the rows of the program with
+``reset: true``: the client replaces its local copy.
+
+Changes are read from ``since - [SYNC] OVERLAP`` seconds, so that rows
+committed late or stamped by a worker with a slightly late clock are not
+missed; a few rows may be sent twice.
+"""
+
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, current_app, request
+from flask.cli import with_appcontext
+from geojson import FeatureCollection
+from sqlalchemy import func
+
+from gncitizen.core.commons.models import DeletionModel
+from gncitizen.core.observations.models import ObservationModel
+from gncitizen.core.observations.routes import observation_projection
+from gncitizen.core.sites.models import SiteModel, VisitModel
+from gncitizen.core.sites.routes import prepare_sites
+from gncitizen.utils.sqlalchemy import Projection, json_resp
+from server import db
+
+sync_api = Blueprint("sync", __name__)
+
+DEFAULT_SYNC_CONFIG = {"OVERLAP": 60, "RETENTION_DAYS": 90}
+
+VERSION_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+"""Keys of the deleted ids by entity of the deletion log"""
+DELETED_KEYS = {"observation": "observations", "site": "sites", "visit": "visits"}
+
+visit_projection = Projection(
+    {
+        column.key: getattr(VisitModel, column.key)
+        for column in VisitModel.__table__.columns
+    }
+)
+
+
+def get_sync_config():
+    conf = dict(DEFAULT_SYNC_CONFIG)
+    conf.update(current_app.config.get("SYNC", {}))
+    return conf
+
+
+@sync_api.route("/programs/<int:program_id>/changes", methods=["GET"])
+@json_resp
+def get_program_changes(program_id):
+    """Changes of a program since a version, for offline clients
+    ---
+    tags:
+      - Sync
+    parameters:
+      - name: program_id
+        in: path
+        type: integer
+        required: true
+        example: 1
+      - name: since
+        in: query
+        type: string
+        description: version returned by the previous call, all rows if not set
+    responses:
+      200:
+        description: Rows changed and ids deleted since the version
+    """
+    conf = get_sync_config()
+    # Database clock, the deletion log is stamped by the database
+    version = db.session.query(func.timezone("utc", func.now())).scalar()
+    try:
+        since = (
+            datetime.strptime(request.args["since"], VERSION_FORMAT)
+            if request.args.get("since")
+            else None
+        )
+    except ValueError:
+        return {"message": "Invalid version"}, 400
+    reset = since is None or since < version - timedelta(days=conf["RETENTION_DAYS"])
+    if not reset:
+        since -= timedelta(seconds=conf["OVERLAP"])
+
+    def changed(model):
+        return [] if reset else [model.timestamp_update > since]
+
+    try:
+        observations = (
+            db.session.query(
+                *observation_projection.columns, ObservationModel.municipality
+            )
+            .filter(
+                ObservationModel.id_program == program_id, *changed(ObservationModel)
+            )
+            .order_by(ObservationModel.timestamp_update)
+        )
+        observation_features = []
+        for observation in observations:
+            feature = observation_projection.feature(observation)
+            feature["properties"]["municipality"] = observation.municipality
+            observation_features.append(feature)
+
+        visits = (
+            db.session.query(*visit_projection.columns)
+            .join(SiteModel, SiteModel.id_site == VisitModel.id_site)
+            .filter(SiteModel.id_program == program_id, *changed(VisitModel))
+            .order_by(VisitModel.timestamp_update)
+        )
+
+        deleted = {key: [] for key in DELETED_KEYS.values()}
+        if not reset:
+            deletions = db.session.query(
+                DeletionModel.entity, DeletionModel.id_entity
+            ).filter(
+                DeletionModel.id_program == program_id,
+                DeletionModel.timestamp_delete > since,
+            )
+            for entity, id_entity in deletions:
+                deleted[DELETED_KEYS[entity]].append(id_entity)
+
+        return (
+            {
+                "version": version.strftime(VERSION_FORMAT),
+                "reset": reset,
+                "observations": FeatureCollection(observation_features),
+                "sites": prepare_sites(
+                    SiteModel.id_program == program_id, *changed(SiteModel)
+                ),
+                "visits": [visit_projection.properties(visit) for visit in visits],
+                "deleted": deleted,
+            },
+            200,
+        )
+    except Exception as e:
+        current_app.logger.critical("[get_program_changes] Error: %s", str(e))
+        return {"message": str(e)}, 400
+
+
+def purge_deletions(retention_days):
+    """Delete the deletion log entries older than ``retention_days``
+
+    Clients with an older version get all the rows (``reset``) instead.
+
+    :return: purged entries
+    :rtype: int
+    """
+    count = DeletionModel.query.filter(
+        DeletionModel.timestamp_delete
+        < datetime.utcnow() - timedelta(days=retention_days)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+@click.command("sync-purge")
+@with_appcontext
+def sync_purge_command():
+    """Purge deletion log entries older than SYNC.RETENTION_DAYS"""
+    count = purge_deletions(get_sync_config()["RETENTION_DAYS"])
+    click.echo("{} deletion log entries purged".format(count))
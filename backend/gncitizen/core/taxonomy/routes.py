@@ -2,19 +2,11 @@
 from flask import Blueprint, current_app
 
 # from gncitizen.utils.env import taxhub_lists_url
-from gncitizen.utils.env import db
 from gncitizen.utils.sqlalchemy import json_resp
+from gncitizen.utils.taxonomy import get_taxon_list
 
 if current_app.config.get("API_TAXHUB") is None:
-    from gncitizen.core.taxonomy.models import (
-        BibNoms,
-        BibListes,
-        CorNomListe,
-        TMedias,
-        Taxref,
-    )
-else:
-    from gncitizen.utils.taxonomy import mkTaxonRepository
+    from gncitizen.core.taxonomy.models import BibListes, Taxref
 
 
 taxo_api = Blueprint("taxonomy", __name__)
@@ -91,30 +83,12 @@ def get_list(id):
 
     if current_app.config.get("API_TAXHUB") is not None:
         current_app.logger.info("Calling TaxHub REST API.")
-        return mkTaxonRepository(id)
+        return get_taxon_list(id)
 
     else:
         current_app.logger.info("Select TaxHub schema.")
         try:
-            data = (
-                db.session.query(BibNoms, Taxref, TMedias)
-                .distinct(BibNoms.cd_ref)
-                .join(CorNomListe, CorNomListe.id_nom == BibNoms.id_nom)
-                .join(Taxref, Taxref.cd_ref == BibNoms.cd_ref)
-                .outerjoin(TMedias, TMedias.cd_ref == BibNoms.cd_ref)
-                .filter(CorNomListe.id_liste == id)
-                .all()
-            )
-            # current_app.logger.debug(
-            #     [{'nom': d[0], 'taxref': d[1]} for d in data])
-            return [
-                {
-                    "nom": d[0].as_dict(),
-                    "taxref": d[1].as_dict(),
-                    "medias": d[2].as_dict() if d[2] else None,
-                }
-                for d in data
-            ]
+            return get_taxon_list(id)
         except Exception as e:
             return {"message": str(e)}, 400
 
@@ -1,12 +1,11 @@
 #!/usr/bin/env python3
 
-from passlib.hash import pbkdf2_sha256 as sha256
-
 from gncitizen.core.commons.models import (
     TModules,
     ProgramsModel,
     TimestampMixinModel,
 )
+from gncitizen.utils.passwords import hash_password, verify_password
 from gncitizen.utils.sqlalchemy import serializable
 from server import db
 from sqlalchemy.ext.declarative import declared_attr
@@ -17,7 +16,9 @@ class RevokedTokenModel(db.Model):
     __table_args__ = {"schema": "gnc_core"}
 
     id = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String(120))
+    jti = db.Column(db.String(120), index=True)
+    # token expiration, the row can be purged afterwards
+    expires = db.Column(db.DateTime, index=True)
 
     def add(self):
         db.session.add(self)
@@ -80,11 +81,26 @@ class UserModel(TimestampMixinModel, db.Model):
 
     @staticmethod
     def generate_hash(password):
-        return sha256.hash(password)
+        return hash_password(password)
 
     @staticmethod
     def verify_hash(password, hash):
-        return sha256.verify(password, hash)
+        return verify_password(password, hash)[0]
+
+    def check_password(self, password):
+        """Verify the password, upgrading its hash if the scheme is deprecated
+
+        :param password: clear password
+        :type password: str
+
+        :return: True if the password is valid
+        :rtype: bool
+        """
+        valid, new_hash = verify_password(password, self.password)
+        if valid and new_hash:
+            self.password = new_hash
+            db.session.commit()
+        return valid
 
     @classmethod
     def find_by_username(cls, username):
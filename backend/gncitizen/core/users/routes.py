@@ -2,8 +2,6 @@ import flask
 import os
 from flask import request, Blueprint, current_app
 from flask_jwt_extended import (
-    create_access_token,
-    create_refresh_token,
     get_jwt,
     get_jwt_identity,
     jwt_required,
@@ -11,15 +9,22 @@ from flask_jwt_extended import (
 from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 from gncitizen.utils.mail_check import confirm_user_email, confirm_token
+from gncitizen.utils.mail_outbox import mail_sender, queue_mail
 from gncitizen.utils.errors import GeonatureApiError
 from gncitizen.utils.env import MEDIA_DIR
+from gncitizen.utils.media import save_avatar_file
+from gncitizen.utils.passwords import PasswordHashingBusy
 from gncitizen.utils.sqlalchemy import json_resp
 from server import db, jwt
 from gncitizen.core.observations.models import ObservationModel
-from .models import UserModel, RevokedTokenModel
-from gncitizen.utils.jwt import admin_required
+from .models import UserModel
+from gncitizen.utils.jwt import (
+    admin_required,
+    create_user_tokens,
+    get_current_user,
+    revoked_tokens,
+)
 import uuid
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import base64
@@ -132,8 +137,7 @@ def registration():
             else:
                 raise GeonatureApiError(e)
 
-        access_token = create_access_token(identity=newuser.username)
-        refresh_token = create_refresh_token(identity=newuser.username)
+        access_token, refresh_token = create_user_tokens(newuser)
 
         # save user avatar
         if "extention" in request_datas and "avatar" in request_datas:
@@ -210,9 +214,8 @@ def login():
                 {"message": "Votre compte n'a pas été activé"},
                 400,
             )
-        if UserModel.verify_hash(password, current_user.password):
-            access_token = create_access_token(identity=email)
-            refresh_token = create_refresh_token(identity=email)
+        if current_user.check_password(password):
+            access_token, refresh_token = create_user_tokens(current_user)
             return (
                 {
                     "message": """Connecté en tant que "{}".""".format(email),
@@ -226,6 +229,9 @@ def login():
             )
         else:
             return {"message": """Mauvaises informations d'identification"""}, 400
+    except PasswordHashingBusy:
+        current_app.logger.warning("[login] too many pending password hashes")
+        return {"message": "Service surchargé, veuillez réessayer"}, 503
     except Exception as e:
         return {"message": str(e)}, 400
 
@@ -261,10 +267,9 @@ def logout():
         description: user disconnected
 
     """
-    jti = get_jwt()["jti"]
+    token = get_jwt()
     try:
-        revoked_token = RevokedTokenModel(jti=jti)
-        revoked_token.add()
+        revoked_tokens.revoke(token["jti"], token.get("exp"))
         return {"msg": "Successfully logged out"}, 200
     except Exception:
         return {"message": "Something went wrong"}, 500
@@ -285,8 +290,11 @@ def token_refresh():
       200:
         description: list all logged users
     """
-    current_user = get_jwt_identity()
-    access_token = create_access_token(identity=current_user)
+    # Claims (admin...) are reloaded from the database
+    user = get_current_user()
+    if user is None:
+        return {"message": "Unknown user"}, 401
+    access_token, _refresh_token = create_user_tokens(user, refresh=False)
     return {"access_token": access_token}
 
 
@@ -345,35 +353,48 @@ def logged_user():
         if flask.request.method == "PATCH":
             is_admin = user.admin or False
             current_app.logger.debug("[logged_user] Update current user personnal data")
-            request_data = dict(request.get_json())
-            if "extention" in request_data and "avatar" in request_data:
-                extention = request_data["extention"]
-                imgdata = base64.b64decode(
-                    request_data["avatar"].replace(
-                        "data:image/" + extention + ";base64,", ""
-                    )
+            if request.mimetype == "multipart/form-data":
+                # avatar is streamed to media dir by UploadRequest
+                request_data = request.form.to_dict()
+                avatar_file = request.files.get("avatar")
+            else:
+                request_data = dict(request.get_json())
+                avatar_file = None
+            if avatar_file is not None or (
+                "extention" in request_data and "avatar" in request_data
+            ):
+                old_avatar = os.path.join(
+                    str(MEDIA_DIR), str(user.as_secured_dict(True)["avatar"])
                 )
-                filename = "avatar_" + user.username + "." + extention
-                request_data["avatar"] = filename
-                if os.path.exists(
-                    os.path.join(
-                        str(MEDIA_DIR), str(user.as_secured_dict(True)["avatar"])
-                    )
-                ):
-                    os.remove(
-                        os.path.join(
-                            str(MEDIA_DIR), str(user.as_secured_dict(True)["avatar"])
-                        )
-                    )
                 try:
-                    handler = open(os.path.join(str(MEDIA_DIR), str(filename)), "wb+")
-                    handler.write(imgdata)
-                    handler.close()
+                    if avatar_file is not None:
+                        filename = save_avatar_file(avatar_file, user.username)
+                    else:
+                        # Legacy base64 JSON payload
+                        extention = request_data["extention"]
+                        imgdata = base64.b64decode(
+                            request_data["avatar"].replace(
+                                "data:image/" + extention + ";base64,", ""
+                            )
+                        )
+                        filename = "avatar_" + user.username + "." + extention
+                        handler = open(
+                            os.path.join(str(MEDIA_DIR), str(filename)), "wb+"
+                        )
+                        handler.write(imgdata)
+                        handler.close()
+                except GeonatureApiError as e:
+                    return ({"message": e.message}, e.status_code)
                 except Exception as e:
                     return (
-                        {"message": e},
+                        {"message": str(e)},
                         500,
                     )
+                request_data["avatar"] = filename
+                if os.path.exists(old_avatar) and old_avatar != os.path.join(
+                    str(MEDIA_DIR), filename
+                ):
+                    os.remove(old_avatar)
 
             for data in request_data:
                 if hasattr(UserModel, data) and data not in {
@@ -497,20 +518,12 @@ def reset_user_password():
     msg.attach(part2)
 
     try:
-        with smtplib.SMTP_SSL(
-            current_app.config["MAIL"]["MAIL_HOST"],
-            int(current_app.config["MAIL"]["MAIL_PORT"]),
-        ) as server:
-            server.login(
-                str(current_app.config["MAIL"]["MAIL_AUTH_LOGIN"]),
-                str(current_app.config["MAIL"]["MAIL_AUTH_PASSWD"]),
-            )
-            server.sendmail(
-                current_app.config["MAIL"]["MAIL_FROM"], user.email, msg.as_string()
-            )
-            server.quit()
+        # The new password and its email are committed together, the email
+        # is delivered by the outbox sender
+        queue_mail(msg, current_app.config["RESET_PASSWD"]["FROM"], user.email)
         user.password = passwd_hash
         db.session.commit()
+        mail_sender.notify()
         return (
             {"message": "Check your email, you credentials have been updated."},
             200,
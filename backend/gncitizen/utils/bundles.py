@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to build the offline bundles of programs
+
+A bundle is a zip archive with what a client needs to work offline on a
+program, instead of one call per resource and taxon media:
+
+    * ``program.json``: program feature (as ``GET /programs/<id>``)
+    * ``customform.json``: custom form of the program (null if none)
+    * ``species.json``: taxa of the program list
+      (as ``GET /taxonomy/lists/<id>/species``)
+    * ``thumbnails/<id_media>.<ext>``: thumbnails of the taxon medias,
+      generated by TaxHub
+    * ``manifest.json``: version, build date and thumbnail of each media id
+
+Bundles are stored in ``MEDIA_FOLDER/bundles``, named after the digest of
+their inputs (``program_<id>_<digest>.zip``): a bundle is rebuilt only when
+the program, its form or its taxa change. ``GET /programs/<id>/bundle``
+redirects to the current bundle (``/media/bundles/...``), served as an
+immutable media. Bundles are built by ``flask bundle-build`` (cron) and,
+with ``[BUNDLES] BACKGROUND``, by a background thread started by the first
+request after a change (``202`` until it is built).
+
+A bundle is only stored when all its thumbnails were downloaded, a build
+failing on TaxHub is retried by the next request or command.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from datetime import datetime
+
+import click
+import requests
+from flask import current_app
+from flask.cli import with_appcontext
+
+from gncitizen.core.commons.models import CustomFormModel, ProgramsModel
+from gncitizen.utils.encoder import default
+from gncitizen.utils.env import MEDIA_DIR, db, taxhub_url
+from gncitizen.utils.media import MEDIA_DIGEST_LENGTH
+from gncitizen.utils.taxonomy import get_taxon_list, timed_taxhub_call
+
+logger = logging.getLogger(__name__)
+
+BUNDLES_FOLDER = "bundles"
+
+DEFAULT_BUNDLES_CONFIG = {
+    "THUMBNAIL_HEIGHT": 100,
+    "THUMBNAIL_WIDTH": 100,
+    "TAXHUB_TIMEOUT": 10,
+    "BACKGROUND": True,
+}
+
+THUMBNAIL_EXTENSIONS = {"image/png": ".png", "image/webp": ".webp"}
+
+
+"""Programs whose bundle is being built by this process"""
+_building = set()
+_building_lock = threading.Lock()
+
+
+def get_bundles_config(app=None):
+    conf = dict(DEFAULT_BUNDLES_CONFIG)
+    conf.update((app or current_app).config.get("BUNDLES", {}))
+    return conf
+
+
+def to_json(data):
+    return json.dumps(data, default=default, sort_keys=True).encode("utf-8")
+
+
+def get_bundle_inputs(program):
+    """Program feature, custom form and taxa of a program
+
+    :param program: program
+    :type program: ProgramsModel
+
+    :return: bundle JSON documents by name
+    :rtype: dict
+    """
+    from gncitizen.core.commons.routes import get_program_feature
+
+    form = (
+        CustomFormModel.query.get(program.id_form)
+        if program.id_form is not None
+        else None
+    )
+    return {
+        "program": get_program_feature(program),
+        "customform": form.as_dict(True) if form is not None else None,
+        "species": (
+            get_taxon_list(program.taxonomy_list)
+            if program.taxonomy_list is not None
+            else []
+        ),
+    }
+
+
+def get_media_ids(species):
+    """Ids of the medias of the taxa, in list order"""
+    ids = []
+    for taxon in species:
+        medias = taxon.get("medias") or []
+        if isinstance(medias, dict):
+            medias = [medias]
+        for media in medias:
+            if media.get("id_media") is not None and media["id_media"] not in ids:
+                ids.append(media["id_media"])
+    return ids
+
+
+@timed_taxhub_call
+def fetch_thumbnail(id_media, conf):
+    """Download the thumbnail of a taxon media from TaxHub
+
+    :return: file extension and content
+    :rtype: tuple
+    """
+    res = requests.get(
+        "{}tmedias/thumbnail/{}".format(taxhub_url, id_media),
+        params={"h": conf["THUMBNAIL_HEIGHT"], "w": conf["THUMBNAIL_WIDTH"]},
+        timeout=conf["TAXHUB_TIMEOUT"],
+    )
+    res.raise_for_status()
+    content_type = res.headers.get("Content-Type", "").split(";")[0].strip()
+    return THUMBNAIL_EXTENSIONS.get(content_type, ".jpg"), res.content
+
+
+def get_bundle_filename(id_program, version):
+    """Bundle path relative to the media dir"""
+    return "{}/program_{}_{}.zip".format(
+        BUNDLES_FOLDER, id_program, version[:MEDIA_DIGEST_LENGTH]
+    )
+
+
+def write_bundle(path, version, documents):
+    """Write the bundle archive, replacing ``path`` atomically"""
+    conf = get_bundles_config()
+    manifest = {
+        "version": version,
+        "built_at": datetime.utcnow().isoformat(),
+        "thumbnails": {},
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(
+            f, "w", zipfile.ZIP_DEFLATED
+        ) as archive:
+            for name, content in documents.items():
+                archive.writestr("{}.json".format(name), content)
+            if taxhub_url != "/":
+                for id_media in get_media_ids(json.loads(documents["species"])):
+                    # A failure aborts the build: the version of an incomplete
+                    # bundle would not change once TaxHub is back
+                    ext, content = fetch_thumbnail(id_media, conf)
+                    name = "thumbnails/{}{}".format(id_media, ext)
+                    # Already compressed images
+                    archive.writestr(name, content, zipfile.ZIP_STORED)
+                    manifest["thumbnails"][str(id_media)] = name
+            archive.writestr("manifest.json", to_json(manifest))
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def get_current_bundle(program):
+    """Current version of the bundle of a program
+
+    :param program: program
+    :type program: ProgramsModel
+
+    :return: bundle path relative to the media dir, version and documents
+    :rtype: tuple
+    """
+    documents = {
+        name: to_json(data) for name, data in get_bundle_inputs(program).items()
+    }
+    digest = hashlib.sha256()
+    for name in sorted(documents):
+        digest.update(name.encode("utf-8"))
+        digest.update(documents[name])
+    version = digest.hexdigest()
+    return get_bundle_filename(program.id_program, version), version, documents
+
+
+def ensure_program_bundle(program):
+    """Build the bundle of a program if its inputs changed
+
+    :param program: program
+    :type program: ProgramsModel
+
+    :return: bundle path relative to the media dir
+    :rtype: str
+    """
+    filename, version, documents = get_current_bundle(program)
+    path = os.path.join(MEDIA_DIR, filename)
+    if os.path.isfile(path):
+        return filename
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_bundle(path, version, documents)
+    logger.info("[bundles] program %s bundle %s built", program.id_program, filename)
+    # Previous versions
+    prefix = "program_{}_".format(program.id_program)
+    for name in os.listdir(os.path.dirname(path)):
+        if name.startswith(prefix) and name != os.path.basename(path):
+            os.remove(os.path.join(os.path.dirname(path), name))
+    return filename
+
+
+def _run_build(app, id_program):
+    with app.app_context():
+        try:
+            ensure_program_bundle(ProgramsModel.query.get(id_program))
+        except Exception as e:
+            logger.error("[bundles] program %s: %s", id_program, str(e))
+        finally:
+            db.session.remove()
+            with _building_lock:
+                _building.discard(id_program)
+
+
+def start_bundle_build(id_program):
+    """Build the bundle of a program in a background thread
+
+    Does nothing when ``[BUNDLES] BACKGROUND`` is false (bundles built by
+    ``flask bundle-build`` only) or when this process is already building it.
+
+    :param id_program: program id
+    :type id_program: int
+    """
+    app = current_app._get_current_object()
+    if not get_bundles_config(app)["BACKGROUND"]:
+        return
+    with _building_lock:
+        if id_program in _building:
+            return
+        _building.add(id_program)
+    threading.Thread(
+        target=_run_build,
+        args=(app, id_program),
+        name="gnc-bundle-{}".format(id_program),
+        daemon=True,
+    ).start()
+
+
+@click.command("bundle-build")
+@click.option("--program", "id_program", type=int, help="Only this program")
+@with_appcontext
+def bundle_build_command(id_program):
+    """Build the offline bundles of active programs whose inputs changed"""
+    query = ProgramsModel.query.filter_by(is_active=True)
+    if id_program is not None:
+        query = query.filter_by(id_program=id_program)
+    for program in query:
+        try:
+            filename = ensure_program_bundle(program)
+        except Exception as e:
+            click.echo("{}: error, {}".format(program.id_program, str(e)))
+        else:
+            click.echo("{}: {}".format(program.id_program, filename))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to configure and monitor the SQLAlchemy connection pool"""
+
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from gncitizen.utils.metrics import observe_pool_checkout
+
+logger = logging.getLogger(__name__)
+
+"""
+    Correspondance entre les clés de la section [DB_POOL]
+    et les options de create_engine
+"""
+POOL_OPTIONS = {
+    "SIZE": "pool_size",
+    "MAX_OVERFLOW": "max_overflow",
+    "TIMEOUT": "pool_timeout",
+    "RECYCLE": "pool_recycle",
+    "PRE_PING": "pool_pre_ping",
+}
+
+
+class PoolStats(object):
+    """Process wide counters fed by ``InstrumentedQueuePool``"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.saturations = 0
+            self.wait_time_total = 0.0
+            self.wait_time_max = 0.0
+            self.last_saturation_log = 0.0
+
+    def record_checkout(self, wait_time, saturated):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            if saturated:
+                self.saturations += 1
+
+    def record_timeout(self, wait_time):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def should_log_saturation(self, interval):
+        """Rate limit saturation warnings to one per ``interval`` seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self.last_saturation_log < interval:
+                return False
+            self.last_saturation_log = now
+            return True
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "saturations": self.saturations,
+                "wait_time_total": round(self.wait_time_total, 6),
+                "wait_time_avg": round(self.wait_time_total / self.checkouts, 6)
+                if self.checkouts
+                else 0.0,
+                "wait_time_max": round(self.wait_time_max, 6),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool measuring checkout wait time and logging saturation"""
+
+    saturation_log_interval = 60
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kw):
+        self.max_overflow = max_overflow
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kw)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            wait_time = time.perf_counter() - start
+            pool_stats.record_timeout(wait_time)
+            observe_pool_checkout(wait_time, timeout=True)
+            logger.error(
+                "[db_pool] checkout timed out after %.3fs: %s", wait_time, self.status()
+            )
+            raise
+        wait_time = time.perf_counter() - start
+        saturated = (
+            self.max_overflow >= 0
+            and self.checkedout() >= self.size() + self.max_overflow
+        )
+        pool_stats.record_checkout(wait_time, saturated)
+        observe_pool_checkout(wait_time)
+        if saturated and pool_stats.should_log_saturation(
+            self.saturation_log_interval
+        ):
+            logger.warning(
+                "[db_pool] pool saturated (waited %.3fs): %s", wait_time, self.status()
+            )
+        return connection
+
+
+def get_engine_options(config):
+    """Build ``SQLALCHEMY_ENGINE_OPTIONS`` from the ``[DB_POOL]`` config section
+
+    :param config: application config
+    :type config: dict
+
+    :return: create_engine keyword arguments
+    :rtype: dict
+    """
+    pool_config = config.get("DB_POOL", {})
+    options = {"poolclass": InstrumentedQueuePool}
+    for key, option in POOL_OPTIONS.items():
+        if key in pool_config:
+            options[option] = pool_config[key]
+    statement_timeout = pool_config.get("STATEMENT_TIMEOUT")
+    if statement_timeout:
+        options["connect_args"] = {
+            "options": "-c statement_timeout={}".format(int(statement_timeout))
+        }
+    return options
+
+
+def get_pool_status(engine):
+    """Return the current state and counters of the engine pool
+
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy.engine.Engine
+
+    :return: pool metrics
+    :rtype: dict
+    """
+    pool = engine.pool
+    status = {"pool_class": pool.__class__.__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                # SQLAlchemy counts overflow from -pool_size
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": getattr(pool, "max_overflow", None),
+            }
+        )
+    status.update(pool_stats.as_dict())
+    return status
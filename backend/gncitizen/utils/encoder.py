@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to encode API responses in JSON
+
+The encoder used by ``to_json_resp`` is set by ``[JSON] ENCODER``:
+
+    * ``orjson`` (default), faster, returns bytes.
+    * ``json``, the standard library, used when orjson is not installed.
+
+Both encoders share ``default`` for the types they do not know (dates,
+UUIDs, decimals, geometries implementing ``__geo_interface__``), which
+formats them like the ``as_dict`` serializers (``str()``, dates as
+"YYYY-MM-DD HH:MM:SS"). With orjson (``native_types``), ``as_dict`` leaves
+dates, UUIDs and decimals to the encoder instead of converting each value
+beforehand: responses are the same with either encoder.
+"""
+
+import json
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def default(obj):
+    """Encode the types unknown to the encoders"""
+    if isinstance(obj, (datetime, date, time, UUID, Decimal)):
+        return str(obj)
+    if isinstance(obj, Enum):
+        return obj.name
+    if hasattr(obj, "__geo_interface__"):
+        return obj.__geo_interface__
+    raise TypeError(
+        "Object of type {} is not JSON serializable".format(type(obj).__name__)
+    )
+
+
+def orjson_dumps(obj, indent=None):
+    # Dates are formatted by default (str), as by the as_dict serializers
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=default, option=option)
+
+
+def json_dumps(obj, indent=None):
+    return json.dumps(obj, indent=indent, default=default).encode("utf-8")
+
+
+ENCODERS = {
+    "orjson": orjson_dumps,
+    "json": json_dumps,
+}
+
+"""Encoders fast enough on dates, UUIDs and decimals to get them unconverted"""
+NATIVE_TYPES_ENCODERS = ("orjson",)
+
+
+class JSONEncoder(object):
+    """JSON encoder of the API responses, set up from ``[JSON]``"""
+
+    def __init__(self):
+        self.name = "json"
+        self.native_types = False
+        self._dumps = ENCODERS["json"]
+
+    def init_app(self, app):
+        name = app.config.get("JSON", {}).get("ENCODER", "orjson")
+        if name == "orjson" and orjson is None:
+            logger.warning("[json] orjson is not installed, using json")
+            name = "json"
+        if name not in ENCODERS:
+            raise ValueError("Unknown JSON encoder {}".format(name))
+        self.name = name
+        self.native_types = name in NATIVE_TYPES_ENCODERS
+        self._dumps = ENCODERS[name]
+
+    def dumps(self, obj, indent=None):
+        """Encode ``obj``
+
+        :param obj: data
+        :param indent: pretty print indentation
+        :type indent: int
+
+        :return: encoded JSON
+        :rtype: bytes
+        """
+        return self._dumps(obj, indent)
+
+
+json_encoder = JSONEncoder()
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from functools import lru_cache
+
 from flask import current_app
 
 from gncitizen.core.ref_geo.models import LAreas, BibAreasTypes
 from gncitizen.utils.env import db
+from gncitizen.utils.sqlalchemy import get_geojson_feature
 from geoalchemy2 import func
 
 
@@ -57,6 +60,30 @@ def get_municipality_id_from_wkb(wkb):
     return municipality_id
 
 
+@lru_cache(maxsize=1)
+def get_municipality_features():
+    """Return enabled municipalities as geojson features (epsg 4326)
+
+    The result is cached for the process lifetime, it is loaded before
+    forking workers when gunicorn preloads the app (see ``utils.preload``).
+
+    :return: municipalities features with area_name and area_code properties
+    :rtype: tuple
+    """
+    datas = db.session.query(
+        LAreas.area_name,
+        LAreas.area_code,
+        func.ST_Transform(LAreas.geom, 4326).label("geom"),
+    ).filter(LAreas.enable, LAreas.id_type == 101)
+    features = []
+    for data in datas:
+        feature = get_geojson_feature(data.geom)
+        feature["properties"]["area_name"] = data.area_name
+        feature["properties"]["area_code"] = data.area_code
+        features.append(feature)
+    return tuple(features)
+
+
 def get_area_informations(id_area):
     try:
         query = db.session.query(LAreas).filter(LAreas.id_area == id_area)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to import the geometry files of program zones
+
+Files uploaded in the admin (``GeometryView``) may be large (detailed
+regional boundaries), they are imported outside of the admin request, by a
+background thread of the worker or by ``flask geometry-import`` (cron) when
+``[GEOMETRY_IMPORT] BACKGROUND`` is false. The status and progress of the
+import are stored on the geometry (``import_status``, ``import_progress``,
+``import_error``) and shown in the admin list.
+
+Files are read incrementally: ``iterparse`` for KML, ``ijson`` for GeoJSON.
+Every Polygon and MultiPolygon of the file is loaded by batches in a
+temporary table, then a single statement repairs them (``ST_MakeValid``),
+unions them and updates the geometry with its simplified versions.
+
+An import holds a transaction-level advisory lock on its geometry. Imports
+left ``pending`` or ``running`` by a worker killed or recycled are resumed
+when a worker starts (gunicorn ``post_worker_init``) or by
+``flask geometry-import``, and the lock skips those still running elsewhere.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import click
+import ijson
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, text
+from sqlalchemy.sql import column, table
+
+from gncitizen.core.commons.models import GeometryModel
+from gncitizen.utils.env import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GEOMETRY_IMPORT_CONFIG = {
+    "BACKGROUND": True,
+    "BATCH_SIZE": 500,
+    "PROGRESS_INTERVAL": 2,
+}
+
+INVALID_GEOMETRY_MESSAGE = "Géométrie non valide pour GNC"
+
+GEOJSON_EXTENSIONS = (".geojson", ".json")
+
+IMPORT_TABLE = "gnc_geometry_import"
+
+"""First key of the advisory locks of the imports (the second is id_geom)"""
+IMPORT_LOCK = 4326
+
+"""Statuses of the imports to resume"""
+UNFINISHED_STATUSES = ("pending", "running")
+
+"""Conversion of the parsed geometries, by file format"""
+IMPORT_INSERTS = {
+    "geojson": text(
+        "INSERT INTO {} VALUES (ST_SetSRID(ST_GeomFromGeoJSON(:geom), 4326))".format(
+            IMPORT_TABLE
+        )
+    ),
+    # KML is always 4326 srid
+    "kml": text("INSERT INTO {} VALUES (ST_GeomFromKML(:geom))".format(IMPORT_TABLE)),
+}
+
+
+def get_geometry_import_config(app=None):
+    conf = dict(DEFAULT_GEOMETRY_IMPORT_CONFIG)
+    conf.update((app or current_app).config.get("GEOMETRY_IMPORT", {}))
+    return conf
+
+
+def _first_position(coordinates):
+    while coordinates and isinstance(coordinates[0], (list, tuple)):
+        coordinates = coordinates[0]
+    return coordinates
+
+
+def iter_geojson_polygons(geom_file):
+    """Polygon and MultiPolygon geometries of a GeoJSON FeatureCollection
+
+    :param geom_file: file opened in binary mode
+    :return: GeoJSON geometries (str)
+    """
+    for feature in ijson.items(geom_file, "features.item", use_float=True):
+        geometry = feature.get("geometry")
+        if not geometry or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+            continue
+        # Minimal coordinate system check
+        position = _first_position(geometry.get("coordinates"))
+        if not position:
+            raise ValueError(INVALID_GEOMETRY_MESSAGE)
+        x, y = position[:2]
+        if abs(x) > 180 or abs(y) > 180:
+            raise ValueError("Mauvais système de projection")
+        yield json.dumps(geometry)
+
+
+def iter_kml_polygons(geom_file):
+    """Polygon elements of a KML file, in MultiGeometry or not
+
+    :param geom_file: file opened in binary mode
+    :return: KML polygons (str)
+    """
+    for _event, elt in ET.iterparse(geom_file, events=("end",)):
+        tag = elt.tag.rsplit("}", 1)[-1]
+        if tag == "Polygon":
+            yield ET.tostring(elt, encoding="unicode", method="xml")
+            elt.clear()
+        elif tag == "Placemark":
+            # Free the parsed placemarks
+            elt.clear()
+
+
+def iter_polygons(geom_file, ext):
+    """Format and polygons of a geometry file, read incrementally"""
+    if ext in GEOJSON_EXTENSIONS:
+        return "geojson", iter_geojson_polygons(geom_file)
+    if ext == ".kml":
+        return "kml", iter_kml_polygons(geom_file)
+    raise ValueError(INVALID_GEOMETRY_MESSAGE)
+
+
+def set_import_status(id_geom, **values):
+    """Update the import status of a geometry in its own transaction"""
+    geometries = GeometryModel.__table__
+    with db.engine.begin() as connection:
+        connection.execute(
+            geometries.update().where(geometries.c.id_geom == id_geom).values(**values)
+        )
+
+
+def import_geometry(id_geom):
+    """Import the file of a geometry, replacing its geometry
+
+    :param id_geom: geometry id
+    :type id_geom: int
+
+    :return: number of polygons imported, None if imported by another process
+    :rtype: int
+    """
+    conf = get_geometry_import_config()
+    geometry = GeometryModel.query.get(id_geom)
+    if geometry is None or not geometry.geom_file:
+        raise ValueError("No geometry file to import")
+    path = geometry.get_geom_file_path()
+    db.session.remove()
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    locked = connection.execute(
+        select([func.pg_try_advisory_xact_lock(IMPORT_LOCK, id_geom)])
+    ).scalar()
+    if not locked:
+        transaction.rollback()
+        connection.close()
+        logger.info("[geometry_import] geometry %s: already running", id_geom)
+        return None
+    set_import_status(id_geom, import_status="running", import_progress=0)
+    count = 0
+    try:
+        size = max(os.path.getsize(path), 1)
+        connection.execute(
+            "CREATE TEMP TABLE {} (geom geometry) ON COMMIT DROP".format(IMPORT_TABLE)
+        )
+        with open(path, "rb") as geom_file:
+            fmt, polygons = iter_polygons(geom_file, os.path.splitext(path)[1])
+            batch = []
+            reported_at = time.monotonic()
+            for polygon in polygons:
+                batch.append({"geom": polygon})
+                if len(batch) >= conf["BATCH_SIZE"]:
+                    connection.execute(IMPORT_INSERTS[fmt], batch)
+                    count += len(batch)
+                    batch = []
+                if time.monotonic() - reported_at >= conf["PROGRESS_INTERVAL"]:
+                    # Bytes read by the parser, the last % is the union
+                    progress = min(99 * geom_file.tell() // size, 99)
+                    set_import_status(id_geom, import_progress=progress)
+                    reported_at = time.monotonic()
+            if batch:
+                connection.execute(IMPORT_INSERTS[fmt], batch)
+                count += len(batch)
+        if not count:
+            raise ValueError(INVALID_GEOMETRY_MESSAGE)
+
+        imported = table(IMPORT_TABLE, column("geom"))
+        union = select(
+            [
+                func.ST_Multi(
+                    func.ST_Union(
+                        func.ST_CollectionExtract(func.ST_MakeValid(imported.c.geom), 3)
+                    )
+                ).label("geom")
+            ]
+        ).alias("imported")
+        values = GeometryModel.variants_values(union.c.geom)
+        values.update(
+            geom=union.c.geom,
+            import_status="done",
+            import_progress=100,
+            import_error=None,
+            timestamp_update=datetime.utcnow(),
+        )
+        geometries = GeometryModel.__table__
+        result = connection.execute(
+            geometries.update()
+            .where(geometries.c.id_geom == id_geom)
+            .where(func.ST_IsEmpty(union.c.geom).is_(False))
+            .values(**values)
+        )
+        if not result.rowcount:
+            # Only degenerated polygons
+            raise ValueError(INVALID_GEOMETRY_MESSAGE)
+        transaction.commit()
+    except Exception as e:
+        transaction.rollback()
+        logger.error("[geometry_import] geometry %s: %s", id_geom, str(e))
+        set_import_status(id_geom, import_status="error", import_error=str(e))
+        raise
+    finally:
+        connection.close()
+    logger.info("[geometry_import] geometry %s: %s polygons", id_geom, count)
+    return count
+
+
+def _run_import(app, id_geom):
+    with app.app_context():
+        try:
+            import_geometry(id_geom)
+        except Exception:
+            # Logged and stored on the geometry
+            pass
+        finally:
+            db.session.remove()
+
+
+def start_geometry_import(id_geom):
+    """Import the file of a geometry marked as pending, in a background thread
+
+    Does nothing when ``[GEOMETRY_IMPORT] BACKGROUND`` is false, pending
+    imports are then run by ``flask geometry-import``.
+
+    :param id_geom: geometry id
+    :type id_geom: int
+    """
+    app = current_app._get_current_object()
+    if not get_geometry_import_config(app)["BACKGROUND"]:
+        return
+    threading.Thread(
+        target=_run_import,
+        args=(app, id_geom),
+        name="gnc-geometry-import-{}".format(id_geom),
+        daemon=True,
+    ).start()
+
+
+def get_unfinished_imports():
+    """Ids of the geometries whose import is pending or was interrupted"""
+    ids = [
+        id_geom
+        for id_geom, in db.session.query(GeometryModel.id_geom).filter(
+            GeometryModel.import_status.in_(UNFINISHED_STATUSES)
+        )
+    ]
+    db.session.remove()
+    return ids
+
+
+def resume_geometry_imports(app):
+    """Resume the unfinished imports in background threads
+
+    Gunicorn ``post_worker_init`` hook: imports of a worker killed or
+    recycled stay ``running``. Imports still running in another process
+    keep their lock and are skipped.
+
+    :param app: flask app
+    :type app: flask.Flask
+    """
+    if not get_geometry_import_config(app)["BACKGROUND"]:
+        return
+    with app.app_context():
+        try:
+            for id_geom in get_unfinished_imports():
+                start_geometry_import(id_geom)
+        except Exception as e:
+            logger.error("[geometry_import] resume: %s", str(e))
+
+
+@click.command("geometry-import")
+@click.option("--geometry", "id_geom", type=int, help="Import this geometry")
+@with_appcontext
+def geometry_import_command(id_geom):
+    """Import pending or interrupted geometry files (or a given one)"""
+    ids = [id_geom] if id_geom is not None else get_unfinished_imports()
+    for id_geom in ids:
+        try:
+            count = import_geometry(id_geom)
+        except Exception as e:
+            click.echo("{}: error, {}".format(id_geom, str(e)))
+        else:
+            if count is None:
+                click.echo("{}: already running".format(id_geom))
+            else:
+                click.echo("{}: {} polygons".format(id_geom, count))
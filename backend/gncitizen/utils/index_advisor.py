@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to check that hot route queries are supported by indexes
+
+``flask index-advisor`` runs ``EXPLAIN`` on the canonical queries of the
+listing routes, with ids sampled from the database, and reports the
+sequential scans on tables larger than ``--min-rows``. It exits with status
+1 when a sequential scan is found, so it can be used after a migration.
+"""
+
+import json
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from gncitizen.utils.env import db
+
+"""Canonical queries of the hot routes (route: SQL)"""
+CANONICAL_QUERIES = {
+    "GET /programs/<id>/observations": """
+        SELECT o.id_observation FROM gnc_obstax.t_obstax o
+        WHERE o.id_program = :id_program
+        ORDER BY o.timestamp_create DESC LIMIT 1000""",
+    "GET /observations/users/<id>": """
+        SELECT o.id_observation FROM gnc_obstax.t_obstax o
+        WHERE o.id_role = :id_role
+        ORDER BY o.timestamp_create DESC""",
+    "observation medias": """
+        SELECT m.filename FROM gnc_obstax.cor_obstax_media c
+        JOIN gnc_core.t_medias m ON m.id_media = c.id_media
+        WHERE c.id_data_source = :id_observation""",
+    "observations by taxon": """
+        SELECT count(*) FROM gnc_obstax.t_obstax o WHERE o.cd_nom = :cd_nom""",
+    "GET /programs/<id>/changes": """
+        SELECT o.id_observation FROM gnc_obstax.t_obstax o
+        WHERE o.id_program = :id_program
+        AND o.timestamp_update > now() - interval '1 day'""",
+    "deletion log": """
+        SELECT d.id_entity FROM gnc_core.t_deletions d
+        WHERE d.id_program = :id_program
+        AND d.timestamp_delete > now() - interval '1 day'""",
+    "GET /sites/programs/<id>": """
+        SELECT s.id_site FROM gnc_sites.t_sites s WHERE s.id_program = :id_program""",
+    "GET /sites/users/<id>": """
+        SELECT s.id_site FROM gnc_sites.t_sites s WHERE s.id_role = :id_role""",
+    "site visits": """
+        SELECT v.id_visit FROM gnc_sites.t_visit v
+        WHERE v.id_site = :id_site ORDER BY v.date DESC""",
+    "visit medias": """
+        SELECT m.filename FROM gnc_sites.cor_visites_media c
+        JOIN gnc_core.t_medias m ON m.id_media = c.id_media
+        WHERE c.id_data_source = :id_visit""",
+    "GET /municipality": """
+        SELECT a.id_area FROM ref_geo.l_areas a
+        WHERE a.enable AND a.id_type = 101""",
+    "municipality of a point": """
+        SELECT a.id_area FROM ref_geo.l_areas a
+        JOIN ref_geo.bib_areas_types t ON t.id_type = a.id_type
+        WHERE t.type_name = 'Communes'
+        AND ST_Intersects(
+            a.geom,
+            ST_Transform(
+                ST_SetSRID(ST_MakePoint(:x, :y), 4326),
+                Find_SRID('ref_geo', 'l_areas', 'geom')
+            )
+        ) LIMIT 1""",
+}
+
+SAMPLE_QUERIES = {
+    "id_program": "SELECT id_program FROM gnc_obstax.t_obstax LIMIT 1",
+    "id_role": """SELECT id_role FROM gnc_obstax.t_obstax
+        WHERE id_role IS NOT NULL LIMIT 1""",
+    "id_observation": """SELECT id_data_source FROM gnc_obstax.cor_obstax_media
+        LIMIT 1""",
+    "cd_nom": "SELECT cd_nom FROM gnc_obstax.t_obstax LIMIT 1",
+    "id_site": "SELECT id_site FROM gnc_sites.t_visit LIMIT 1",
+    "id_visit": "SELECT id_data_source FROM gnc_sites.cor_visites_media LIMIT 1",
+    "x": "SELECT ST_X(geom) FROM gnc_obstax.t_obstax LIMIT 1",
+    "y": "SELECT ST_Y(geom) FROM gnc_obstax.t_obstax LIMIT 1",
+}
+
+DEFAULT_SAMPLES = {"x": 2.35, "y": 48.85}
+
+
+def get_sample_params():
+    """Return parameters of the canonical queries sampled from the database"""
+    params = {}
+    for name, sql in SAMPLE_QUERIES.items():
+        value = db.session.execute(text(sql)).scalar()
+        params[name] = value if value is not None else DEFAULT_SAMPLES.get(name, 0)
+    return params
+
+
+def iter_plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+
+def get_table_rows(schema, table):
+    return (
+        db.session.execute(
+            text(
+                """SELECT c.reltuples FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = :schema AND c.relname = :table"""
+            ),
+            {"schema": schema, "table": table},
+        ).scalar()
+        or 0
+    )
+
+
+def explain(sql, params):
+    """Return the JSON plan of a query
+
+    :param sql: query
+    :type sql: str
+    :param params: query parameters
+    :type params: dict
+
+    :return: plan root node
+    :rtype: dict
+    """
+    plan = db.session.execute(
+        text("EXPLAIN (FORMAT JSON, VERBOSE) " + sql), params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def find_seq_scans(min_rows=10000):
+    """Explain canonical queries and list sequential scans on large tables
+
+    :param min_rows: ignore tables with fewer (estimated) rows
+    :type min_rows: int
+
+    :return: one dict per sequential scan (route, table, rows, filter)
+    :rtype: list
+    """
+    params = get_sample_params()
+    warnings = []
+    for route, sql in CANONICAL_QUERIES.items():
+        for node in iter_plan_nodes(explain(sql, params)):
+            if node["Node Type"] != "Seq Scan":
+                continue
+            rows = get_table_rows(node.get("Schema"), node["Relation Name"])
+            if rows < min_rows:
+                continue
+            warnings.append(
+                {
+                    "route": route,
+                    "table": "{}.{}".format(
+                        node.get("Schema"), node["Relation Name"]
+                    ),
+                    "rows": int(rows),
+                    "filter": node.get("Filter"),
+                }
+            )
+    db.session.rollback()
+    return warnings
+
+
+@click.command("index-advisor")
+@click.option(
+    "--min-rows",
+    default=10000,
+    show_default=True,
+    help="Ignore sequential scans on smaller tables",
+)
+@with_appcontext
+def index_advisor_command(min_rows):
+    """Flag sequential scans in the plans of hot route queries"""
+    warnings = find_seq_scans(min_rows)
+    for warning in warnings:
+        click.echo(
+            "Seq Scan on {table} (~{rows} rows) for {route}, filter: {filter}".format(
+                **warning
+            )
+        )
+    if warnings:
+        raise SystemExit(1)
+    click.echo("No sequential scan on tables over {} rows".format(min_rows))
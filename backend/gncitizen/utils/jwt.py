@@ -3,26 +3,113 @@
 
 """A module to manage jwt"""
 
+import calendar
+import threading
+import time
+from datetime import datetime
 from functools import wraps
 
-from flask import jsonify
-from flask_jwt_extended import get_jwt_identity
+from flask import current_app, jsonify, request
+from flask_jwt_extended import (
+    create_access_token,
+    create_refresh_token,
+    get_jwt,
+    get_jwt_identity,
+)
 
-from gncitizen.core.users.models import UserModel
+from gncitizen.core.users.models import RevokedTokenModel, UserModel
+from gncitizen.utils.env import db, jwt
+
+
+"""Claims added to tokens by ``create_user_tokens``"""
+USER_CLAIMS = ("id_user", "username", "admin")
+
+
+def get_user_claims(user):
+    """Return the additional token claims of a user
+
+    :param user: user
+    :type user: UserModel
+
+    :return: id_user, username and admin claims
+    :rtype: dict
+    """
+    return {
+        "id_user": user.id_user,
+        "username": user.username,
+        "admin": bool(user.admin),
+    }
+
+
+def create_user_tokens(user, refresh=True):
+    """Create the access (and refresh) tokens of a user, identified by email
+
+    :param user: user
+    :type user: UserModel
+    :param refresh: also create a refresh token
+    :type refresh: bool
+
+    :return: access token and refresh token (None if ``refresh`` is False)
+    :rtype: tuple
+    """
+    claims = get_user_claims(user)
+    access_token = create_access_token(identity=user.email, additional_claims=claims)
+    refresh_token = (
+        create_refresh_token(identity=user.email, additional_claims=claims)
+        if refresh
+        else None
+    )
+    return access_token, refresh_token
+
+
+def get_current_user_claims():
+    """Return the current user claims, cached for the request
+
+    Claims are read from the token, the user is only queried for tokens
+    created before they were added.
+
+    :return: email, id_user, username and admin of the user, None if anonymous
+    :rtype: dict
+    """
+    if "gnc.user_claims" in request.environ:
+        return request.environ["gnc.user_claims"]
+    email = get_jwt_identity()
+    claims = None
+    if email is not None:
+        token = get_jwt()
+        if all(claim in token for claim in USER_CLAIMS):
+            claims = {claim: token[claim] for claim in USER_CLAIMS}
+        else:
+            user = get_current_user()
+            claims = get_user_claims(user) if user is not None else None
+        if claims is not None:
+            claims["email"] = email
+    request.environ["gnc.user_claims"] = claims
+    return claims
+
+
+def get_current_user():
+    """Return the current ``UserModel`` (one query per request at most)
+
+    :return: user, None if anonymous or unknown
+    :rtype: UserModel
+    """
+    if "gnc.user" not in request.environ:
+        email = get_jwt_identity()
+        request.environ["gnc.user"] = (
+            UserModel.query.filter_by(email=email).first() if email is not None else None
+        )
+    return request.environ["gnc.user"]
 
 
 def get_id_role_if_exists():
-    """get id_role if exists from ``get_jwt_identity()``
+    """get id_role if exists from the token claims
 
     :return: user id
     :rtype: int
     """
-    if get_jwt_identity() is not None:
-        current_user = get_jwt_identity()
-        id_role = UserModel.query.filter_by(email=current_user).first().id_user
-    else:
-        id_role = None
-    return id_role
+    claims = get_current_user_claims()
+    return claims["id_user"] if claims is not None else None
 
 
 def admin_required(func):
@@ -37,13 +124,128 @@ def admin_required(func):
 
     @wraps(func)
     def decorated_function(*args, **kwargs):
-        current_user = get_jwt_identity()
         try:
-            is_admin = UserModel.query.filter_by(email=current_user).first().admin
-            if not is_admin:
+            claims = get_current_user_claims()
+            if claims is None or not claims["admin"]:
                 return {"message": "Special authorization required"}, 403
             return func(*args, **kwargs)
         except Exception as e:
             return jsonify(message=e), 500
 
     return decorated_function
+
+
+REFRESH_ID_OVERLAP = 100
+
+
+class RevokedTokens(object):
+    """In-process set of revoked JWT ids
+
+    The set is refreshed incrementally from ``t_revoked_tokens`` (rows with an
+    id greater than the last one seen) at most every ``REFRESH_INTERVAL``
+    seconds, so that checking a token is usually a dict lookup instead of a
+    query. Tokens revoked by this process are added immediately, tokens
+    revoked by other workers are seen after at most ``REFRESH_INTERVAL``
+    seconds. Entries (and rows) are dropped once the token has expired.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._revoked = {}
+        self._last_id = 0
+        self._last_refresh = float("-inf")
+        self._last_purge = time.monotonic()
+
+    def _config(self):
+        return current_app.config.get("JWT_REVOCATION", {})
+
+    def _refresh(self, conn):
+        table = RevokedTokenModel.__table__
+        rows = conn.execute(
+            db.select([table.c.id, table.c.jti, table.c.expires])
+            .where(
+                db.and_(
+                    # Overlap: ids of concurrent transactions may commit late
+                    table.c.id > self._last_id - REFRESH_ID_OVERLAP,
+                    db.or_(
+                        table.c.expires.is_(None),
+                        table.c.expires > datetime.utcnow(),
+                    ),
+                )
+            )
+            .order_by(table.c.id)
+        )
+        for row in rows:
+            self._revoked[row.jti] = (
+                calendar.timegm(row.expires.utctimetuple())
+                if row.expires
+                else float("inf")
+            )
+            self._last_id = max(self._last_id, row.id)
+
+    def _purge(self, conn):
+        now = time.time()
+        self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+        table = RevokedTokenModel.__table__
+        conn.execute(table.delete().where(table.c.expires < datetime.utcnow()))
+
+    def _maybe_refresh(self):
+        conf = self._config()
+        now = time.monotonic()
+        refresh = now - self._last_refresh >= conf.get("REFRESH_INTERVAL", 5)
+        purge = now - self._last_purge >= conf.get("PURGE_INTERVAL", 3600)
+        if not (refresh or purge):
+            return
+        with self._lock:
+            # Own connection: the request session must not be committed here
+            with db.engine.begin() as conn:
+                if refresh:
+                    self._refresh(conn)
+                    self._last_refresh = now
+                if purge:
+                    self._purge(conn)
+                    self._last_purge = now
+
+    def is_revoked(self, jti):
+        """Check if a token id has been revoked
+
+        :param jti: JWT id
+        :type jti: str
+
+        :return: True if revoked
+        :rtype: bool
+        """
+        self._maybe_refresh()
+        return jti in self._revoked
+
+    def revoke(self, jti, exp):
+        """Store a revoked token
+
+        :param jti: JWT id
+        :type jti: str
+        :param exp: token expiration timestamp
+        :type exp: int
+        """
+        RevokedTokenModel(
+            jti=jti, expires=datetime.utcfromtimestamp(exp) if exp else None
+        ).add()
+        with self._lock:
+            self._revoked[jti] = exp or float("inf")
+
+
+revoked_tokens = RevokedTokens()
+
+
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    """flask_jwt_extended callback, enabled by ``JWT_BLACKLIST_ENABLED``"""
+    if not current_app.config.get("JWT_BLACKLIST_ENABLED", False):
+        return False
+    if jwt_payload.get("type") not in current_app.config.get(
+        "JWT_BLACKLIST_TOKEN_CHECKS", ["access", "refresh"]
+    ):
+        return False
+    return revoked_tokens.is_revoked(jwt_payload["jti"])
@@ -1,9 +1,11 @@
 from flask import current_app
 from itsdangerous import URLSafeTimedSerializer
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+from gncitizen.utils.env import db
+from gncitizen.utils.mail_outbox import mail_sender, queue_mail
+
 
 def confirm_user_email(newuser):
 
@@ -31,33 +33,10 @@ def confirm_user_email(newuser):
 
     msg.attach(msg_body)
 
-    try:
-        if current_app.config["MAIL"]["MAIL_USE_SSL"]:
-            server = smtplib.SMTP_SSL(
-                current_app.config["MAIL"]["MAIL_HOST"],
-                int(current_app.config["MAIL"]["MAIL_PORT"]),
-            )
-        else:
-            server = smtplib.SMTP(
-                current_app.config["MAIL"]["MAIL_HOST"],
-                int(current_app.config["MAIL"]["MAIL_PORT"]),
-            )
-
-        server.ehlo()
-        if current_app.config["MAIL"]["MAIL_STARTTLS"]:
-            server.starttls()
-        server.login(
-            str(current_app.config["MAIL"]["MAIL_AUTH_LOGIN"]),
-            str(current_app.config["MAIL"]["MAIL_AUTH_PASSWD"]),
-        )
-        server.sendmail(
-            current_app.config["CONFIRM_EMAIL"]["FROM"], newuser.email, msg.as_string()
-        )
-        server.quit()
-
-    except Exception as e:
-        current_app.logger.warning("send confirm_email failled. %s", str(e))
-        return {"message": """ send confirm_email failled: "{}".""".format(str(e))}
+    # Delivered by the outbox sender, outside of the HTTP request
+    queue_mail(msg, current_app.config["CONFIRM_EMAIL"]["FROM"], newuser.email)
+    db.session.commit()
+    mail_sender.notify()
 
 
 def generate_confirmation_token(email):
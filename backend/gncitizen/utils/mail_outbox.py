@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to send emails outside of HTTP requests
+
+Messages are stored in ``gnc_core.t_mail_outbox`` within the caller
+transaction (``queue_mail``) and delivered by a background thread of each
+worker, or by ``flask mail-send`` (cron, dedicated process) when
+``MAIL_OUTBOX.BACKGROUND_SENDER`` is false. A batch of pending messages is
+sent over a single authenticated SMTP connection and failed messages are
+retried with an exponential backoff.
+
+The body of a message (eg: a new password) is cleared once it is sent or
+given up, and sent or failed rows are deleted after
+``MAIL_OUTBOX.RETENTION_DAYS``. Each worker drains the outbox when it starts
+(gunicorn ``post_worker_init`` hook, or first request), so that retries left
+pending by a restart are not waiting for a new email.
+
+To test locally, run a debugging SMTP server (``pip install aiosmtpd``)::
+
+    python -m aiosmtpd -n -l localhost:8025
+
+and set ``MAIL_HOST = 'localhost'``, ``MAIL_PORT = 8025``,
+``MAIL_USE_SSL = false``, ``MAIL_STARTTLS = false`` and an empty
+``MAIL_AUTH_LOGIN``.
+"""
+
+import logging
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from gncitizen.core.commons.models import MailOutboxModel
+from gncitizen.utils.env import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX_CONFIG = {
+    "BACKGROUND_SENDER": True,
+    "BATCH_SIZE": 50,
+    "POLL_INTERVAL": 30,
+    "MAX_ATTEMPTS": 8,
+    "RETRY_DELAY": 60,
+    "MAX_RETRY_DELAY": 3600,
+    "SMTP_TIMEOUT": 30,
+    "RETENTION_DAYS": 7,
+}
+
+
+def get_outbox_config(app=None):
+    conf = dict(DEFAULT_OUTBOX_CONFIG)
+    conf.update((app or current_app).config.get("MAIL_OUTBOX", {}))
+    return conf
+
+
+def queue_mail(msg, mail_from, mail_to):
+    """Add an email to the outbox, committed with the current transaction
+
+    :param msg: email message
+    :type msg: email.message.Message
+    :param mail_from: sender address
+    :type mail_from: str
+    :param mail_to: recipient address
+    :type mail_to: str
+
+    :return: queued mail
+    :rtype: MailOutboxModel
+    """
+    mail = MailOutboxModel(
+        mail_from=mail_from,
+        mail_to=mail_to,
+        subject=str(msg["Subject"]),
+        message=msg.as_string(),
+        status="pending",
+        attempts=0,
+        next_attempt=datetime.utcnow(),
+    )
+    db.session.add(mail)
+    return mail
+
+
+def open_smtp_connection(mail_config, timeout=None):
+    """Open an SMTP(S) connection and log in when credentials are set
+
+    :param mail_config: ``[MAIL]`` config section
+    :type mail_config: dict
+
+    :return: connected SMTP client
+    :rtype: smtplib.SMTP
+    """
+    smtp_class = smtplib.SMTP_SSL if mail_config.get("MAIL_USE_SSL") else smtplib.SMTP
+    server = smtp_class(
+        mail_config["MAIL_HOST"], int(mail_config["MAIL_PORT"]), timeout=timeout
+    )
+    server.ehlo()
+    if mail_config.get("MAIL_STARTTLS") and not mail_config.get("MAIL_USE_SSL"):
+        server.starttls()
+        server.ehlo()
+    if mail_config.get("MAIL_AUTH_LOGIN"):
+        server.login(
+            str(mail_config["MAIL_AUTH_LOGIN"]), str(mail_config["MAIL_AUTH_PASSWD"])
+        )
+    return server
+
+
+def _retry(mail, error, conf):
+    mail.attempts += 1
+    mail.last_error = str(error)[:1000]
+    if mail.attempts >= conf["MAX_ATTEMPTS"]:
+        mail.status = "failed"
+        # Never sent, its content is not kept
+        mail.message = ""
+        logger.error(
+            "[mail_outbox] giving up mail %s to %s: %s",
+            mail.id_mail,
+            mail.mail_to,
+            mail.last_error,
+        )
+    else:
+        delay = min(
+            conf["RETRY_DELAY"] * 2 ** (mail.attempts - 1), conf["MAX_RETRY_DELAY"]
+        )
+        mail.next_attempt = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def send_pending(batch_size=None, mail_from=None):
+    """Send one batch of due emails over a single SMTP connection
+
+    Rows are locked with ``FOR UPDATE SKIP LOCKED`` so that concurrent
+    senders (one per worker) never send the same email twice.
+
+    :param batch_size: max number of emails sent
+    :type batch_size: int
+    :param mail_from: only send the emails of this sender
+    :type mail_from: str
+
+    :return: sent and failed counts
+    :rtype: tuple
+    """
+    conf = get_outbox_config()
+    criterion = [
+        MailOutboxModel.status == "pending",
+        MailOutboxModel.next_attempt <= datetime.utcnow(),
+    ]
+    if mail_from is not None:
+        criterion.append(MailOutboxModel.mail_from == mail_from)
+    mails = (
+        MailOutboxModel.query.filter(*criterion)
+        .order_by(MailOutboxModel.next_attempt)
+        .limit(batch_size or conf["BATCH_SIZE"])
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not mails:
+        db.session.rollback()
+        return 0, 0
+    sent, failed = 0, 0
+    try:
+        server = open_smtp_connection(
+            current_app.config["MAIL"], timeout=conf["SMTP_TIMEOUT"]
+        )
+    except Exception as e:
+        logger.warning("[mail_outbox] SMTP connection failed: %s", str(e))
+        for mail in mails:
+            _retry(mail, e, conf)
+        db.session.commit()
+        return 0, len(mails)
+    try:
+        for mail in mails:
+            try:
+                server.sendmail(mail.mail_from, [mail.mail_to], mail.message)
+            except smtplib.SMTPServerDisconnected as e:
+                # Retry the remaining mails with the next batch
+                _retry(mail, e, conf)
+                failed += 1
+                break
+            except Exception as e:
+                _retry(mail, e, conf)
+                failed += 1
+            else:
+                mail.status = "sent"
+                mail.sent_at = datetime.utcnow()
+                # May contain credentials
+                mail.message = ""
+                mail.attempts += 1
+                sent += 1
+    finally:
+        db.session.commit()
+        try:
+            server.quit()
+        except Exception:
+            pass
+    logger.info("[mail_outbox] %s sent, %s failed", sent, failed)
+    return sent, failed
+
+
+def purge_outbox(retention_days, mail_from=None):
+    """Delete the sent and failed emails older than ``retention_days``
+
+    :param mail_from: only purge the emails of this sender
+    :type mail_from: str
+
+    :return: purged emails
+    :rtype: int
+    """
+    criterion = [
+        MailOutboxModel.status.in_(("sent", "failed")),
+        MailOutboxModel.timestamp_create
+        < datetime.utcnow() - timedelta(days=retention_days),
+    ]
+    if mail_from is not None:
+        criterion.append(MailOutboxModel.mail_from == mail_from)
+    count = MailOutboxModel.query.filter(*criterion).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def send_all_pending():
+    """Send due emails batch after batch until none is left"""
+    total_sent, total_failed = 0, 0
+    while True:
+        sent, failed = send_pending()
+        total_sent += sent
+        total_failed += failed
+        if not sent:
+            return total_sent, total_failed
+
+
+class MailSender(object):
+    """Background thread delivering the outbox of this process
+
+    The thread is started on first use in each process (so that gunicorn
+    workers forked from a preloaded master get their own) and woken up by
+    ``notify`` once a request has committed new emails.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._app = None
+
+    def init_app(self, app):
+        self._app = app
+        # Without gunicorn (flask run), drain the outbox on the first request
+        app.before_first_request(self.notify)
+
+    def notify(self):
+        if self._app is None:
+            return
+        if not get_outbox_config(self._app)["BACKGROUND_SENDER"]:
+            return
+        self._ensure_started()
+        self._event.set()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="gnc-mail-sender", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        poll_interval = get_outbox_config(self._app)["POLL_INTERVAL"]
+        while True:
+            self._event.wait(poll_interval)
+            self._event.clear()
+            with self._app.app_context():
+                try:
+                    send_all_pending()
+                    purge_outbox(get_outbox_config(self._app)["RETENTION_DAYS"])
+                except Exception as e:
+                    logger.error("[mail_outbox] sender error: %s", str(e))
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+mail_sender = MailSender()
+
+
+@click.command("mail-send")
+@click.option("--loop", is_flag=True, help="Keep polling the outbox")
+@with_appcontext
+def mail_send_command(loop):
+    """Send pending emails of the outbox"""
+    conf = get_outbox_config()
+    while True:
+        sent, failed = send_all_pending()
+        purged = purge_outbox(conf["RETENTION_DAYS"])
+        click.echo("{} sent, {} failed, {} purged".format(sent, failed, purged))
+        if not loop:
+            break
+        db.session.remove()
+        time.sleep(conf["POLL_INTERVAL"])
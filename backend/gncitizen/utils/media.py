@@ -4,17 +4,29 @@
 """A module to manage medias"""
 
 import datetime
+import mimetypes
 import os
+import re
 
-from flask import current_app
+from flask import Response, abort, current_app, request
 from werkzeug.datastructures import FileStorage
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
 
 from gncitizen.core.commons.models import MediaModel
 from gncitizen.utils.env import MEDIA_DIR
 from gncitizen.utils.errors import GeonatureApiError
 from gncitizen.utils.env import ALLOWED_EXTENSIONS
+from gncitizen.utils.upload import save_file_storage
 from server import db
 
+# Number of sha256 hex chars appended to media filenames
+MEDIA_DIGEST_LENGTH = 8
+# Media filenames ending with their content digest never change
+CONTENT_ADDRESSED_RE = re.compile(
+    r"_(?P<digest>[0-9a-f]{%d})\.[a-z0-9]+$" % MEDIA_DIGEST_LENGTH
+)
+
 
 def allowed_file(filename):
     """Check if uploaded file type is allowed
@@ -38,8 +50,9 @@ def save_upload_files(
     for each files in flask request.files, this function does:
 
         * verify if file type is in allowed medias
+        * stream file in ``./media`` dir (renamed if already spooled on disk)
         * generate a filename from ``prefix``, ``cdnom``, ``index``, ``timestamp``
-        * save file in ``./media`` dir
+          and the file content digest
         * save filename in MediaModel and then in a matching media model
 
 
@@ -80,13 +93,23 @@ def save_upload_files(
                     )
                     ext = filename.rsplit(".", 1)[1].lower()
                     timestamp = datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-                    filename = "{}_{}_{}_{}.{}".format(
-                        prefix, str(cdnom), i, timestamp, ext
+                    filename, size = save_file_storage(
+                        file,
+                        str(MEDIA_DIR),
+                        lambda digest: "{}_{}_{}_{}_{}.{}".format(
+                            prefix,
+                            str(cdnom),
+                            i,
+                            timestamp,
+                            digest[:MEDIA_DIGEST_LENGTH],
+                            ext,
+                        ),
                     )
                     current_app.logger.debug(
-                        "[save_upload_files] new filename : {}".format(filename)
+                        "[save_upload_files] new filename : {} ({} bytes)".format(
+                            filename, size
+                        )
                     )
-                    file.save(os.path.join(str(MEDIA_DIR), filename))
                     # Save media filename to Database
                     try:
                         newmedia = MediaModel(filename=filename)
@@ -135,3 +158,93 @@ def save_upload_files(
         raise GeonatureApiError(e)
 
     return files
+
+
+def save_avatar_file(file, username):
+    """Save an uploaded avatar in media dir
+
+    :param file: uploaded avatar
+    :type file: werkzeug.datastructures.FileStorage
+    :param username: avatar owner username
+    :type username: str
+
+    :return: saved filename
+    :rtype: str
+    """
+    if not isinstance(file, FileStorage) or not allowed_file(file.filename):
+        raise GeonatureApiError("Format d'image non autorisé", status_code=400)
+    ext = file.filename.rsplit(".", 1)[1].lower()
+    filename, _size = save_file_storage(
+        file,
+        str(MEDIA_DIR),
+        lambda digest: "avatar_{}_{}.{}".format(
+            username, digest[:MEDIA_DIGEST_LENGTH], ext
+        ),
+    )
+    return filename
+
+
+def send_media_file(filename):
+    """Serve a file from media dir
+
+    Depending on ``MEDIA_SERVING.MODE``, the file is either delegated to the
+    web server (``x-sendfile`` for Apache, ``x-accel-redirect`` for nginx) or
+    streamed by the worker (``flask``, default) with Range and conditional
+    requests support.
+
+    Content-addressed files (uploads whose name ends with their digest) get a
+    long-lived immutable cache policy.
+
+    :param filename: path relative to media dir
+    :type filename: str
+
+    :return: flask response
+    :rtype: flask.Response
+    """
+    conf = current_app.config.get("MEDIA_SERVING", {})
+    mode = conf.get("MODE", "flask").lower()
+    path = safe_join(str(MEDIA_DIR), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    stat = os.stat(path)
+    content_addressed = CONTENT_ADDRESSED_RE.search(os.path.basename(path))
+    if content_addressed:
+        etag = "{}-{:x}".format(content_addressed.group("digest"), stat.st_size)
+    else:
+        etag = "{:x}-{:x}".format(stat.st_mtime_ns, stat.st_size)
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    if mode == "x-sendfile":
+        rv = Response(mimetype=mimetype)
+        rv.headers["X-Sendfile"] = path
+    elif mode == "x-accel-redirect":
+        rv = Response(mimetype=mimetype)
+        rv.headers["X-Accel-Redirect"] = conf.get(
+            "X_ACCEL_REDIRECT_PREFIX", "/protected_media/"
+        ).rstrip("/") + "/" + filename.lstrip("/")
+    else:
+        rv = Response(
+            wrap_file(request.environ, open(path, "rb")),
+            mimetype=mimetype,
+            direct_passthrough=True,
+        )
+        rv.content_length = stat.st_size
+
+    rv.set_etag(etag)
+    rv.last_modified = int(stat.st_mtime)
+    if content_addressed:
+        rv.headers["Cache-Control"] = "public, max-age={}, immutable".format(
+            conf.get("IMMUTABLE_MAX_AGE", 31536000)
+        )
+    else:
+        rv.headers["Cache-Control"] = "public, max-age={}".format(
+            conf.get("MAX_AGE", 3600)
+        )
+
+    if mode == "flask":
+        return rv.make_conditional(
+            request, accept_ranges=True, complete_length=stat.st_size
+        )
+    # Range requests are handled by the web server
+    return rv.make_conditional(request)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to expose Prometheus metrics
+
+Enabled with ``METRICS.ENABLED`` (requires ``prometheus_client``). When
+``METRICS.MULTIPROC_DIR`` is set, every gunicorn worker writes its samples in
+memory mapped files of this directory so that ``/api/metrics`` aggregates all
+workers, whichever one answers the scrape.
+"""
+
+import logging
+import os
+import shutil
+import time
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+"""Request duration buckets (s)"""
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = {}
+
+
+def is_enabled():
+    return bool(_metrics)
+
+
+def _define_metrics(prometheus_client):
+    Counter = prometheus_client.Counter
+    Gauge = prometheus_client.Gauge
+    Histogram = prometheus_client.Histogram
+    return {
+        "requests": Counter(
+            "gnc_http_requests_total",
+            "HTTP requests by blueprint, method and status",
+            ["blueprint", "method", "status"],
+        ),
+        "latency": Histogram(
+            "gnc_http_request_duration_seconds",
+            "HTTP request duration by blueprint and endpoint",
+            ["blueprint", "endpoint"],
+            buckets=LATENCY_BUCKETS,
+        ),
+        "exceptions": Counter(
+            "gnc_http_exceptions_total",
+            "Unhandled exceptions by blueprint",
+            ["blueprint"],
+        ),
+        "cache": Counter(
+            "gnc_cache_requests_total", "Cache lookups by result", ["cache", "result"]
+        ),
+        "taxhub_latency": Histogram(
+            "gnc_taxhub_request_duration_seconds",
+            "TaxHub API calls duration",
+            ["call"],
+            buckets=LATENCY_BUCKETS,
+        ),
+        "taxhub_errors": Counter(
+            "gnc_taxhub_errors_total", "Failed TaxHub API calls", ["call"]
+        ),
+        "upload_bytes": Counter(
+            "gnc_upload_bytes_total", "Uploaded bytes saved in media dir"
+        ),
+        "uploads": Counter("gnc_uploads_total", "Uploaded files saved in media dir"),
+        "db_pool_checked_out": Gauge(
+            "gnc_db_pool_checked_out",
+            "Checked out database connections",
+            multiprocess_mode="livesum",
+        ),
+        "db_pool_overflow": Gauge(
+            "gnc_db_pool_overflow",
+            "Overflow database connections",
+            multiprocess_mode="livesum",
+        ),
+        "db_pool_size": Gauge(
+            "gnc_db_pool_size", "Database pool size", multiprocess_mode="livesum"
+        ),
+        "db_pool_timeouts": Counter(
+            "gnc_db_pool_timeouts_total", "Database pool checkout timeouts"
+        ),
+        "db_pool_wait": Histogram(
+            "gnc_db_pool_wait_seconds",
+            "Database pool checkout wait time",
+            buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+        ),
+    }
+
+
+def init_metrics(app, engine=None):
+    """Define metrics and register request hooks
+
+    :param app: flask app
+    :type app: flask.Flask
+    :param engine: SQLAlchemy engine whose pool state is reported
+    :type engine: sqlalchemy.engine.Engine
+    """
+    conf = app.config.get("METRICS", {})
+    if not conf.get("ENABLED", False):
+        return
+    set_multiproc_env(conf.get("MULTIPROC_DIR"))
+    try:
+        import prometheus_client
+    except ImportError:
+        app.logger.error("[metrics] METRICS.ENABLED requires prometheus_client")
+        return
+    if not _metrics:
+        _metrics.update(_define_metrics(prometheus_client))
+
+    @app.before_request
+    def _start_timer():
+        request.environ["gnc.metrics_start"] = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = request.environ.get("gnc.metrics_start")
+        blueprint = request.blueprint or "none"
+        _metrics["requests"].labels(
+            blueprint, request.method, response.status_code
+        ).inc()
+        if start is not None:
+            _metrics["latency"].labels(blueprint, request.endpoint or "none").observe(
+                time.perf_counter() - start
+            )
+        if engine is not None:
+            observe_pool(engine.pool)
+        return response
+
+    @app.teardown_request
+    def _observe_exception(exc):
+        if exc is not None:
+            _metrics["exceptions"].labels(request.blueprint or "none").inc()
+
+
+def observe_pool(pool):
+    """Report the pool state of this process"""
+    if not _metrics or not hasattr(pool, "checkedout"):
+        return
+    _metrics["db_pool_checked_out"].set(pool.checkedout())
+    _metrics["db_pool_overflow"].set(max(pool.overflow(), 0))
+    _metrics["db_pool_size"].set(pool.size())
+
+
+def observe_pool_checkout(wait_time, timeout=False):
+    if not _metrics:
+        return
+    _metrics["db_pool_wait"].observe(wait_time)
+    if timeout:
+        _metrics["db_pool_timeouts"].inc()
+
+
+def observe_cache(cache, hit):
+    if _metrics:
+        _metrics["cache"].labels(cache, "hit" if hit else "miss").inc()
+
+
+def observe_taxhub_call(call, duration, failed=False):
+    if not _metrics:
+        return
+    _metrics["taxhub_latency"].labels(call).observe(duration)
+    if failed:
+        _metrics["taxhub_errors"].labels(call).inc()
+
+
+def observe_upload(size):
+    if _metrics:
+        _metrics["uploads"].inc()
+        _metrics["upload_bytes"].inc(size)
+
+
+def generate_metrics():
+    """Return the Prometheus text exposition and its content type"""
+    import prometheus_client
+
+    if os.environ.get(MULTIPROC_ENV):
+        from prometheus_client import multiprocess
+
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def set_multiproc_env(path):
+    """Set ``PROMETHEUS_MULTIPROC_DIR`` from ``METRICS.MULTIPROC_DIR``
+
+    Called by the gunicorn master (``on_starting``, so that ``child_exit``
+    can mark dead workers) and by each app, a value already set in the
+    environment is kept.
+
+    :return: multiprocess directory, None in single process mode
+    :rtype: str
+    """
+    if path:
+        os.makedirs(path, exist_ok=True)
+        os.environ.setdefault(MULTIPROC_ENV, path)
+    return os.environ.get(MULTIPROC_ENV)
+
+
+def clear_multiproc_dir(path):
+    """Remove samples of a previous run (to call before forking workers)"""
+    if path and os.path.isdir(path):
+        shutil.rmtree(path)
+    if path:
+        os.makedirs(path, exist_ok=True)
+
+
+def mark_worker_dead(pid):
+    """Gunicorn ``child_exit`` hook: drop live gauges of a dead worker"""
+    if os.environ.get(MULTIPROC_ENV):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to manage the database schema with Alembic
+
+Revisions are stored in ``backend/migrations/versions`` and generated from
+the models (``flask db-revision --autogenerate``). Only the GeoNature-citizen
+schemas are managed, ``ref_geo`` and ``taxonomie`` belong to their own
+applications.
+
+Large tables must be migrated without long locks, revisions use the helpers
+of this module for that:
+
+    * ``create_index_concurrently`` builds an index without blocking writes
+    * ``batched_backfill`` fills a new column by small committed batches
+
+Columns are added nullable and without default (a metadata only change),
+backfilled, then constrained in a later revision.
+
+The schema is created or upgraded under a session advisory lock
+(``migration_lock``): gunicorn workers, the master and ``flask db-upgrade``
+never migrate at the same time, the next one finds the schema up to date.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+import click
+from alembic import command
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, text
+
+from gncitizen.utils.env import BACKEND_DIR
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = BACKEND_DIR / "migrations"
+MANAGED_SCHEMAS = ("gnc_core", "gnc_obstax", "gnc_sites")
+
+"""Revision matching the schema created by versions up to 0.99.2"""
+BASELINE_REVISION = "0001_baseline"
+
+"""Key of the advisory lock held while the schema is created or upgraded"""
+MIGRATION_LOCK = 20210101
+
+
+def get_alembic_config():
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    return config
+
+
+def get_current_heads(engine):
+    with engine.connect() as conn:
+        return set(MigrationContext.configure(conn).get_current_heads())
+
+
+def get_script_heads():
+    return set(ScriptDirectory.from_config(get_alembic_config()).get_heads())
+
+
+def is_schema_up_to_date(engine):
+    """Check that the database is at the latest revision
+
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy.engine.Engine
+
+    :return: True if up to date
+    :rtype: bool
+    """
+    return get_current_heads(engine) == get_script_heads()
+
+
+@contextmanager
+def migration_lock(engine):
+    """Wait for the other migrations of the database, then block them
+
+    The lock is held by a dedicated autocommit connection: an idle
+    transaction would stall ``CREATE INDEX CONCURRENTLY``.
+
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy.engine.Engine
+    """
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(select([func.pg_advisory_lock(MIGRATION_LOCK)]))
+        try:
+            yield
+        finally:
+            conn.execute(select([func.pg_advisory_unlock(MIGRATION_LOCK)]))
+
+
+def upgrade_db(db, revision="heads"):
+    """Create or upgrade the schema to ``revision``
+
+    A new database is created from the models then stamped at the latest
+    revision. A database created before migrations were introduced is
+    stamped at the baseline revision then upgraded.
+
+    Must be called under ``migration_lock``.
+
+    :param db: flask_sqlalchemy db
+    """
+    if revision == "heads" and is_schema_up_to_date(db.engine):
+        # Already migrated by another process
+        return
+    config = get_alembic_config()
+    if not get_current_heads(db.engine):
+        with db.engine.connect() as conn:
+            legacy = db.engine.dialect.has_table(conn, "t_users", schema="gnc_core")
+        if legacy:
+            logger.info("[migrations] existing database, stamp baseline")
+            command.stamp(config, BASELINE_REVISION)
+        else:
+            logger.info("[migrations] new database, create tables")
+            db.create_all()
+            command.stamp(config, "heads")
+            return
+    command.upgrade(config, revision)
+
+
+def create_index_concurrently(
+    op, name, table, columns, schema=None, using=None, unique=False
+):
+    """Build an index without locking writes (``CREATE INDEX CONCURRENTLY``)
+
+    Must be called from a revision, outside of its transaction (the helper
+    opens an autocommit block). Safe to run again after a failure.
+
+    Partitioned tables (see ``flask db-partition``) do not support concurrent
+    builds, their index is built on each partition with a lock.
+
+    :param op: alembic op
+    :param name: index name
+    :type name: str
+    :param table: table name
+    :type table: str
+    :param columns: indexed columns or expressions
+    :type columns: list
+    :param schema: table schema
+    :type schema: str
+    :param using: index method (eg: ``gist``)
+    :type using: str
+    :param unique: unique index
+    :type unique: bool
+    """
+    with op.get_context().autocommit_block():
+        # An interrupted concurrent build leaves an invalid index behind
+        op.execute(
+            text(
+                """DO $$ BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE c.relname = '{name}' AND n.nspname = '{schema}'
+                    AND NOT i.indisvalid
+                ) THEN
+                    DROP INDEX {schema}.{name};
+                END IF;
+                END $$""".format(
+                    name=name, schema=schema or "public"
+                )
+            )
+        )
+        qualified_table = "{}.{}".format(schema, table) if schema else table
+        partitioned = (
+            op.get_bind()
+            .execute(
+                text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+                {"table": qualified_table},
+            )
+            .scalar()
+            == "p"
+        )
+        op.execute(
+            "CREATE {unique}INDEX {concurrently}IF NOT EXISTS {name} "
+            "ON {table} {using}({columns})".format(
+                unique="UNIQUE " if unique else "",
+                concurrently="" if partitioned else "CONCURRENTLY ",
+                name=name,
+                table=qualified_table,
+                using="USING {} ".format(using) if using else "",
+                columns=", ".join(columns),
+            )
+        )
+
+
+def drop_index_concurrently(op, name, schema=None):
+    with op.get_context().autocommit_block():
+        op.execute(
+            "DROP INDEX CONCURRENTLY IF EXISTS {}".format(
+                "{}.{}".format(schema, name) if schema else name
+            )
+        )
+
+
+def batched_backfill(
+    op,
+    table,
+    set_clause,
+    where_clause,
+    pk="id",
+    schema=None,
+    batch_size=10000,
+    pause=0,
+):
+    """Update rows by committed batches of ``batch_size`` rows
+
+    Each batch only locks the rows it updates, so the table stays usable and
+    the backfill can be interrupted and resumed (``where_clause`` must
+    select the rows still to update, eg: ``new_column IS NULL``).
+
+    :param op: alembic op
+    :param table: table name
+    :type table: str
+    :param set_clause: SET clause (eg: ``year = extract(year from date)``)
+    :type set_clause: str
+    :param where_clause: rows still to update (eg: ``year IS NULL``)
+    :type where_clause: str
+    :param pk: primary key column
+    :type pk: str
+    :param schema: table schema
+    :type schema: str
+    :param batch_size: rows updated per transaction
+    :type batch_size: int
+    :param pause: sleep (s) between batches to limit the load
+    :type pause: float
+
+    :return: updated rows
+    :rtype: int
+    """
+    name = "{}.{}".format(schema, table) if schema else table
+    sql = text(
+        """UPDATE {name} SET {set_clause}
+        WHERE {pk} IN (
+            SELECT {pk} FROM {name} WHERE {where_clause}
+            LIMIT :batch_size FOR UPDATE SKIP LOCKED
+        )""".format(
+            name=name, set_clause=set_clause, pk=pk, where_clause=where_clause
+        )
+    )
+    total = 0
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        while True:
+            updated = conn.execute(sql, {"batch_size": batch_size}).rowcount
+            total += updated
+            if updated:
+                logger.info("[migrations] %s: %s rows backfilled", name, total)
+            if updated < batch_size:
+                return total
+            if pause:
+                time.sleep(pause)
+
+
+@click.command("db-upgrade")
+@click.argument("revision", default="heads")
+@with_appcontext
+def db_upgrade_command(revision):
+    """Upgrade the database schema (to the latest revision by default)"""
+    from gncitizen.utils.env import db
+
+    with migration_lock(db.engine):
+        upgrade_db(db, revision)
+    click.echo(
+        "Database at revision {}".format(", ".join(get_current_heads(db.engine)))
+    )
+
+
+@click.command("db-check")
+@with_appcontext
+def db_check_command():
+    """Exit with status 1 if the database schema is not up to date"""
+    from gncitizen.utils.env import db
+
+    current, heads = get_current_heads(db.engine), get_script_heads()
+    if current != heads:
+        click.echo(
+            "Database at revision {} instead of {}, run `flask db-upgrade`".format(
+                ", ".join(current) or "none", ", ".join(heads)
+            ),
+            err=True,
+        )
+        raise SystemExit(1)
+    click.echo("Database is up to date ({})".format(", ".join(heads)))
+
+
+@click.command("db-revision")
+@click.option("-m", "--message", required=True, help="Revision message")
+@click.option("--autogenerate", is_flag=True, help="Compare models and database")
+@with_appcontext
+def db_revision_command(message, autogenerate):
+    """Create a new revision in backend/migrations/versions"""
+    command.revision(get_alembic_config(), message=message, autogenerate=autogenerate)
+
+
+@click.command("db-stamp")
+@click.argument("revision")
+@with_appcontext
+def db_stamp_command(revision):
+    """Record a revision without running migrations"""
+    command.stamp(get_alembic_config(), revision)
+
+
+COMMANDS = (
+    db_upgrade_command,
+    db_check_command,
+    db_revision_command,
+    db_stamp_command,
+)
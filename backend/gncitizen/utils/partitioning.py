@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to partition the largest tables (observations, visits)
+
+Partitioning is optional and set in the ``[PARTITIONING]`` config section:
+by program (``LIST``) or by year of creation (``RANGE``), among the
+strategies declared by the ``__partitioning__`` attribute of the models.
+``flask db-partition`` converts an existing table while the API is running:
+
+    1. a partitioned copy of the table is created with its constraints
+       (the partition key is added to primary and unique keys), indexes and
+       partitions, plus a default partition;
+    2. a trigger mirrors the writes on the table into the copy while the
+       existing rows are copied by committed batches;
+    3. both tables are swapped in a short transaction. Foreign keys
+       referencing the table (medias, sites) are replaced by a trigger, as
+       PostgreSQL can only reference a partitioned table on its whole
+       partition key. The former table is kept as ``<table>_unpartitioned``
+       until it is dropped by hand.
+
+Run again (eg: daily by cron), the command creates the missing partitions
+(next years, new programs) and moves their rows out of the default
+partition. Requires PostgreSQL 11 or later.
+"""
+
+import logging
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITIONING_CONFIG = {
+    "OBSERVATIONS": "",
+    "VISITS": "",
+    "BATCH_SIZE": 10000,
+    "BATCH_PAUSE": 0,
+    "YEARS_AHEAD": 1,
+}
+
+"""Partitioning method of each strategy"""
+METHODS = {"program": "LIST", "year": "RANGE"}
+
+COPY_SUFFIX = "_partitioned"
+INDEX_SUFFIX = "_part"
+OLD_SUFFIX = "_unpartitioned"
+
+"""Actions replacing ``ON DELETE`` of the foreign keys referencing the table"""
+ON_DELETE_ACTIONS = {
+    "c": "DELETE FROM {table} WHERE {column} = OLD.{pk};",
+    "n": "UPDATE {table} SET {column} = NULL WHERE {column} = OLD.{pk};",
+    "d": "UPDATE {table} SET {column} = DEFAULT WHERE {column} = OLD.{pk};",
+}
+RESTRICT_ACTION = """IF EXISTS (SELECT 1 FROM {table} WHERE {column} = OLD.{pk})
+        THEN
+            RAISE EXCEPTION 'row still referenced from {table}'
+            USING ERRCODE = 'foreign_key_violation';
+        END IF;"""
+
+
+def get_partitioning_config(app=None):
+    conf = dict(DEFAULT_PARTITIONING_CONFIG)
+    conf.update((app or current_app).config.get("PARTITIONING", {}))
+    return conf
+
+
+def get_partitioned_models():
+    """Models which can be partitioned, by ``[PARTITIONING]`` key"""
+    from gncitizen.core.observations.models import ObservationModel
+    from gncitizen.core.sites.models import VisitModel
+
+    return {"OBSERVATIONS": ObservationModel, "VISITS": VisitModel}
+
+
+def get_strategy(model, conf=None):
+    conf = conf or get_partitioning_config()
+    for key, partitioned_model in get_partitioned_models().items():
+        if partitioned_model is model:
+            return conf.get(key) or None
+    return None
+
+
+def partition_clauses(instance):
+    """Filter on the partition key of a loaded row
+
+    Added to updates and deletes so that PostgreSQL only scans the row
+    partition instead of probing the primary key index of each of them.
+
+    :param instance: loaded row
+    :type instance: db.Model
+
+    :return: SQLAlchemy filters (empty when the table is not partitioned)
+    :rtype: list
+    """
+    model = type(instance)
+    key = getattr(model, "__partitioning__", {}).get(get_strategy(model))
+    if key is None:
+        return []
+    return [getattr(model, key) == getattr(instance, key)]
+
+
+class PartitionedTable(object):
+    """Table of a model partitioned with one of its strategies"""
+
+    def __init__(self, model, strategy):
+        if strategy not in getattr(model, "__partitioning__", {}):
+            raise ValueError(
+                "{} can not be partitioned by {}".format(model.__name__, strategy)
+            )
+        self.strategy = strategy
+        self.key = model.__partitioning__[strategy]
+        self.schema = model.__table__.schema
+        self.name = model.__table__.name
+        self.pk = model.__table__.primary_key.columns.values()[0].name
+
+    def qualified(self, name=None):
+        return "{}.{}".format(self.schema, name or self.name)
+
+    @property
+    def copy(self):
+        return self.qualified(self.name + COPY_SUFFIX)
+
+    @property
+    def default(self):
+        return self.qualified(self.name + "_default")
+
+    @property
+    def partition_by(self):
+        return "{} ({})".format(METHODS[self.strategy], self.key)
+
+    def partition_name(self, bound):
+        return "{}_{}{}".format(self.name, self.strategy[0], bound)
+
+    def bound_sql(self, bound):
+        if self.strategy == "program":
+            return "FOR VALUES IN ({:d})".format(bound)
+        return "FOR VALUES FROM ('{:d}-01-01') TO ('{:d}-01-01')".format(
+            bound, bound + 1
+        )
+
+    def bound_condition(self, bound):
+        if self.strategy == "program":
+            return "{} = {:d}".format(self.key, bound)
+        return "{key} >= '{:d}-01-01' AND {key} < '{:d}-01-01'".format(
+            bound, bound + 1, key=self.key
+        )
+
+    def get_bounds(self, conn, source, years_ahead=1):
+        """Bounds of the partitions to create (programs or years)"""
+        if self.strategy == "program":
+            return [
+                row[0]
+                for row in conn.execute(
+                    text("SELECT id_program FROM gnc_core.t_programs")
+                )
+            ]
+        first = conn.execute(
+            text("SELECT min({}) FROM {}".format(self.key, source))
+        ).scalar()
+        this_year = datetime.utcnow().year
+        return list(
+            range(first.year if first else this_year, this_year + 1 + years_ahead)
+        )
+
+
+def get_relkind(conn, schema, name):
+    return conn.execute(
+        text("""SELECT c.relkind FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema AND c.relname = :name"""),
+        {"schema": schema, "name": name},
+    ).scalar()
+
+
+def get_partitions(conn, parent):
+    return {
+        row[0]
+        for row in conn.execute(
+            text("""SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = CAST(:parent AS regclass)"""),
+            {"parent": parent},
+        )
+    }
+
+
+def get_columns(conn, table):
+    return [
+        row[0]
+        for row in conn.execute(
+            text("""SELECT attname FROM pg_attribute
+                WHERE attrelid = CAST(:table AS regclass)
+                AND attnum > 0 AND NOT attisdropped
+                ORDER BY attnum"""),
+            {"table": table},
+        )
+    ]
+
+
+def get_index_names(conn, table):
+    return [
+        row[0]
+        for row in conn.execute(
+            text("""SELECT i.relname FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = CAST(:table AS regclass)"""),
+            {"table": table},
+        )
+    ]
+
+
+def get_references(conn, table):
+    """Single column foreign keys referencing ``table``"""
+    return conn.execute(
+        text("""SELECT c.conname AS name,
+                CAST(CAST(c.conrelid AS regclass) AS text) AS ref_table,
+                a.attname AS ref_column,
+                c.confdeltype AS on_delete
+            FROM pg_constraint c
+            JOIN pg_attribute a
+                ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+            WHERE c.contype = 'f' AND c.confrelid = CAST(:table AS regclass)"""),
+        {"table": table},
+    ).fetchall()
+
+
+def create_partition(conn, table, parent, bound):
+    """Create a partition, moving its rows out of the default partition"""
+    name = table.qualified(table.partition_name(bound))
+    conn.execute(
+        text(
+            "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)".format(
+                name, parent
+            )
+        )
+    )
+    # Moved rows are not logged as deleted (see gnc_core.log_deletion)
+    conn.execute(text("SET LOCAL gnc.log_deletions = 'off'"))
+    conn.execute(
+        text(
+            """WITH moved AS (DELETE FROM {} WHERE {} RETURNING *)
+            INSERT INTO {} SELECT * FROM moved""".format(
+                table.default, table.bound_condition(bound), name
+            )
+        )
+    )
+    conn.execute(text("SET LOCAL gnc.log_deletions = 'on'"))
+    conn.execute(
+        text(
+            "ALTER TABLE {} ATTACH PARTITION {} {}".format(
+                parent, name, table.bound_sql(bound)
+            )
+        )
+    )
+
+
+def ensure_partitions(engine, table, parent, source=None, years_ahead=1):
+    """Create the default partition and the missing ones
+
+    :param engine: SQLAlchemy engine
+    :param table: partitioned table
+    :type table: PartitionedTable
+    :param parent: qualified name of the partitioned table
+    :type parent: str
+    :param source: table giving the first year (defaults to ``parent``)
+    :type source: str
+    :param years_ahead: yearly partitions created in advance
+    :type years_ahead: int
+
+    :return: created partitions
+    :rtype: list
+    """
+    with engine.connect() as conn:
+        existing = get_partitions(conn, parent)
+        bounds = table.get_bounds(conn, source or parent, years_ahead)
+    created = []
+    if table.name + "_default" not in existing:
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "CREATE TABLE {} PARTITION OF {} DEFAULT".format(
+                        table.default, parent
+                    )
+                )
+            )
+        created.append(table.name + "_default")
+    for bound in bounds:
+        name = table.partition_name(bound)
+        if name in existing:
+            continue
+        # One transaction per partition, the parent is locked while attaching
+        with engine.begin() as conn:
+            create_partition(conn, table, parent, bound)
+        logger.info("[partitioning] partition %s created", name)
+        created.append(name)
+    return created
+
+
+def create_partitioned_copy(engine, table, years_ahead=1):
+    """Create an empty partitioned copy of the table"""
+    source, copy = table.qualified(), table.copy
+    with engine.begin() as conn:
+        conn.execute(
+            text("""CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+                PARTITION BY {}""".format(copy, source, table.partition_by))
+        )
+        # Primary and unique keys must include the partition key
+        keys = conn.execute(
+            text("""SELECT c.contype, array_agg(a.attname ORDER BY k.ord)
+                FROM pg_constraint c
+                CROSS JOIN LATERAL unnest(c.conkey) WITH ORDINALITY AS k(attnum, ord)
+                JOIN pg_attribute a
+                    ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+                WHERE c.conrelid = CAST(:table AS regclass)
+                AND c.contype IN ('p', 'u')
+                GROUP BY c.oid, c.contype
+                ORDER BY c.contype"""),
+            {"table": source},
+        ).fetchall()
+        added = set()
+        for contype, columns in keys:
+            if table.key not in columns:
+                columns = list(columns) + [table.key]
+            if tuple(columns) in added:
+                continue
+            added.add(tuple(columns))
+            conn.execute(
+                text(
+                    "ALTER TABLE {} ADD {} ({})".format(
+                        copy,
+                        "PRIMARY KEY" if contype == "p" else "UNIQUE",
+                        ", ".join(columns),
+                    )
+                )
+            )
+        foreign_keys = conn.execute(
+            text("""SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"""),
+            {"table": source},
+        ).fetchall()
+        for name, definition in foreign_keys:
+            conn.execute(
+                text(
+                    "ALTER TABLE {} ADD CONSTRAINT {} {}".format(copy, name, definition)
+                )
+            )
+        indexes = conn.execute(
+            text("""SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = CAST(:table AS regclass)
+                AND NOT EXISTS (
+                    SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid
+                )"""),
+            {"table": source},
+        ).fetchall()
+        for name, definition in indexes:
+            definition = definition.replace(
+                "INDEX {} ON {} ".format(name, source),
+                "INDEX {}{} ON {} ".format(name, INDEX_SUFFIX, copy),
+            )
+            if definition.startswith("CREATE UNIQUE") and table.key not in definition:
+                definition = "{}, {})".format(definition[:-1], table.key)
+            conn.execute(text(definition))
+    ensure_partitions(engine, table, copy, source, years_ahead)
+
+
+def install_mirror_trigger(engine, table):
+    """Mirror the writes on the table into its partitioned copy"""
+    source, copy = table.qualified(), table.copy
+    with engine.begin() as conn:
+        assignments = ", ".join(
+            '"{0}" = EXCLUDED."{0}"'.format(column)
+            for column in get_columns(conn, source)
+        )
+        conn.execute(
+            text(
+                """CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        DELETE FROM {copy} WHERE {pk} = OLD.{pk};
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        INSERT INTO {copy} SELECT NEW.*
+                        ON CONFLICT ({pk}, {key}) DO UPDATE SET {assignments};
+                    END IF;
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql""".format(
+                    function=table.qualified(table.name + "_mirror"),
+                    copy=copy,
+                    pk=table.pk,
+                    key=table.key,
+                    assignments=assignments,
+                )
+            )
+        )
+        conn.execute(
+            text("DROP TRIGGER IF EXISTS {0}_mirror ON {1}".format(table.name, source))
+        )
+        conn.execute(
+            text(
+                """CREATE TRIGGER {0}_mirror
+                AFTER INSERT OR UPDATE OR DELETE ON {1}
+                FOR EACH ROW EXECUTE PROCEDURE {2}()""".format(
+                    table.name, source, table.qualified(table.name + "_mirror")
+                )
+            )
+        )
+
+
+def copy_rows(engine, table, batch_size=10000, pause=0):
+    """Copy the rows of the table into its partitioned copy by batches
+
+    Each batch is committed, rows written in the meantime are copied by the
+    mirror trigger.
+
+    :return: copied rows
+    :rtype: int
+    """
+    source, copy, pk = table.qualified(), table.copy, table.pk
+    last, total = 0, 0
+    while True:
+        with engine.begin() as conn:
+            upto = conn.execute(
+                text("""SELECT max({pk}) FROM (
+                        SELECT {pk} FROM {source} WHERE {pk} > :last
+                        ORDER BY {pk} LIMIT :batch_size
+                    ) AS batch""".format(pk=pk, source=source)),
+                {"last": last, "batch_size": batch_size},
+            ).scalar()
+            if upto is None:
+                return total
+            total += conn.execute(
+                text("""INSERT INTO {copy} SELECT * FROM {source}
+                    WHERE {pk} > :last AND {pk} <= :upto
+                    ON CONFLICT DO NOTHING""".format(copy=copy, source=source, pk=pk)),
+                {"last": last, "upto": upto},
+            ).rowcount
+        last = upto
+        logger.info("[partitioning] %s: %s rows copied", source, total)
+        if pause:
+            time.sleep(pause)
+
+
+def swap_tables(engine, table):
+    """Replace the table by its partitioned copy"""
+    source, copy = table.qualified(), table.copy
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE".format(source)))
+        conn.execute(text("DROP TRIGGER {}_mirror ON {}".format(table.name, source)))
+        conn.execute(
+            text("DROP FUNCTION {}()".format(table.qualified(table.name + "_mirror")))
+        )
+        triggers = [
+            row[0]
+            for row in conn.execute(
+                text("""SELECT pg_get_triggerdef(oid) FROM pg_trigger
+                    WHERE tgrelid = CAST(:table AS regclass) AND NOT tgisinternal"""),
+                {"table": source},
+            )
+        ]
+        references = get_references(conn, source)
+        for reference in references:
+            conn.execute(
+                text(
+                    "ALTER TABLE {} DROP CONSTRAINT {}".format(
+                        reference.ref_table, reference.name
+                    )
+                )
+            )
+        sequence = conn.execute(
+            text("SELECT pg_get_serial_sequence(:table, :pk)"),
+            {"table": source, "pk": table.pk},
+        ).scalar()
+
+        for index in get_index_names(conn, source):
+            conn.execute(
+                text(
+                    "ALTER INDEX {} RENAME TO {}{}".format(
+                        table.qualified(index),
+                        index[: 63 - len(OLD_SUFFIX)],
+                        OLD_SUFFIX,
+                    )
+                )
+            )
+        for index in get_index_names(conn, copy):
+            if index.endswith(INDEX_SUFFIX):
+                new_name = index[: -len(INDEX_SUFFIX)]
+            else:
+                new_name = index.replace(table.name + COPY_SUFFIX, table.name, 1)
+            conn.execute(
+                text(
+                    "ALTER INDEX {} RENAME TO {}".format(
+                        table.qualified(index), new_name
+                    )
+                )
+            )
+        conn.execute(
+            text("ALTER TABLE {} RENAME TO {}{}".format(source, table.name, OLD_SUFFIX))
+        )
+        conn.execute(text("ALTER TABLE {} RENAME TO {}".format(copy, table.name)))
+        if sequence:
+            # Otherwise dropped with the former table
+            conn.execute(
+                text(
+                    "ALTER SEQUENCE {} OWNED BY {}.{}".format(
+                        sequence, source, table.pk
+                    )
+                )
+            )
+        # Definitions read before renaming, they apply to the new table
+        for trigger in triggers:
+            conn.execute(text(trigger))
+        if references:
+            create_references_trigger(conn, table, references)
+
+
+def create_references_trigger(conn, table, references):
+    """Apply ``ON DELETE`` of the dropped foreign keys with a trigger"""
+    actions = "\n        ".join(
+        ON_DELETE_ACTIONS.get(reference.on_delete, RESTRICT_ACTION).format(
+            table=reference.ref_table, column=reference.ref_column, pk=table.pk
+        )
+        for reference in references
+    )
+    function = table.qualified(table.name + "_on_delete")
+    conn.execute(
+        text(
+            """CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+            BEGIN
+                -- An update of the partition key moves the row
+                IF EXISTS (SELECT 1 FROM {source} WHERE {pk} = OLD.{pk}) THEN
+                    RETURN NULL;
+                END IF;
+                {actions}
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql""".format(
+                function=function,
+                source=table.qualified(),
+                pk=table.pk,
+                actions=actions,
+            )
+        )
+    )
+    conn.execute(
+        text(
+            """CREATE TRIGGER {}_on_delete AFTER DELETE ON {}
+            FOR EACH ROW EXECUTE PROCEDURE {}()""".format(
+                table.name, table.qualified(), function
+            )
+        )
+    )
+
+
+def partition_table(engine, model, strategy, conf):
+    """Partition the table of a model, or create its missing partitions
+
+    :param engine: SQLAlchemy engine
+    :param model: partitionable model
+    :param strategy: ``program`` or ``year``
+    :type strategy: str
+    :param conf: ``[PARTITIONING]`` config section
+    :type conf: dict
+
+    :return: created partitions
+    :rtype: list
+    """
+    table = PartitionedTable(model, strategy)
+    source = table.qualified()
+    with engine.connect() as conn:
+        relkind = get_relkind(conn, table.schema, table.name)
+        if relkind == "p":
+            partition_by = conn.execute(
+                text("SELECT pg_get_partkeydef(CAST(:table AS regclass))"),
+                {"table": source},
+            ).scalar()
+            if partition_by != table.partition_by:
+                raise ValueError(
+                    "{} is already partitioned by {}".format(source, partition_by)
+                )
+            return ensure_partitions(
+                engine, table, source, years_ahead=conf["YEARS_AHEAD"]
+            )
+        copy_exists = (
+            get_relkind(conn, table.schema, table.name + COPY_SUFFIX) is not None
+        )
+    # A copy left by an interrupted conversion is resumed
+    if not copy_exists:
+        create_partitioned_copy(engine, table, conf["YEARS_AHEAD"])
+    install_mirror_trigger(engine, table)
+    copy_rows(engine, table, conf["BATCH_SIZE"], conf["BATCH_PAUSE"])
+    # Programs created during the copy
+    created = ensure_partitions(
+        engine, table, table.copy, source, years_ahead=conf["YEARS_AHEAD"]
+    )
+    swap_tables(engine, table)
+    logger.info("[partitioning] %s partitioned by %s", source, table.partition_by)
+    return created
+
+
+def ensure_all_partitions(app=None):
+    """Create the missing partitions of the partitioned tables
+
+    Called when a program is created, so that its observations do not land
+    in the default partition.
+    """
+    from gncitizen.utils.env import db
+
+    conf = get_partitioning_config(app)
+    for key, model in get_partitioned_models().items():
+        strategy = conf.get(key)
+        if not strategy:
+            continue
+        table = PartitionedTable(model, strategy)
+        with db.engine.connect() as conn:
+            relkind = get_relkind(conn, table.schema, table.name)
+        if relkind == "p":
+            ensure_partitions(
+                db.engine, table, table.qualified(), years_ahead=conf["YEARS_AHEAD"]
+            )
+
+
+@click.command("db-partition")
+@click.argument("tables", nargs=-1, type=click.Choice(["observations", "visits"]))
+@with_appcontext
+def db_partition_command(tables):
+    """Partition tables as set in [PARTITIONING], create missing partitions"""
+    from gncitizen.utils.env import db
+
+    conf = get_partitioning_config()
+    models = get_partitioned_models()
+    for name in tables or ("observations", "visits"):
+        key = name.upper()
+        strategy = conf.get(key)
+        if not strategy:
+            click.echo("{}: not partitioned ([PARTITIONING] {})".format(name, key))
+            continue
+        try:
+            created = partition_table(db.engine, models[key], strategy, conf)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(
+            "{}: partitioned by {}, {} partition(s) created".format(
+                name, strategy, len(created)
+            )
+        )
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to hash and verify user passwords
+
+Hashes are handled by a passlib ``CryptContext`` built from the
+``[PASSWORDS]`` config section: new passwords are hashed with the first
+available scheme of ``SCHEMES`` (argon2 by default) and hashes of the other
+schemes are upgraded when their owner logs in (``verify_password``).
+
+Hashing is CPU bound, it runs in a bounded thread pool so that a burst of
+logins only occupies ``THREADS`` cores and fails fast (``PasswordHashingBusy``)
+instead of piling up requests when ``MAX_PENDING`` hashes are already waiting.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from passlib import hash as passlib_hash
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCHEMES = ["argon2", "bcrypt", "pbkdf2_sha256"]
+
+"""[PASSWORDS] keys mapped to CryptContext settings"""
+SCHEME_SETTINGS = {
+    "ARGON2_TIME_COST": "argon2__time_cost",
+    "ARGON2_MEMORY_COST": "argon2__memory_cost",
+    "ARGON2_PARALLELISM": "argon2__parallelism",
+    "BCRYPT_ROUNDS": "bcrypt__rounds",
+    "PBKDF2_ROUNDS": "pbkdf2_sha256__rounds",
+}
+
+
+class PasswordHashingBusy(Exception):
+    """Too many password hashes are pending"""
+
+
+def get_password_config(app=None):
+    return (app or current_app).config.get("PASSWORDS", {})
+
+
+def has_backend(scheme):
+    handler = getattr(passlib_hash, scheme, None)
+    if handler is None:
+        return False
+    return not hasattr(handler, "has_backend") or handler.has_backend()
+
+
+def build_crypt_context(conf):
+    """Build a CryptContext from the ``[PASSWORDS]`` config section
+
+    Schemes whose backend is not installed (``argon2-cffi``, ``bcrypt``) are
+    skipped. pbkdf2_sha256, used by previous versions, is always kept so
+    that existing hashes can still be verified.
+
+    :param conf: ``[PASSWORDS]`` config section
+    :type conf: dict
+
+    :return: passlib context
+    :rtype: passlib.context.CryptContext
+    """
+    schemes = []
+    for scheme in list(conf.get("SCHEMES", DEFAULT_SCHEMES)) + ["pbkdf2_sha256"]:
+        if scheme in schemes:
+            continue
+        if has_backend(scheme):
+            schemes.append(scheme)
+        else:
+            logger.warning("[passwords] no backend available for %s", scheme)
+    settings = {
+        option: conf[key] for key, option in SCHEME_SETTINGS.items() if key in conf
+    }
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+
+class PasswordHasher(object):
+    """CryptContext running hashes in a bounded thread pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._context = None
+        self._executor = None
+        self._pending = None
+        self._timeout = None
+
+    def _init(self):
+        with self._lock:
+            if self._context is not None:
+                return
+            conf = get_password_config()
+            threads = conf.get("THREADS", 2)
+            self._pending = threading.BoundedSemaphore(conf.get("MAX_PENDING", 32))
+            self._timeout = conf.get("QUEUE_TIMEOUT", 5)
+            self._executor = ThreadPoolExecutor(
+                max_workers=threads, thread_name_prefix="gnc-passwords"
+            )
+            self._context = build_crypt_context(conf)
+
+    @property
+    def context(self):
+        if self._context is None:
+            self._init()
+        return self._context
+
+    def _run(self, func, *args):
+        context = self.context
+        if not self._pending.acquire(timeout=self._timeout):
+            raise PasswordHashingBusy()
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            self._pending.release()
+
+    def hash(self, password):
+        return self._run(self.context.hash, password)
+
+    def verify_and_update(self, password, hash):
+        return self._run(self.context.verify_and_update, password, hash)
+
+    def reset(self):
+        """Drop the context (eg: after a config change in tests)"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._context = None
+
+
+password_hasher = PasswordHasher()
+
+
+def hash_password(password):
+    """Hash a password with the default scheme
+
+    :param password: clear password
+    :type password: str
+
+    :return: hash
+    :rtype: str
+    """
+    return password_hasher.hash(password)
+
+
+def verify_password(password, hash):
+    """Verify a password and return a new hash if its scheme is deprecated
+
+    :param password: clear password
+    :type password: str
+    :param hash: stored hash
+    :type hash: str
+
+    :return: validity and new hash (None if up to date or invalid)
+    :rtype: tuple
+    """
+    try:
+        return password_hasher.verify_and_update(password, hash)
+    except ValueError:
+        # Unknown or malformed hash
+        return False, None
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to warm read-only caches and make the app fork safe
+
+With gunicorn ``preload_app`` (``STARTUP.PRELOAD``), the app is built once in
+the master process: caches warmed there are shared copy-on-write by every
+worker instead of being rebuilt by each of them on their first requests.
+Database connections opened while warming are closed before forking and the
+engine is disposed again in each worker (``post_fork`` hook), so that no
+socket is ever shared between processes.
+"""
+
+import gc
+import logging
+import time
+
+from gncitizen.utils.env import ROOT_DIR, db
+
+logger = logging.getLogger(__name__)
+
+BADGES_CONFIG_FILE = ROOT_DIR / "config" / "badges_config.py"
+
+
+def load_badges_config(app):
+    """Load ``config/badges_config.py`` (``REWARDS``) into the app config once
+
+    :param app: flask app
+    :type app: flask.Flask
+    """
+    if not app.config.get("_BADGES_CONFIG_LOADED"):
+        app.config.from_pyfile(str(BADGES_CONFIG_FILE))
+        app.config["_BADGES_CONFIG_LOADED"] = True
+
+
+def warm_taxon_repositories(app):
+    """Load TaxHub repositories of the taxonomy lists used by programs"""
+    if app.config.get("API_TAXHUB") is None:
+        return 0
+    from gncitizen.core.commons.models import ProgramsModel
+    from gncitizen.utils.taxonomy import mkTaxonRepository
+
+    taxonomy_lists = [
+        row.taxonomy_list
+        for row in db.session.query(ProgramsModel.taxonomy_list)
+        .filter(ProgramsModel.taxonomy_list.isnot(None))
+        .distinct()
+    ]
+    for taxonomy_list in taxonomy_lists:
+        try:
+            mkTaxonRepository(taxonomy_list)
+        except Exception as e:
+            logger.warning(
+                "[preload] can't load taxonomy list %s: %s", taxonomy_list, str(e)
+            )
+    return len(taxonomy_lists)
+
+
+def warm_reward_models(app):
+    """Compile reward models (needs a ``REWARDS.CONF`` config dict)"""
+    if not isinstance(app.config.get("REWARDS"), dict):
+        return False
+    import gncitizen.utils.rewards.models  # noqa: F401
+
+    return True
+
+
+def warm_caches(app):
+    """Fill read-only caches then close database connections
+
+    Caches: badges config, municipalities features, TaxHub taxon repositories
+    and reward models.
+
+    :param app: flask app
+    :type app: flask.Flask
+    """
+    from gncitizen.utils.geo import get_municipality_features
+
+    start = time.perf_counter()
+    with app.app_context():
+        load_badges_config(app)
+        for name, warm in (
+            ("municipalities", lambda app: len(get_municipality_features())),
+            ("taxon_repositories", warm_taxon_repositories),
+            ("reward_models", warm_reward_models),
+        ):
+            try:
+                logger.info("[preload] %s: %s", name, warm(app))
+            except Exception as e:
+                logger.warning("[preload] can't warm %s: %s", name, str(e))
+        db.session.remove()
+        db.engine.dispose()
+    # Keep warmed objects out of the collector so that workers don't touch
+    # (and copy) their memory pages (python >= 3.7)
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    logger.info(
+        "[preload] caches warmed in %.1f ms", (time.perf_counter() - start) * 1000
+    )
+
+
+def dispose_engine(app):
+    """Drop pooled connections inherited from the master (``post_fork`` hook)"""
+    with app.app_context():
+        db.engine.dispose()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to profile requests (wall time, SQL statements, serialization)
+
+Enabled with ``PROFILING.ENABLED``, it records for each request:
+
+    * wall time
+    * number of SQL statements, total SQL time and fetched rows
+    * JSON serialization time spent in ``to_json_resp``
+
+Slow requests and queries are logged with their stack location and request
+durations are aggregated in per route histograms.
+"""
+
+import logging
+import os
+import threading
+import time
+import traceback
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+"""Histogram buckets upper bounds (ms)"""
+DEFAULT_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+MODULE_FILE = os.path.abspath(__file__)
+PACKAGE_DIR = os.path.dirname(os.path.dirname(MODULE_FILE))
+
+
+class RequestProfile(object):
+    """Counters of the current request, stored in ``flask.g``"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.sql_rows = 0
+        self.serialization_time = 0.0
+
+    def as_dict(self, wall_time):
+        return {
+            "wall_time": round(wall_time * 1000, 3),
+            "sql_count": self.sql_count,
+            "sql_time": round(self.sql_time * 1000, 3),
+            "sql_rows": self.sql_rows,
+            "serialization_time": round(self.serialization_time * 1000, 3),
+        }
+
+
+class RouteHistograms(object):
+    """Per route request duration histograms and SQL counters"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, route, wall_time, profile):
+        duration = wall_time * 1000
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "max": 0.0,
+                    "sql_count": 0,
+                    "sql_time": 0.0,
+                    "serialization_time": 0.0,
+                    "buckets": [0] * (len(self.buckets) + 1),
+                }
+                self._routes[route] = stats
+            stats["count"] += 1
+            stats["sum"] += duration
+            stats["max"] = max(stats["max"], duration)
+            stats["sql_count"] += profile.sql_count
+            stats["sql_time"] += profile.sql_time * 1000
+            stats["serialization_time"] += profile.serialization_time * 1000
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    stats["buckets"][i] += 1
+                    break
+            else:
+                stats["buckets"][-1] += 1
+
+    def as_dict(self):
+        """Return histograms with cumulative bucket counts (ms)"""
+        labels = [str(b) for b in self.buckets] + ["+Inf"]
+        result = {}
+        with self._lock:
+            for route, stats in self._routes.items():
+                cumulative, buckets = 0, {}
+                for label, count in zip(labels, stats["buckets"]):
+                    cumulative += count
+                    buckets[label] = cumulative
+                result[route] = {
+                    "count": stats["count"],
+                    "avg": round(stats["sum"] / stats["count"], 3),
+                    "max": round(stats["max"], 3),
+                    "sql_count_avg": round(stats["sql_count"] / stats["count"], 2),
+                    "sql_time_avg": round(stats["sql_time"] / stats["count"], 3),
+                    "serialization_time_avg": round(
+                        stats["serialization_time"] / stats["count"], 3
+                    ),
+                    "buckets": buckets,
+                }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+
+
+route_histograms = RouteHistograms()
+
+
+def get_current_profile():
+    """Return the profile of the current request if profiling is enabled"""
+    if has_request_context():
+        return getattr(g, "_gnc_profile", None)
+    return None
+
+
+def record_serialization(elapsed):
+    """Add JSON serialization time (s) to the current request profile"""
+    profile = get_current_profile()
+    if profile is not None:
+        profile.serialization_time += elapsed
+
+
+def get_caller_location():
+    """Return the innermost ``gncitizen`` frame outside this module"""
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        if frame.filename.startswith(PACKAGE_DIR) and frame.filename != MODULE_FILE:
+            return "{}:{} in {}".format(
+                os.path.relpath(frame.filename, PACKAGE_DIR), frame.lineno, frame.name
+            )
+    return "unknown"
+
+
+def init_profiling(app, engine):
+    """Register profiling hooks on the app and the SQLAlchemy engine
+
+    :param app: flask app
+    :type app: flask.Flask
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy.engine.Engine
+    """
+    conf = app.config.get("PROFILING", {})
+    if not conf.get("ENABLED", False):
+        return
+    slow_request_ms = conf.get("SLOW_REQUEST_MS", 500)
+    slow_query_ms = conf.get("SLOW_QUERY_MS", 100)
+    server_timing = conf.get("SERVER_TIMING_HEADER", False)
+    if conf.get("BUCKETS"):
+        route_histograms.buckets = tuple(sorted(conf["BUCKETS"]))
+        route_histograms.reset()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("_gnc_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["_gnc_query_start"].pop()
+        profile = get_current_profile()
+        if profile is not None:
+            profile.sql_count += 1
+            profile.sql_time += elapsed
+            if cursor.rowcount and cursor.rowcount > 0 and cursor.description:
+                profile.sql_rows += cursor.rowcount
+        if elapsed * 1000 >= slow_query_ms:
+            logger.warning(
+                "[profiling] slow query (%.1f ms) at %s: %s",
+                elapsed * 1000,
+                get_caller_location(),
+                " ".join(statement.split())[:1000],
+            )
+
+    @app.before_request
+    def _start_profile():
+        g._gnc_profile = RequestProfile()
+
+    @app.after_request
+    def _end_profile(response):
+        profile = getattr(g, "_gnc_profile", None)
+        if profile is None:
+            return response
+        wall_time = time.perf_counter() - profile.start
+        route = (
+            "{} {}".format(request.method, request.url_rule.rule)
+            if request.url_rule
+            else "<unmatched>"
+        )
+        route_histograms.observe(route, wall_time, profile)
+        if wall_time * 1000 >= slow_request_ms:
+            logger.warning(
+                "[profiling] slow request %s (%s) %s: %s",
+                route,
+                request.endpoint,
+                response.status_code,
+                profile.as_dict(wall_time),
+            )
+        if server_timing:
+            data = profile.as_dict(wall_time)
+            response.headers["Server-Timing"] = (
+                "db;desc=\"{} queries\";dur={}, serialize;dur={}, total;dur={}".format(
+                    data["sql_count"],
+                    data["sql_time"],
+                    data["serialization_time"],
+                    data["wall_time"],
+                )
+            )
+        return response
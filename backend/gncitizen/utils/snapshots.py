@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to cache per-user snapshots of dashboard data
+
+A snapshot (eg: all the observations of a user, formatted) is expensive to
+build for active users but changes only when they write. Snapshots are kept
+in process, with a fingerprint of the user data read from the database (eg:
+count and last update of their rows):
+
+    * a snapshot is reused while the fingerprint is unchanged, so writes made
+      through another worker (or the admin) invalidate it too
+    * the routes writing user data call ``invalidate`` to free it at once
+
+At most ``[USER_SNAPSHOTS] SIZE`` users are kept per cache (least recently
+used are dropped), 0 disables the cache.
+"""
+
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+from gncitizen.utils.metrics import observe_cache
+
+
+class UserSnapshots(object):
+    """In-process LRU cache of per-user snapshots"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()
+
+    def _size(self):
+        return current_app.config.get("USER_SNAPSHOTS", {}).get("SIZE", 200)
+
+    def get(self, user_id, fingerprint, build):
+        """Return the snapshot of a user, built if missing or outdated
+
+        :param user_id: user id
+        :type user_id: int
+        :param fingerprint: current state of the user data
+        :type fingerprint: tuple
+        :param build: function building the snapshot
+        :type build: func
+
+        :return: snapshot
+        """
+        with self._lock:
+            cached = self._snapshots.get(user_id)
+            hit = cached is not None and cached[0] == fingerprint
+            if hit:
+                self._snapshots.move_to_end(user_id)
+        observe_cache(self.name, hit)
+        if hit:
+            return cached[1]
+        snapshot = build()
+        size = self._size()
+        if size:
+            with self._lock:
+                self._snapshots[user_id] = (fingerprint, snapshot)
+                self._snapshots.move_to_end(user_id)
+                while len(self._snapshots) > size:
+                    self._snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id):
+        """Drop the snapshot of a user after a write
+
+        :param user_id: user id
+        :type user_id: int
+        """
+        with self._lock:
+            self._snapshots.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
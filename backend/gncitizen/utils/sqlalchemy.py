@@ -3,15 +3,22 @@
 
 """A module to manage database and datas with sqlalchemy"""
 
-import json
+import keyword
+import time
 from functools import wraps
 
-from flask import Response, current_app
+from flask import Response, current_app, request
 from geoalchemy2.shape import from_shape, to_shape
 from geojson import Feature
 from shapely.geometry import asShape
+from sqlalchemy import cast, func, orm
+from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.orm import load_only
 from werkzeug.datastructures import Headers
 
+from gncitizen.utils.encoder import json_encoder
+from gncitizen.utils.profiling import record_serialization
+
 
 """
     Liste des types de données sql qui
@@ -24,10 +31,15 @@ SERIALIZERS = {
     "time": lambda x: str(x) if x else None,
     "timestamp": lambda x: str(x) if x else None,
     "uuid": lambda x: str(x) if x else None,
-    "numeric": lambda x: str(x) if x else None,
+    "numeric": lambda x: str(x) if x is not None else None,
     "enum": lambda x: x.name if x else None,
 }
 
+"""
+    Types laissés tels quels par as_dict quand l'encodeur JSON les formate
+    comme SERIALIZERS (json_encoder.native_types)
+"""
+NATIVE_TYPES = ("date", "datetime", "time", "timestamp", "uuid", "numeric")
 
 
 def geom_from_geojson(data):
@@ -74,6 +86,110 @@ def get_geojson_feature(wkb):
     return feature
 
 
+def _attribute(name):
+    if name.isidentifier() and not keyword.iskeyword(name):
+        return "self.{}".format(name)
+    return "getattr(self, {!r})".format(name)
+
+
+def compile_serializer(props, relationships=()):
+    """Génère une fonction de sérialisation dédiée à un jeu de colonnes
+
+    Le code produit lit directement chaque attribut et n'appelle un
+    sérialiseur que pour les colonnes qui en ont un.
+
+    :param props: colonnes et sérialiseurs (ou None)
+    :type props: list
+    :param relationships: relations sérialisées (nom, uselist)
+    :type relationships: list
+
+    :return: fonction prenant l'objet et renvoyant un dict
+    :rtype: function
+    """
+    namespace = {}
+    lines = ["def serialize(self):", "    out = {"]
+    for key, serializer in props:
+        if serializer is None:
+            lines.append("        {!r}: {},".format(key, _attribute(key)))
+        else:
+            name = "_serializer_{}".format(len(namespace))
+            namespace[name] = serializer
+            lines.append("        {!r}: {}({}),".format(key, name, _attribute(key)))
+    lines.append("    }")
+    for rel, uselist in relationships:
+        lines.append("    value = {}".format(_attribute(rel)))
+        lines.append("    if value is not None:")
+        if uselist:
+            lines.append(
+                "        out[{!r}] = [x.as_dict(True) for x in value]".format(rel)
+            )
+        else:
+            lines.append("        out[{!r}] = value.as_dict(True)".format(rel))
+    lines.append("    return out")
+    exec("\n".join(lines), namespace)
+    return namespace["serialize"]
+
+
+def _has_geometry(cls):
+    return any(col.type.__class__.__name__ == "Geometry" for col in cls.__mapper__.c)
+
+
+def _serialized_attributes(cls):
+    """Attributs colonnes lus par as_dict (toutes sauf les géométries)"""
+    return [
+        prop.key
+        for prop in cls.__mapper__.column_attrs
+        if prop.columns[0].type.__class__.__name__ != "Geometry"
+    ]
+
+
+def build_loader_options(cls, recursif=False, columns=(), _parent=None, _seen=()):
+    """Options de chargement correspondant à as_dict(recursif, columns)
+
+    Les relations simples sont jointes (joinedload), les collections et
+    les objets géométriques (pour ne pas répéter une géométrie sur chaque
+    ligne) sont chargés par une requête par relation (selectinload). Le
+    nombre de requêtes ne dépend donc pas du nombre de lignes. Les
+    géométries des objets liés, que as_dict ne sérialise pas, ne sont pas
+    lues (load_only).
+
+    :param cls: modèle sérialisable
+    :param recursif: relations sérialisées
+    :type recursif: bool
+    :param columns: colonnes sérialisées (toutes par défaut)
+    :type columns: list
+
+    :return: options pour Query.options()
+    :rtype: list
+    """
+    options = []
+    if columns and _parent is None:
+        options.append(load_only(*columns))
+    if not recursif:
+        return options
+    for rel, uselist in getattr(cls, "__serializable_relationships__", ()):
+        attribute = getattr(cls, rel)
+        target = attribute.property.mapper.class_
+        if uselist or _has_geometry(target):
+            loader = "selectinload"
+        else:
+            loader = "joinedload"
+        if _parent is None:
+            option = getattr(orm, loader)(attribute)
+        else:
+            option = getattr(_parent, loader)(attribute)
+        if _has_geometry(target):
+            option = option.load_only(*_serialized_attributes(target))
+        options.append(option)
+        if target not in _seen:
+            options.extend(
+                build_loader_options(
+                    target, True, _parent=option, _seen=_seen + (cls, target)
+                )
+            )
+    return options
+
+
 def serializable(cls):
     """
     Décorateur de classe pour les DB.Models
@@ -85,14 +201,16 @@ def serializable(cls):
         Liste des propriétés sérialisables de la classe
         associées à leur sérializer en fonction de leur type
     """
-    cls_db_columns = [
-        (
-            db_col.key,
-            SERIALIZERS.get(db_col.type.__class__.__name__.lower(), lambda x: x),
-        )
+    cls_db_types = [
+        (db_col.key, db_col.type.__class__.__name__.lower())
         for db_col in cls.__mapper__.c
         if not db_col.type.__class__.__name__ == "Geometry"
     ]
+    cls_db_columns = [(key, SERIALIZERS.get(type_)) for key, type_ in cls_db_types]
+    cls_native_columns = [
+        (key, None if type_ in NATIVE_TYPES else SERIALIZERS.get(type_))
+        for key, type_ in cls_db_types
+    ]
 
     """
         Liste des propriétés de type relationship
@@ -104,6 +222,12 @@ def serializable(cls):
         (db_rel.key, db_rel.uselist) for db_rel in cls.__mapper__.relationships
     ]
 
+    """
+        Fonctions de sérialisation générées à la demande,
+        par jeu de colonnes (voir compile_serializer)
+    """
+    cls_serializers = {}
+
     def serializefn(self, recursif=False, columns=()):
         """
         Méthode qui renvoie les données de l'objet sous la forme d'un dict
@@ -116,28 +240,31 @@ def serializable(cls):
             columns: liste
                 liste des colonnes qui doivent être prises en compte
         """
-        if columns:
-            fprops = list(filter(lambda d: d[0] in columns, cls_db_columns))
-        else:
-            fprops = cls_db_columns
-
-        out = {item: _serializer(getattr(self, item)) for item, _serializer in fprops}
-
-        if recursif is False:
-            return out
-
-        for (rel, uselist) in cls_db_relationships:
-            if getattr(self, rel) is None:
-                break
+        native = json_encoder.native_types
+        key = (native, recursif is not False, frozenset(columns))
+        serializer = cls_serializers.get(key)
+        if serializer is None:
+            props = cls_native_columns if native else cls_db_columns
+            if columns:
+                props = [d for d in props if d[0] in columns]
+            serializer = compile_serializer(
+                props, cls_db_relationships if recursif is not False else ()
+            )
+            cls_serializers[key] = serializer
+        return serializer(self)
 
-            if uselist is True:
-                out[rel] = [x.as_dict(recursif) for x in getattr(self, rel)]
-            else:
-                out[rel] = getattr(self, rel).as_dict(recursif)
+    def loader_options(recursif=False, columns=()):
+        """
+        Options de requête chargeant en une fois ce que sérialise
+        as_dict(recursif, columns)
 
-        return out
+        ex: ProgramsModel.query.options(*ProgramsModel.as_dict_options(True))
+        """
+        return build_loader_options(cls, recursif, columns)
 
     cls.as_dict = serializefn
+    cls.as_dict_options = staticmethod(loader_options)
+    cls.__serializable_relationships__ = cls_db_relationships
     return cls
 
 
@@ -176,6 +303,109 @@ def geoserializable(cls):
     return cls
 
 
+class Projection(object):
+    """Champs d'une liste sélectionnés colonne par colonne
+
+    Les lignes sont des tuples transformés directement en features GeoJSON,
+    sans instancier les modèles (ni identity map) ni appeler as_dict, et la
+    géométrie est convertie en GeoJSON par PostGIS.
+
+    ex:
+        projection = Projection(
+            {"id_site": SiteModel.id_site, "site_type": {"type": SiteTypeModel.type}},
+            geometry=SiteModel.geom,
+        )
+        rows = db.session.query(*projection.columns).join(...).all()
+        features = [projection.feature(row) for row in rows]
+    """
+
+    GEOMETRY_LABEL = "geometry_geojson"
+
+    def __init__(self, properties, geometry=None):
+        """
+        :param properties: propriétés et colonnes (dict pour un objet imbriqué)
+        :type properties: dict
+        :param geometry: colonne géométrie
+        """
+        self.geometry = geometry
+        self.fields = list(self._flatten(properties))
+        self.types = [
+            column.type.__class__.__name__.lower() for path, column in self.fields
+        ]
+
+    @classmethod
+    def _flatten(cls, properties, path=()):
+        for name, column in properties.items():
+            if isinstance(column, dict):
+                yield from cls._flatten(column, path + (name,))
+            else:
+                yield path + (name,), column
+
+    @property
+    def columns(self):
+        """Colonnes à sélectionner, en tête de requête"""
+        columns = [column.label("__".join(path)) for path, column in self.fields]
+        if self.geometry is not None:
+            columns.append(
+                cast(func.ST_AsGeoJSON(self.geometry), JSON).label(self.GEOMETRY_LABEL)
+            )
+        return columns
+
+    def properties(self, row):
+        out = {}
+        for (path, column), type_, value in zip(self.fields, self.types, row):
+            serializer = SERIALIZERS.get(type_)
+            if serializer is not None:
+                value = serializer(value)
+            target = out
+            for name in path[:-1]:
+                target = target.setdefault(name, {})
+            target[path[-1]] = value
+        return out
+
+    def feature(self, row):
+        return {
+            "type": "Feature",
+            "geometry": getattr(row, self.GEOMETRY_LABEL, None),
+            "properties": self.properties(row),
+        }
+
+
+def get_page_args():
+    """Paramètres ``page`` et ``per_page`` de la requête HTTP
+
+    La taille de page est bornée par ``[PAGINATION] MAX_PER_PAGE``.
+
+    :return: page (à partir de 1) et taille de page
+    :rtype: tuple
+    """
+    config = current_app.config.get("PAGINATION", {})
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = request.args.get("per_page", config.get("PER_PAGE", 100), type=int)
+    per_page = min(max(per_page, 1), config.get("MAX_PER_PAGE", 1000))
+    return page, per_page
+
+
+def paginate(query):
+    """Page d'une requête selon les paramètres ``page`` et ``per_page``
+
+    Le total n'est pas compté : une ligne de plus que la page est lue pour
+    savoir s'il existe une page suivante.
+
+    :param query: requête triée
+    :type query: sqlalchemy.orm.Query
+
+    :return: lignes de la page et métadonnées (page, per_page, has_next)
+    :rtype: tuple
+    """
+    page, per_page = get_page_args()
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return (
+        rows[:per_page],
+        {"page": page, "per_page": per_page, "has_next": len(rows) > per_page},
+    )
+
+
 def json_resp(fn):
     """
     Décorateur transformant le résultat renvoyé par une vue
@@ -207,8 +437,12 @@ def to_json_resp(res, status=200, filename=None, as_file=False, indent=None):
             "Content-Disposition", "attachment", filename="export_%s.json" % filename,
         )
 
+    start = time.perf_counter()
+    body = json_encoder.dumps(res, indent=indent)
+    record_serialization(time.perf_counter() - start)
+
     return Response(
-        json.dumps(res, indent=indent),
+        body,
         status=status,
         mimetype="application/json",
         headers=headers,
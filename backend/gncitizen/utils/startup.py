@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to keep application startup fast
+
+Blueprints are imported lazily from their dotted path by ``get_app`` and each
+import is timed, so the slowest modules show up in the logs (and on
+``/api/internal/metrics/startup``) when the boot exceeds
+``STARTUP.IMPORT_BUDGET_MS``.
+
+Database schemas are created and migrated (see ``gncitizen.utils.migrations``)
+by the ``flask db-init`` command instead of on every worker boot (see
+``STARTUP.INIT_DB``, gunicorn then runs it once in its master process).
+"""
+
+import importlib
+import logging
+import time
+
+import click
+from flask.cli import with_appcontext
+
+logger = logging.getLogger(__name__)
+
+"""Core blueprints: (module, blueprint attribute, url prefix suffix)"""
+CORE_BLUEPRINTS = (
+    ("gncitizen.core.users.routes", "users_api", ""),
+    ("gncitizen.core.commons.routes", "commons_api", ""),
+    ("gncitizen.core.observations.routes", "obstax_api", ""),
+    ("gncitizen.core.ref_geo.routes", "geo_api", ""),
+    ("gncitizen.core.badges.routes", "badges_api", ""),
+    ("gncitizen.core.taxonomy.routes", "taxo_api", ""),
+    ("gncitizen.core.sites.routes", "sites_api", "/sites"),
+    ("gncitizen.core.monitoring.routes", "monitoring_api", ""),
+    ("gncitizen.core.sync.routes", "sync_api", ""),
+)
+
+
+class ImportTimes(object):
+    """Import durations (ms) of the modules loaded by ``get_app``"""
+
+    def __init__(self):
+        self.modules = {}
+
+    def import_module(self, name):
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        self.modules[name] = round((time.perf_counter() - start) * 1000, 3)
+        return module
+
+    @property
+    def total(self):
+        return round(sum(self.modules.values()), 3)
+
+    def as_dict(self):
+        return {
+            "total": self.total,
+            "modules": dict(
+                sorted(self.modules.items(), key=lambda item: item[1], reverse=True)
+            ),
+        }
+
+
+import_times = ImportTimes()
+
+
+def register_core_blueprints(app, url_prefix):
+    """Import and register the core blueprints, timing each import
+
+    :param app: flask app
+    :type app: flask.Flask
+    :param url_prefix: api url prefix (eg: ``/api``)
+    :type url_prefix: str
+    """
+    for module_name, attr, prefix in CORE_BLUEPRINTS:
+        module = import_times.import_module(module_name)
+        app.register_blueprint(getattr(module, attr), url_prefix=url_prefix + prefix)
+
+
+def report_import_times(app):
+    """Log blueprint import times, warn when over ``STARTUP.IMPORT_BUDGET_MS``
+
+    :param app: flask app
+    :type app: flask.Flask
+    """
+    budget = app.config.get("STARTUP", {}).get("IMPORT_BUDGET_MS")
+    times = import_times.as_dict()
+    if budget and times["total"] > budget:
+        logger.warning(
+            "[startup] blueprints imported in %.1f ms (budget %s ms): %s",
+            times["total"],
+            budget,
+            times["modules"],
+        )
+    else:
+        logger.info(
+            "[startup] blueprints imported in %.1f ms: %s",
+            times["total"],
+            times["modules"],
+        )
+
+
+def init_db(db):
+    """Create schemas, migrate tables and insert reference data
+
+    Processes booting together run it one after the other.
+    """
+    from gncitizen.utils.init_data import create_schemas, populate_modules
+    from gncitizen.utils.migrations import migration_lock, upgrade_db
+
+    with migration_lock(db.engine):
+        create_schemas(db)
+        upgrade_db(db)
+        populate_modules(db)
+
+
+@click.command("db-init")
+@with_appcontext
+def db_init_command():
+    """Create and migrate database schemas, insert reference data"""
+    from gncitizen.utils.env import db
+
+    init_db(db)
+    click.echo("Database initialized")
+
+
+def register_commands(app):
+    from gncitizen.core.sync.routes import sync_purge_command
+    from gncitizen.utils.bundles import bundle_build_command
+    from gncitizen.utils.geometry_import import geometry_import_command
+    from gncitizen.utils.index_advisor import index_advisor_command
+    from gncitizen.utils.mail_outbox import mail_send_command
+    from gncitizen.utils.migrations import COMMANDS as MIGRATION_COMMANDS
+    from gncitizen.utils.partitioning import db_partition_command
+
+    app.cli.add_command(db_init_command)
+    for command in MIGRATION_COMMANDS:
+        app.cli.add_command(command)
+    app.cli.add_command(db_partition_command)
+    app.cli.add_command(index_advisor_command)
+    app.cli.add_command(mail_send_command)
+    app.cli.add_command(sync_purge_command)
+    app.cli.add_command(bundle_build_command)
+    app.cli.add_command(geometry_import_command)
@@ -3,13 +3,18 @@
 
 """A module to manage taxonomy"""
 
+import time
 from typing import Dict, List, Union
-from functools import lru_cache
+from functools import lru_cache, wraps
 from flask import current_app
+from sqlalchemy import and_, select
+from sqlalchemy.orm import aliased
 
-if current_app.config.get("API_TAXHUB") is None:
-    from gncitizen.core.taxonomy.models import Taxref
-else:
+from gncitizen.core.taxonomy.models import BibNoms, CorNomListe, Taxref, TMedias
+from gncitizen.utils.env import db
+from gncitizen.utils.metrics import observe_cache, observe_taxhub_call
+
+if current_app.config.get("API_TAXHUB") is not None:
     import requests
     from requests.models import Response
 
@@ -22,6 +27,24 @@ else:
 Taxon = Dict[str, Union[str, Dict[str, str], List[Dict]]]
 
 
+def timed_taxhub_call(func):
+    """Report TaxHub call duration and failures to metrics"""
+
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            observe_taxhub_call(func.__name__, time.perf_counter() - start, True)
+            raise
+        observe_taxhub_call(func.__name__, time.perf_counter() - start)
+        return result
+
+    return decorated_function
+
+
+@timed_taxhub_call
 def taxhub_rest_get_taxon_list(taxhub_list_id: int) -> Dict:
     payload = {"existing": "true", "order": "asc", "orderby": "taxref.nom_complet"}
     res = requests.get(
@@ -33,6 +56,7 @@ def taxhub_rest_get_taxon_list(taxhub_list_id: int) -> Dict:
     return res.json()
 
 
+@timed_taxhub_call
 def taxhub_rest_get_taxon(taxhub_id: int) -> Taxon:
     if not taxhub_id:
         raise ValueError("Null value for taxhub taxon id")
@@ -42,12 +66,78 @@ def taxhub_rest_get_taxon(taxhub_id: int) -> Taxon:
 
 
 @lru_cache()
-def mkTaxonRepository(taxhub_list_id: int) -> List[Taxon]:
+def _mkTaxonRepository(taxhub_list_id: int) -> List[Taxon]:
     taxa = taxhub_rest_get_taxon_list(taxhub_list_id)
     taxon_ids = [item["id_nom"] for item in taxa.get("items")]
     return [taxhub_rest_get_taxon(taxon_id) for taxon_id in taxon_ids]
 
 
+def mkTaxonRepository(taxhub_list_id: int) -> List[Taxon]:
+    hits = _mkTaxonRepository.cache_info().hits
+    repository = _mkTaxonRepository(taxhub_list_id)
+    observe_cache("taxon_repository", _mkTaxonRepository.cache_info().hits > hits)
+    return repository
+
+
+mkTaxonRepository.cache_info = _mkTaxonRepository.cache_info
+mkTaxonRepository.cache_clear = _mkTaxonRepository.cache_clear
+
+
+def get_taxon_list(taxhub_list_id: int) -> List[Taxon]:
+    """Taxa of a taxonomy list
+
+    From the cached TaxHub repository, else from the taxonomie schema as
+    ``{"nom": ..., "taxref": ..., "medias": ...}`` dicts.
+
+    :param taxhub_list_id: taxonomy list id
+    :type taxhub_list_id: int
+
+    :return: taxa
+    :rtype: list
+    """
+    if current_app.config.get("API_TAXHUB") is not None:
+        return mkTaxonRepository(taxhub_list_id)
+    data = (
+        db.session.query(BibNoms, Taxref, TMedias)
+        .distinct(BibNoms.cd_ref)
+        .join(CorNomListe, CorNomListe.id_nom == BibNoms.id_nom)
+        .join(Taxref, Taxref.cd_ref == BibNoms.cd_ref)
+        .outerjoin(TMedias, TMedias.cd_ref == BibNoms.cd_ref)
+        .filter(CorNomListe.id_liste == taxhub_list_id)
+        .all()
+    )
+    return [
+        {
+            "nom": d[0].as_dict(),
+            "taxref": d[1].as_dict(),
+            "medias": d[2].as_dict() if d[2] else None,
+        }
+        for d in data
+    ]
+
+
+def get_list_cd_noms(taxhub_list_id: int):
+    """taxref ids (cd_nom) of a taxonomy list
+
+    Read from the cached taxon repository when TaxHub is used, else a
+    subquery on ``cor_nom_liste``, to use with ``column.in_()``.
+
+    :param taxhub_list_id: taxonomy list id
+    :type taxhub_list_id: int
+
+    :return: cd_noms
+    :rtype: list or sqlalchemy.sql.Select
+    """
+    if current_app.config.get("API_TAXHUB") is not None:
+        return [taxon["cd_nom"] for taxon in mkTaxonRepository(taxhub_list_id) if taxon]
+    return select([BibNoms.cd_nom]).where(
+        and_(
+            CorNomListe.id_nom == BibNoms.id_nom,
+            CorNomListe.id_liste == taxhub_list_id,
+        )
+    )
+
+
 def get_specie_from_cd_nom(cd_nom):
     """get specie datas from taxref id (cd_nom)
 
@@ -57,18 +147,37 @@ def get_specie_from_cd_nom(cd_nom):
     :return: french and scientific official name (from ``cd_ref`` = ``cd_nom``) as dict
     :rtype: dict
     """
+    return get_species_from_cd_noms([cd_nom]).get(cd_nom, {})
+
+
+def get_species_from_cd_noms(cd_noms):
+    """get specie datas of many taxref ids (cd_nom) in one query
+
+    Each ``cd_nom`` is joined to its official taxon (``cd_ref``).
 
-    result = Taxref.query.filter_by(cd_nom=cd_nom).first()
-    official_taxa = Taxref.query.filter_by(cd_nom=result.cd_ref).first()
-
-    common_names = official_taxa.nom_vern
-    common_name = common_names.split(",")[0]
-    common_name_eng = official_taxa.get("nom_vern_eng")
-    sci_name = official_taxa.lb_nom
-    taxref = {}
-    taxref["common_name"] = common_name
-    taxref["common_name_eng"] = common_name_eng
-    taxref["sci_name"] = sci_name
-    for k in official_taxa:
-        taxref[k] = official_taxa[k]
-    return taxref
+    :param cd_noms: taxref unique ids (cd_nom)
+    :type cd_noms: iterable
+
+    :return: specie datas (see ``get_specie_from_cd_nom``) by cd_nom
+    :rtype: dict
+    """
+    cd_noms = set(cd_nom for cd_nom in cd_noms if cd_nom is not None)
+    if not cd_noms:
+        return {}
+    official_taxon = aliased(Taxref)
+    rows = (
+        db.session.query(Taxref.cd_nom, official_taxon)
+        .join(official_taxon, official_taxon.cd_nom == Taxref.cd_ref)
+        .filter(Taxref.cd_nom.in_(cd_noms))
+        .all()
+    )
+    species = {}
+    for cd_nom, official_taxa in rows:
+        taxref = {
+            "common_name": (official_taxa.nom_vern or "").split(",")[0] or None,
+            "common_name_eng": official_taxa.nom_vern_eng,
+            "sci_name": official_taxa.lb_nom,
+        }
+        taxref.update(official_taxa.as_dict())
+        species[cd_nom] = taxref
+    return species
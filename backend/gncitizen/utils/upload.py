@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A module to stream uploaded files to disk
+
+Werkzeug buffers each uploaded file in memory (up to 500 Ko) then in an
+anonymous temporary file before the view copies it again to ``MEDIA_DIR``.
+The request class defined here spools multipart file parts straight into
+``MEDIA_DIR``, hashes them while they are received and enforces a per
+endpoint size limit, so saving a media is a simple rename.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from gncitizen.utils.env import MEDIA_DIR
+from gncitizen.utils.metrics import observe_upload
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+UPLOAD_TMP_PREFIX = ".upload_"
+UPLOAD_TMP_SUFFIX = ".part"
+
+
+def get_upload_config():
+    """Return the ``[UPLOAD]`` config section (empty dict if missing)"""
+    return current_app.config.get("UPLOAD", {})
+
+
+def get_max_content_length(endpoint=None):
+    """Return the max request size (bytes) allowed for an endpoint
+
+    Per endpoint values are read from ``UPLOAD.ENDPOINTS``, then fallback to
+    ``UPLOAD.MAX_CONTENT_LENGTH`` and finally to flask ``MAX_CONTENT_LENGTH``.
+
+    :param endpoint: flask endpoint name (eg: ``obstax.post_observation``)
+    :type endpoint: str
+
+    :return: max size in bytes, None if unlimited
+    :rtype: int
+    """
+    upload_config = get_upload_config()
+    endpoints = upload_config.get("ENDPOINTS", {})
+    if endpoint is not None and endpoint in endpoints:
+        return endpoints[endpoint]
+    return upload_config.get(
+        "MAX_CONTENT_LENGTH", current_app.config.get("MAX_CONTENT_LENGTH")
+    )
+
+
+class HashingSpooledFile(object):
+    """Disk file receiving an uploaded file part
+
+    Every written chunk updates a sha256 digest and a byte counter, so the
+    digest is available without reading the file back once parsed.
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.max_size = max_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        fd, self.path = tempfile.mkstemp(
+            prefix=UPLOAD_TMP_PREFIX, suffix=UPLOAD_TMP_SUFFIX, dir=directory
+        )
+        self._file = os.fdopen(fd, "w+b")
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        self._digest.update(chunk)
+        return self._file.write(chunk)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    """Flask request spooling uploaded files into ``MEDIA_DIR``"""
+
+    @property
+    def max_content_length(self):
+        return get_max_content_length(self.endpoint)
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        spooled = HashingSpooledFile(str(MEDIA_DIR), max_size=self.max_content_length)
+        if not hasattr(self, "_spooled_uploads"):
+            self._spooled_uploads = []
+        self._spooled_uploads.append(spooled)
+        return spooled
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            # Remove parts which have not been moved by save_file_storage
+            for spooled in getattr(self, "_spooled_uploads", []):
+                spooled.close()
+                if os.path.exists(spooled.path):
+                    os.remove(spooled.path)
+
+
+def stream_to_file(stream, path, max_size=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copy a file-like object to ``path`` chunk by chunk, hashing on the fly
+
+    :param stream: readable binary file-like object
+    :param path: destination path
+    :type path: str
+    :param max_size: max allowed size in bytes
+    :type max_size: int
+    :param chunk_size: read size
+    :type chunk_size: int
+
+    :return: sha256 hexdigest and size of the written file
+    :rtype: tuple
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = path + UPLOAD_TMP_SUFFIX
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise RequestEntityTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return digest.hexdigest(), size
+
+
+def save_file_storage(file, directory, make_filename):
+    """Save an uploaded ``FileStorage`` in ``directory``
+
+    Files already spooled on disk by ``UploadRequest`` are renamed (no copy),
+    others are streamed by chunks.
+
+    :param file: uploaded file
+    :type file: werkzeug.datastructures.FileStorage
+    :param directory: destination directory
+    :type directory: str
+    :param make_filename: callable building the filename from the sha256 digest
+    :type make_filename: function
+
+    :return: saved filename and size
+    :rtype: tuple
+    """
+    stream = file.stream
+    if isinstance(stream, HashingSpooledFile):
+        stream.flush()
+        filename = make_filename(stream.hexdigest())
+        os.replace(stream.path, os.path.join(directory, filename))
+        observe_upload(stream.size)
+        return filename, stream.size
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=UPLOAD_TMP_PREFIX, suffix=UPLOAD_TMP_SUFFIX, dir=directory
+    )
+    os.close(fd)
+    try:
+        digest, size = stream_to_file(
+            stream,
+            tmp_path,
+            max_size=get_max_content_length(),
+            chunk_size=get_upload_config().get("CHUNK_SIZE", DEFAULT_CHUNK_SIZE),
+        )
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    filename = make_filename(digest)
+    os.replace(tmp_path, os.path.join(directory, filename))
+    observe_upload(size)
+    return filename, size
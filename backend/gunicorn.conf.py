@@ -0,0 +1,87 @@
+"""
+    Gunicorn settings and server hooks (used by start_gunicorn.sh)
+"""
+
+import sys
+
+from gncitizen.utils.env import app_conf
+from gncitizen.utils.metrics import (
+    clear_multiproc_dir,
+    mark_worker_dead,
+    set_multiproc_env,
+)
+
+# Build the app (and warm its caches) once in the master process
+preload_app = app_conf.get("STARTUP", {}).get("PRELOAD", False)
+
+
+def on_starting(server):
+    metrics_conf = app_conf.get("METRICS", {})
+    if metrics_conf.get("ENABLED", False):
+        # Inherited by the workers, and needed here by child_exit
+        multiproc_dir = set_multiproc_env(metrics_conf.get("MULTIPROC_DIR"))
+        # Prometheus samples of a previous run must not be aggregated
+        clear_multiproc_dir(multiproc_dir)
+    startup_conf = app_conf.get("STARTUP", {})
+    if startup_conf.get("INIT_DB", True):
+        # Migrated here, not by each worker at the same time
+        init_database(server)
+    elif startup_conf.get("CHECK_SCHEMA", True):
+        check_schema(server)
+
+
+def init_database(server):
+    """Create and migrate the database once, before workers start"""
+    if server.cfg.preload_app:
+        # Already done by get_app in this process
+        return
+    from gncitizen.utils.preload import dispose_engine
+    from server import get_app
+
+    app = get_app(app_conf)
+    # Connections opened here must not be inherited by workers
+    dispose_engine(app)
+
+
+def check_schema(server):
+    """Refuse to start workers on a database behind the migrations"""
+    from sqlalchemy import create_engine
+
+    from gncitizen.utils.migrations import get_current_heads, get_script_heads
+
+    engine = create_engine(app_conf["SQLALCHEMY_DATABASE_URI"])
+    try:
+        current, heads = get_current_heads(engine), get_script_heads()
+    finally:
+        engine.dispose()
+    if current != heads:
+        server.log.error(
+            "Database at revision %s instead of %s, run `flask db-upgrade`",
+            ", ".join(current) or "none",
+            ", ".join(heads),
+        )
+        sys.exit(1)
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        # Connections opened in the master must not be shared by workers
+        from gncitizen.utils.preload import dispose_engine
+        from wsgi import app
+
+        dispose_engine(app)
+
+
+def post_worker_init(worker):
+    # Retries left pending by a restart are sent without waiting for a new email
+    from gncitizen.utils.mail_outbox import mail_sender
+
+    mail_sender.notify()
+    # Imports of zone files interrupted by a killed or recycled worker
+    from gncitizen.utils.geometry_import import resume_geometry_imports
+
+    resume_geometry_imports(worker.wsgi)
+
+
+def child_exit(server, worker):
+    mark_worker_dead(worker.pid)
@@ -0,0 +1,74 @@
+"""Alembic environment of GeoNature-citizen
+
+Run through the flask commands (``flask db-upgrade``, ``flask db-check``,
+``flask db-revision``), which use the database of the app configuration.
+"""
+
+from alembic import context
+from flask import current_app
+
+from gncitizen.utils.env import db, load_config
+from gncitizen.utils.migrations import MANAGED_SCHEMAS
+
+config = context.config
+target_metadata = db.metadata
+
+
+def include_name(name, type_, parent_names):
+    if type_ == "schema":
+        return name in MANAGED_SCHEMAS
+    return True
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == "table":
+        # Tables without model (partitions, see gncitizen.utils.partitioning)
+        # are never dropped
+        if reflected and compare_to is None:
+            return False
+        return object.schema in MANAGED_SCHEMAS
+    return True
+
+
+def get_app():
+    if current_app:
+        return current_app._get_current_object()
+    from server import get_app as create_app
+
+    return create_app(load_config())
+
+
+def run_migrations_offline():
+    """Print the SQL of the migrations (``--sql``)"""
+    context.configure(
+        url=load_config()["SQLALCHEMY_DATABASE_URI"],
+        target_metadata=target_metadata,
+        literal_binds=True,
+        include_schemas=True,
+        include_name=include_name,
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    app = get_app()
+    with app.app_context():
+        with db.engine.connect() as connection:
+            context.configure(
+                connection=connection,
+                target_metadata=target_metadata,
+                include_schemas=True,
+                include_name=include_name,
+                include_object=include_object,
+                compare_type=True,
+            )
+            with context.begin_transaction():
+                context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
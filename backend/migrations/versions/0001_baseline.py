@@ -0,0 +1,24 @@
+"""Baseline: schema created by versions up to 0.99.2
+
+Older databases must first be upgraded with the scripts of
+``data/migrations``, ``flask db-upgrade`` then stamps them at this revision.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2021-06-01 00:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
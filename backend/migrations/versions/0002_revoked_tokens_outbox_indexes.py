@@ -0,0 +1,178 @@
+"""Revoked tokens expiration, mail outbox and indexes of the hot routes
+
+Indexes are built concurrently and the expiration of revoked tokens is
+backfilled by batches, tables stay writable during the upgrade.
+
+Revision ID: 0002_revoked_tokens_outbox_indexes
+Revises: 0001_baseline
+Create Date: 2021-06-15 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from gncitizen.utils.migrations import (
+    batched_backfill,
+    create_index_concurrently,
+    drop_index_concurrently,
+)
+
+# revision identifiers, used by Alembic.
+revision = "0002_revoked_tokens_outbox_indexes"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+"""(name, schema, table, columns, method)"""
+INDEXES = (
+    ("ix_t_revoked_tokens_jti", "gnc_core", "t_revoked_tokens", ["jti"], None),
+    ("ix_t_revoked_tokens_expires", "gnc_core", "t_revoked_tokens", ["expires"], None),
+    (
+        "idx_t_obstax_id_program_timestamp_create",
+        "gnc_obstax",
+        "t_obstax",
+        ["id_program", "timestamp_create"],
+        None,
+    ),
+    (
+        "idx_t_obstax_id_role_timestamp_create",
+        "gnc_obstax",
+        "t_obstax",
+        ["id_role", "timestamp_create"],
+        None,
+    ),
+    ("idx_t_obstax_cd_nom", "gnc_obstax", "t_obstax", ["cd_nom"], None),
+    (
+        "idx_t_obstax_timestamp_create",
+        "gnc_obstax",
+        "t_obstax",
+        ["timestamp_create"],
+        None,
+    ),
+    (
+        "idx_cor_obstax_media_id_data_source",
+        "gnc_obstax",
+        "cor_obstax_media",
+        ["id_data_source"],
+        None,
+    ),
+    (
+        "idx_cor_obstax_media_id_media",
+        "gnc_obstax",
+        "cor_obstax_media",
+        ["id_media"],
+        None,
+    ),
+    ("idx_t_sites_id_program", "gnc_sites", "t_sites", ["id_program"], None),
+    ("idx_t_sites_id_role", "gnc_sites", "t_sites", ["id_role"], None),
+    ("idx_t_visit_id_site_date", "gnc_sites", "t_visit", ["id_site", "date"], None),
+    ("idx_t_visit_id_role", "gnc_sites", "t_visit", ["id_role"], None),
+    (
+        "idx_cor_visites_media_id_data_source",
+        "gnc_sites",
+        "cor_visites_media",
+        ["id_data_source"],
+        None,
+    ),
+    (
+        "idx_cor_visites_media_id_media",
+        "gnc_sites",
+        "cor_visites_media",
+        ["id_media"],
+        None,
+    ),
+    (
+        "idx_cor_sites_obstax_id_site",
+        "gnc_sites",
+        "cor_sites_obstax",
+        ["id_site"],
+        None,
+    ),
+    (
+        "idx_cor_sites_obstax_id_obstax",
+        "gnc_sites",
+        "cor_sites_obstax",
+        ["id_obstax"],
+        None,
+    ),
+    ("idx_l_areas_id_type_enable", "ref_geo", "l_areas", ["id_type", "enable"], None),
+    (
+        "idx_bib_areas_types_type_name",
+        "ref_geo",
+        "bib_areas_types",
+        ["type_name"],
+        None,
+    ),
+    # Created by GeoAlchemy for tables created by the API, may be missing on
+    # ref_geo.l_areas when it was loaded from a dump
+    ("idx_l_areas_geom", "ref_geo", "l_areas", ["geom"], "gist"),
+    ("idx_t_obstax_geom", "gnc_obstax", "t_obstax", ["geom"], "gist"),
+    ("idx_t_sites_geom", "gnc_sites", "t_sites", ["geom"], "gist"),
+)
+
+ANALYZED_TABLES = (
+    "gnc_obstax.t_obstax",
+    "gnc_obstax.cor_obstax_media",
+    "gnc_sites.t_sites",
+    "gnc_sites.t_visit",
+    "gnc_sites.cor_visites_media",
+    "ref_geo.l_areas",
+)
+
+
+def upgrade():
+    # Nullable without default: no table rewrite
+    op.execute(
+        "ALTER TABLE gnc_core.t_revoked_tokens "
+        "ADD COLUMN IF NOT EXISTS expires timestamp"
+    )
+    # Tokens revoked before this version: purged after the default refresh
+    # token lifetime
+    batched_backfill(
+        op,
+        "t_revoked_tokens",
+        "expires = NOW() + INTERVAL '30 days'",
+        "expires IS NULL",
+        schema="gnc_core",
+    )
+
+    bind = op.get_bind()
+    if not bind.dialect.has_table(bind, "t_mail_outbox", schema="gnc_core"):
+        op.create_table(
+            "t_mail_outbox",
+            sa.Column("id_mail", sa.Integer, primary_key=True),
+            sa.Column("mail_from", sa.String(150), nullable=False),
+            sa.Column("mail_to", sa.String(150), nullable=False),
+            sa.Column("subject", sa.String(250)),
+            sa.Column("message", sa.Text, nullable=False),
+            sa.Column("status", sa.String(10), nullable=False),
+            sa.Column("attempts", sa.Integer, nullable=False),
+            sa.Column("next_attempt", sa.DateTime, nullable=False),
+            sa.Column("last_error", sa.Text),
+            sa.Column("sent_at", sa.DateTime),
+            sa.Column("timestamp_create", sa.DateTime, nullable=False),
+            sa.Column("timestamp_update", sa.DateTime),
+            schema="gnc_core",
+        )
+        op.create_index(
+            "idx_t_mail_outbox_pending",
+            "t_mail_outbox",
+            ["status", "next_attempt"],
+            schema="gnc_core",
+        )
+
+    for name, schema, table, columns, using in INDEXES:
+        create_index_concurrently(op, name, table, columns, schema=schema, using=using)
+
+    for table in ANALYZED_TABLES:
+        op.execute("ANALYZE {}".format(table))
+
+
+def downgrade():
+    for name, schema, _table, _columns, _using in reversed(INDEXES):
+        if name in ("idx_l_areas_geom", "idx_t_obstax_geom", "idx_t_sites_geom"):
+            # Possibly created with the tables, kept
+            continue
+        drop_index_concurrently(op, name, schema=schema)
+    op.drop_table("t_mail_outbox", schema="gnc_core")
+    op.drop_column("t_revoked_tokens", "expires", schema="gnc_core")
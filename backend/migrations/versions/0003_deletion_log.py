@@ -0,0 +1,150 @@
+"""Deletion log and indexes of the delta-sync API
+
+Deletions of observations, sites and visits are logged by a trigger in
+gnc_core.t_deletions. Rows never updated get their creation date as last
+update, so that they are found by `timestamp_update > version` queries.
+
+Revision ID: 0003_deletion_log
+Revises: 0002_revoked_tokens_outbox_indexes
+Create Date: 2021-07-01 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from gncitizen.utils.migrations import (
+    batched_backfill,
+    create_index_concurrently,
+    drop_index_concurrently,
+)
+
+# revision identifiers, used by Alembic.
+revision = "0003_deletion_log"
+down_revision = "0002_revoked_tokens_outbox_indexes"
+branch_labels = None
+depends_on = None
+
+"""(table, entity, primary key)"""
+LOGGED_DELETIONS = (
+    ("gnc_obstax.t_obstax", "observation", "id_observation"),
+    ("gnc_sites.t_sites", "site", "id_site"),
+    ("gnc_sites.t_visit", "visit", "id_visit"),
+)
+
+LOG_DELETION_FUNCTION = """
+CREATE OR REPLACE FUNCTION gnc_core.log_deletion() RETURNS trigger AS $$
+DECLARE
+    old_row jsonb := to_jsonb(OLD);
+    program integer := (old_row ->> 'id_program')::integer;
+BEGIN
+    -- Rows moved to a new partition are not deleted
+    IF current_setting('gnc.log_deletions', true) = 'off' THEN
+        RETURN OLD;
+    END IF;
+    IF program IS NULL AND TG_ARGV[0] = 'visit' THEN
+        SELECT s.id_program INTO program FROM gnc_sites.t_sites s
+        WHERE s.id_site = (old_row ->> 'id_site')::integer;
+        IF NOT FOUND THEN
+            -- Deleted with its site, the site deletion is logged
+            RETURN OLD;
+        END IF;
+    END IF;
+    INSERT INTO gnc_core.t_deletions (entity, id_entity, id_program)
+    VALUES (TG_ARGV[0], (old_row ->> TG_ARGV[1])::integer, program);
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql"""
+
+"""(name, schema, table, columns, method)"""
+INDEXES = (
+    (
+        "idx_t_obstax_id_program_timestamp_update",
+        "gnc_obstax",
+        "t_obstax",
+        ["id_program", "timestamp_update"],
+        None,
+    ),
+    (
+        "idx_t_sites_id_program_timestamp_update",
+        "gnc_sites",
+        "t_sites",
+        ["id_program", "timestamp_update"],
+        None,
+    ),
+    (
+        "idx_t_visit_timestamp_update",
+        "gnc_sites",
+        "t_visit",
+        ["timestamp_update"],
+        None,
+    ),
+)
+
+"""(schema, table, primary key)"""
+BACKFILLED_TABLES = (
+    ("gnc_obstax", "t_obstax", "id_observation"),
+    ("gnc_sites", "t_sites", "id_site"),
+    ("gnc_sites", "t_visit", "id_visit"),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if not bind.dialect.has_table(bind, "t_deletions", schema="gnc_core"):
+        op.create_table(
+            "t_deletions",
+            sa.Column("id_deletion", sa.BigInteger, primary_key=True),
+            sa.Column("entity", sa.String(20), nullable=False),
+            sa.Column("id_entity", sa.Integer, nullable=False),
+            sa.Column("id_program", sa.Integer),
+            sa.Column(
+                "timestamp_delete",
+                sa.DateTime,
+                nullable=False,
+                server_default=sa.text("(now() AT TIME ZONE 'utc')"),
+            ),
+            schema="gnc_core",
+        )
+        op.create_index(
+            "idx_t_deletions_id_program_timestamp_delete",
+            "t_deletions",
+            ["id_program", "timestamp_delete"],
+            schema="gnc_core",
+        )
+    op.execute(sa.text(LOG_DELETION_FUNCTION))
+    for table, entity, pk in LOGGED_DELETIONS:
+        name = table.split(".")[1]
+        op.execute("DROP TRIGGER IF EXISTS {}_log_deletion ON {}".format(name, table))
+        op.execute(
+            "CREATE TRIGGER {name}_log_deletion AFTER DELETE ON {table} "
+            "FOR EACH ROW EXECUTE PROCEDURE "
+            "gnc_core.log_deletion('{entity}', '{pk}')".format(
+                name=name, table=table, entity=entity, pk=pk
+            )
+        )
+
+    for schema, table, pk in BACKFILLED_TABLES:
+        batched_backfill(
+            op,
+            table,
+            "timestamp_update = timestamp_create",
+            "timestamp_update IS NULL",
+            pk=pk,
+            schema=schema,
+        )
+
+    for name, schema, table, columns, using in INDEXES:
+        create_index_concurrently(op, name, table, columns, schema=schema, using=using)
+
+
+def downgrade():
+    for name, schema, _table, _columns, _using in reversed(INDEXES):
+        drop_index_concurrently(op, name, schema=schema)
+    for table, _entity, _pk in LOGGED_DELETIONS:
+        op.execute(
+            "DROP TRIGGER IF EXISTS {}_log_deletion ON {}".format(
+                table.split(".")[1], table
+            )
+        )
+    op.execute("DROP FUNCTION IF EXISTS gnc_core.log_deletion()")
+    op.drop_table("t_deletions", schema="gnc_core")
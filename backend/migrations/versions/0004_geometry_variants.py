@@ -0,0 +1,52 @@
+"""Simplified versions, bbox and centroid of program geometries
+
+Computed from the stored geometries, then by the API on each geometry save.
+
+Revision ID: 0004_geometry_variants
+Revises: 0003_deletion_log
+Create Date: 2021-07-15 00:00:00
+
+"""
+from alembic import op
+
+from gncitizen.utils.migrations import batched_backfill
+
+# revision identifiers, used by Alembic.
+revision = "0004_geometry_variants"
+down_revision = "0003_deletion_log"
+branch_labels = None
+depends_on = None
+
+"""(column, type, value)"""
+COLUMNS = (
+    ("geom_low", "GEOMETRY", "ST_SimplifyPreserveTopology(geom, 0.01)"),
+    ("geom_medium", "GEOMETRY", "ST_SimplifyPreserveTopology(geom, 0.001)"),
+    ("geom_high", "GEOMETRY", "ST_SimplifyPreserveTopology(geom, 0.0001)"),
+    ("bbox", "GEOMETRY", "ST_Envelope(geom)"),
+    ("centroid", "POINT", "ST_Centroid(geom)"),
+)
+
+
+def upgrade():
+    for column, geometry_type, _value in COLUMNS:
+        # Nullable without default: no table rewrite
+        op.execute(
+            "ALTER TABLE gnc_core.t_geometries "
+            "ADD COLUMN IF NOT EXISTS {} geometry({}, 4326)".format(
+                column, geometry_type
+            )
+        )
+    batched_backfill(
+        op,
+        "t_geometries",
+        ", ".join("{} = {}".format(column, value) for column, _type, value in COLUMNS),
+        "centroid IS NULL AND geom IS NOT NULL",
+        pk="id_geom",
+        schema="gnc_core",
+        batch_size=10,
+    )
+
+
+def downgrade():
+    for column, _type, _value in reversed(COLUMNS):
+        op.drop_column("t_geometries", column, schema="gnc_core")
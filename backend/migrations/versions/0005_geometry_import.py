@@ -0,0 +1,35 @@
+"""Status of the background imports of geometry files
+
+Revision ID: 0005_geometry_import
+Revises: 0004_geometry_variants
+Create Date: 2021-07-20 00:00:00
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0005_geometry_import"
+down_revision = "0004_geometry_variants"
+branch_labels = None
+depends_on = None
+
+"""(column, type)"""
+COLUMNS = (
+    ("import_status", "varchar(10)"),
+    ("import_progress", "integer"),
+    ("import_error", "text"),
+)
+
+
+def upgrade():
+    for column, column_type in COLUMNS:
+        # Nullable without default: no table rewrite
+        op.execute(
+            "ALTER TABLE gnc_core.t_geometries "
+            "ADD COLUMN IF NOT EXISTS {} {}".format(column, column_type)
+        )
+
+
+def downgrade():
+    for column, _type in reversed(COLUMNS):
+        op.drop_column("t_geometries", column, schema="gnc_core")
@@ -13,7 +13,17 @@ from gncitizen.utils.env import (
     admin,
     ckeditor,
 )
-from gncitizen.utils.init_data import create_schemas, populate_modules
+from gncitizen.utils.db_pool import get_engine_options
+from gncitizen.utils.encoder import json_encoder
+from gncitizen.utils.metrics import init_metrics
+from gncitizen.utils.profiling import init_profiling
+from gncitizen.utils.startup import (
+    init_db,
+    register_commands,
+    register_core_blueprints,
+    report_import_times,
+)
+from gncitizen.utils.upload import UploadRequest
 from gncitizen import __version__
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -49,6 +59,8 @@ def get_app(config, _app=None, with_external_mods=True, url_prefix="/api"):
 
     app = Flask(__name__)
     app.config.update(config)
+    # Stream uploaded files to MEDIA_DIR with per endpoint size limits
+    app.request_class = UploadRequest
     if app.config["DEBUG"]:
         from flask.logging import default_handler
         import coloredlogs
@@ -82,35 +94,38 @@ def get_app(config, _app=None, with_external_mods=True, url_prefix="/api"):
     # https://github.com/corydolphin/flask-cors/issues/67
     # https://stackoverflow.com/questions/29825235/getting-cors-headers-in-a-flask-500-error
 
-    # Bind app to DB
+    # Bind app to DB, pool settings come from the [DB_POOL] section
+    engine_options = get_engine_options(app.config)
+    engine_options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
     db.init_app(app)
     # JWT Auth
     jwt.init_app(app)
     swagger.init_app(app)
     admin.init_app(app)
     ckeditor.init_app(app)
+    # orjson or json for API responses ([JSON] ENCODER)
+    json_encoder.init_app(app)
+    # flask db-init, db-upgrade, db-check, db-partition, index-advisor, mail-send,
+    # sync-purge, bundle-build, geometry-import
+    register_commands(app)
 
     with app.app_context():
+        # Opt-in per request profiling (PROFILING.ENABLED)
+        init_profiling(app, db.engine)
+        # Prometheus metrics (METRICS.ENABLED)
+        init_metrics(app, db.engine)
+
+        # Schemas and tables are created by `flask db-init` when INIT_DB is false
+        if app.config.get("STARTUP", {}).get("INIT_DB", True):
+            init_db(db)
+
+        register_core_blueprints(app, url_prefix)
+        # Background delivery of gnc_core.t_mail_outbox
+        from gncitizen.utils.mail_outbox import mail_sender
 
-        create_schemas(db)
-        db.create_all()
-        populate_modules(db)
-
-        from gncitizen.core.users.routes import users_api
-        from gncitizen.core.commons.routes import commons_api
-        from gncitizen.core.observations.routes import obstax_api
-        from gncitizen.core.ref_geo.routes import geo_api
-        from gncitizen.core.badges.routes import badges_api
-        from gncitizen.core.taxonomy.routes import taxo_api
-        from gncitizen.core.sites.routes import sites_api
-
-        app.register_blueprint(users_api, url_prefix=url_prefix)
-        app.register_blueprint(commons_api, url_prefix=url_prefix)
-        app.register_blueprint(obstax_api, url_prefix=url_prefix)
-        app.register_blueprint(geo_api, url_prefix=url_prefix)
-        app.register_blueprint(badges_api, url_prefix=url_prefix)
-        app.register_blueprint(taxo_api, url_prefix=url_prefix)
-        app.register_blueprint(sites_api, url_prefix=url_prefix + "/sites")
+        mail_sender.init_app(app)
+        report_import_times(app)
 
         CORS(app, supports_credentials=True)
 
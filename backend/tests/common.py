@@ -82,3 +82,29 @@ def getrequest(url):
     params = auth()
     response = requests.get(myUrl, headers=headers, data=params)
     return response
+
+
+def authheaders():
+    h = {"Accept": mimetype}
+    if access_token:
+        h.update({"Authorization": "Bearer {}".format(access_token)})
+    return h
+
+
+def login():
+    response = requests.post(mainUrl + "login", headers=headers, data=auth())
+    data = response.json()
+    set_tokens(data["access_token"], data["refresh_token"])
+    return data
+
+
+def formrequest(url, params):
+    myUrl = mainUrl + url
+    response = requests.post(myUrl, headers=authheaders(), data=params)
+    return response
+
+
+def deleterequest(url):
+    myUrl = mainUrl + url
+    response = requests.delete(myUrl, headers=authheaders())
+    return response
@@ -0,0 +1,76 @@
+import io
+import json
+import os
+import time
+import unittest
+import zipfile
+
+import requests
+
+from gncitizen.utils.bundles import BUNDLES_FOLDER, get_bundles_config
+from gncitizen.utils.env import MEDIA_DIR, load_config
+from gncitizen.utils.media import MEDIA_DIGEST_LENGTH
+from server import get_app
+from tests.common import headers, mainUrl
+
+ID_PROGRAM = 1
+
+"""Max delay (s) for the background build of a bundle"""
+BUILD_TIMEOUT = 60
+
+
+def bundlerequest(id_program):
+    return requests.get(
+        mainUrl + "programs/{}/bundle".format(id_program),
+        headers=headers,
+        allow_redirects=False,
+    )
+
+
+class ProgramBundleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        if not get_bundles_config(self.app)["BACKGROUND"]:
+            self.skipTest("bundles are only built by flask bundle-build")
+        # Built again by the next request
+        folder = os.path.join(MEDIA_DIR, BUNDLES_FOLDER)
+        prefix = "program_{}_".format(ID_PROGRAM)
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                if name.startswith(prefix):
+                    os.remove(os.path.join(folder, name))
+
+    def test_get_program_bundle(self):
+        response = bundlerequest(ID_PROGRAM)
+        self.assertEqual(response.status_code, 202)
+        self.assertIn("Retry-After", response.headers)
+
+        deadline = time.monotonic() + BUILD_TIMEOUT
+        while response.status_code == 202 and time.monotonic() < deadline:
+            time.sleep(1)
+            response = bundlerequest(ID_PROGRAM)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        location = response.headers["Location"]
+        self.assertIn("/{}/program_{}_".format(BUNDLES_FOLDER, ID_PROGRAM), location)
+
+        # Same bundle while the program is unchanged
+        self.assertEqual(bundlerequest(ID_PROGRAM).headers["Location"], location)
+
+        response = requests.get(requests.compat.urljoin(mainUrl, location))
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            names = archive.namelist()
+            for name in ("program", "customform", "species", "manifest"):
+                self.assertIn("{}.json".format(name), names)
+            manifest = json.loads(archive.read("manifest.json"))
+            program = json.loads(archive.read("program.json"))
+        self.assertIn(manifest["version"][:MEDIA_DIGEST_LENGTH], location)
+        self.assertEqual(program["properties"]["id_program"], ID_PROGRAM)
+
+    def test_unknown_program(self):
+        self.assertEqual(bundlerequest(0).status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
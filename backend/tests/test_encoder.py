@@ -0,0 +1,41 @@
+import json
+import unittest
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from gncitizen.utils.encoder import json_dumps, orjson, orjson_dumps
+from gncitizen.utils.sqlalchemy import NATIVE_TYPES, SERIALIZERS
+
+"""Values of each type left unconverted by as_dict with orjson"""
+NATIVE_VALUES = {
+    "date": date(2021, 1, 31),
+    "datetime": datetime(2021, 2, 1, 12, 30, 0, 5),
+    "time": time(8, 15),
+    "timestamp": datetime(2021, 2, 1, 12, 30),
+    "uuid": uuid.UUID("0c5e5c0e-8f4b-4b8e-9a57-3e1f0c2a1b7d"),
+    "numeric": Decimal("0.50"),
+}
+
+
+class EncoderTestCase(unittest.TestCase):
+    def test_native_values(self):
+        self.assertEqual(set(NATIVE_VALUES), set(NATIVE_TYPES))
+        serialized = {
+            type_: SERIALIZERS[type_](value) for type_, value in NATIVE_VALUES.items()
+        }
+        # Formatted by the encoder as by the as_dict serializers
+        self.assertEqual(json.loads(json_dumps(NATIVE_VALUES)), serialized)
+        if orjson is None:
+            self.skipTest("orjson is not installed")
+        self.assertEqual(json.loads(orjson_dumps(NATIVE_VALUES)), serialized)
+
+    def test_same_responses(self):
+        if orjson is None:
+            self.skipTest("orjson is not installed")
+        data = {"properties": dict(NATIVE_VALUES, count=0, name="é")}
+        self.assertEqual(json.loads(orjson_dumps(data)), json.loads(json_dumps(data)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import time
+import unittest
+import uuid
+
+import requests
+from flask_jwt_extended import decode_token
+
+from gncitizen.core.users.models import RevokedTokenModel, UserModel
+from gncitizen.utils.env import db, load_config
+from gncitizen.utils.jwt import RevokedTokens, revoked_tokens
+from server import get_app
+from tests.common import APP_CONF, auth, email, headers, mainUrl, user
+
+
+def tokenrequest(url, token):
+    h = headers.copy()
+    h.update({"Authorization": "Bearer {}".format(token)})
+    return requests.post(mainUrl + url, headers=h)
+
+
+class JwtClaimsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.context = self.app.app_context()
+        self.context.push()
+        response = requests.post(mainUrl + "login", headers=headers, data=auth())
+        self.assertEqual(response.status_code, 200)
+        self.tokens = response.json()
+
+    def tearDown(self):
+        tokenrequest("logout", self.tokens["access_token"])
+        db.session.remove()
+        self.context.pop()
+
+    def assertUserClaims(self, payload):
+        test_user = UserModel.query.filter_by(email=email).one()
+        self.assertEqual(payload["sub"], email)
+        self.assertEqual(payload["id_user"], test_user.id_user)
+        self.assertEqual(payload["username"], user)
+        self.assertEqual(payload["admin"], bool(test_user.admin))
+
+    def test_login_claims(self):
+        access = decode_token(self.tokens["access_token"])
+        self.assertEqual(access["type"], "access")
+        self.assertUserClaims(access)
+        refresh = decode_token(self.tokens["refresh_token"])
+        self.assertEqual(refresh["type"], "refresh")
+        self.assertUserClaims(refresh)
+
+    def test_token_refresh_claims(self):
+        response = tokenrequest("token_refresh", self.tokens["refresh_token"])
+        self.assertEqual(response.status_code, 200)
+        self.assertUserClaims(decode_token(response.json()["access_token"]))
+
+
+class RevokedTokensTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.context = self.app.app_context()
+        self.context.push()
+        self.jtis = []
+
+    def tearDown(self):
+        RevokedTokenModel.query.filter(RevokedTokenModel.jti.in_(self.jtis)).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        db.session.remove()
+        self.context.pop()
+
+    def new_jti(self):
+        jti = str(uuid.uuid4())
+        self.jtis.append(jti)
+        return jti
+
+    def test_revoke(self):
+        jti = self.new_jti()
+        self.assertFalse(revoked_tokens.is_revoked(jti))
+        revoked_tokens.revoke(jti, int(time.time()) + 3600)
+        # Immediately in this process
+        self.assertTrue(revoked_tokens.is_revoked(jti))
+        # Loaded from t_revoked_tokens by other processes
+        self.assertTrue(RevokedTokens().is_revoked(jti))
+        self.assertFalse(RevokedTokens().is_revoked(self.new_jti()))
+
+    def test_refresh_interval(self):
+        self.app.config["JWT_REVOCATION"] = {
+            "REFRESH_INTERVAL": 3600,
+            "PURGE_INTERVAL": 3600,
+        }
+        other_worker = RevokedTokens()
+        jti = self.new_jti()
+        self.assertFalse(other_worker.is_revoked(jti))
+        revoked_tokens.revoke(jti, int(time.time()) + 3600)
+        # Not refreshed yet
+        self.assertFalse(other_worker.is_revoked(jti))
+        self.app.config["JWT_REVOCATION"]["REFRESH_INTERVAL"] = 0
+        self.assertTrue(other_worker.is_revoked(jti))
+
+    def test_purge_expired(self):
+        self.app.config["JWT_REVOCATION"] = {"REFRESH_INTERVAL": 0, "PURGE_INTERVAL": 0}
+        tokens = RevokedTokens()
+        jti = self.new_jti()
+        tokens.revoke(jti, int(time.time()) - 1)
+        self.assertFalse(tokens.is_revoked(jti))
+        self.assertIsNone(RevokedTokenModel.query.filter_by(jti=jti).first())
+
+
+class LogoutTestCase(unittest.TestCase):
+    def test_revoked_token_refused(self):
+        response = requests.post(mainUrl + "login", headers=headers, data=auth())
+        self.assertEqual(response.status_code, 200)
+        tokens = response.json()
+        response = tokenrequest("logout", tokens["access_token"])
+        self.assertEqual(response.status_code, 200)
+
+        # Seen by every worker after REFRESH_INTERVAL
+        time.sleep(APP_CONF.get("JWT_REVOCATION", {}).get("REFRESH_INTERVAL", 5) + 1)
+        for _i in range(4):
+            response = tokenrequest("logout", tokens["access_token"])
+            self.assertEqual(response.status_code, 401)
+        # Refresh tokens are independent
+        response = tokenrequest("token_refresh", tokens["refresh_token"])
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from unittest import mock
+
+from gncitizen.core.commons.models import MailOutboxModel
+from gncitizen.utils.env import db, load_config
+from gncitizen.utils.mail_outbox import purge_outbox, queue_mail, send_pending
+from server import get_app
+from tests.common import email
+
+# Sender of the test emails, the only ones sent or purged by the tests
+MAIL_FROM = "outbox-test@test.com"
+
+
+class MailOutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.app.config["MAIL_OUTBOX"] = dict(
+            self.app.config.get("MAIL_OUTBOX", {}), MAX_ATTEMPTS=2
+        )
+        self.context = self.app.app_context()
+        self.context.push()
+        self.smtp = mock.MagicMock()
+        patcher = mock.patch(
+            "gncitizen.utils.mail_outbox.open_smtp_connection",
+            return_value=self.smtp,
+        )
+        self.open_smtp_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db.session.rollback()
+        MailOutboxModel.query.filter_by(mail_from=MAIL_FROM).delete()
+        db.session.commit()
+        db.session.remove()
+        self.context.pop()
+
+    def queue(self, body="new password: secret"):
+        msg = MIMEText(body)
+        msg["Subject"] = "outbox test"
+        mail = queue_mail(msg, MAIL_FROM, email)
+        # Not due: left alone by the senders of the running server
+        mail.next_attempt = datetime.utcnow() + timedelta(days=1)
+        db.session.commit()
+        return mail.id_mail
+
+    def send_pending(self):
+        """Send the test emails, made due just before"""
+        MailOutboxModel.query.filter_by(mail_from=MAIL_FROM, status="pending").update(
+            {"next_attempt": datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+        return send_pending(mail_from=MAIL_FROM)
+
+    def test_queue_mail(self):
+        mail = MailOutboxModel.query.get(self.queue())
+        self.assertEqual(mail.status, "pending")
+        self.assertEqual(mail.attempts, 0)
+        self.assertEqual(mail.subject, "outbox test")
+        self.assertIn("new password: secret", mail.message)
+
+    def test_send_pending(self):
+        id_mail = self.queue()
+        self.assertEqual(self.send_pending(), (1, 0))
+        self.smtp.sendmail.assert_called_once_with(MAIL_FROM, [email], mock.ANY)
+        self.smtp.quit.assert_called_once()
+        mail = MailOutboxModel.query.get(id_mail)
+        self.assertEqual(mail.status, "sent")
+        self.assertEqual(mail.attempts, 1)
+        self.assertIsNotNone(mail.sent_at)
+        # The body may contain credentials
+        self.assertEqual(mail.message, "")
+
+        # Already sent
+        self.smtp.reset_mock()
+        self.assertEqual(self.send_pending(), (0, 0))
+        self.smtp.sendmail.assert_not_called()
+
+    def test_retry_then_give_up(self):
+        self.open_smtp_connection.side_effect = OSError("connection refused")
+        id_mail = self.queue()
+        self.send_pending()
+        mail = MailOutboxModel.query.get(id_mail)
+        self.assertEqual(mail.status, "pending")
+        self.assertEqual(mail.attempts, 1)
+        self.assertIn("connection refused", mail.last_error)
+        self.assertGreater(mail.next_attempt, datetime.utcnow())
+        self.assertIn("new password: secret", mail.message)
+
+        # Last attempt
+        self.send_pending()
+        mail = MailOutboxModel.query.get(id_mail)
+        self.assertEqual(mail.status, "failed")
+        self.assertEqual(mail.attempts, 2)
+        self.assertEqual(mail.message, "")
+
+    def test_purge_outbox(self):
+        old_sent, old_pending, sent = self.queue(), self.queue(), self.queue()
+        self.send_pending()
+        MailOutboxModel.query.get(old_pending).status = "pending"
+        for id_mail in (old_sent, old_pending):
+            MailOutboxModel.query.get(id_mail).timestamp_create = (
+                datetime.utcnow() - timedelta(days=8)
+            )
+        db.session.commit()
+
+        self.assertEqual(purge_outbox(7, mail_from=MAIL_FROM), 1)
+        self.assertIsNone(MailOutboxModel.query.get(old_sent))
+        self.assertIsNotNone(MailOutboxModel.query.get(old_pending))
+        self.assertIsNotNone(MailOutboxModel.query.get(sent))
+
+
+if __name__ == "__main__":
+    unittest.main()
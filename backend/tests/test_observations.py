@@ -1,10 +1,21 @@
 import unittest
+from collections import namedtuple
+from datetime import date, datetime
 
-from gncitizen.utils.env import load_config
+from gncitizen.core.commons.models import ProgramsModel
+from gncitizen.core.observations.models import ObservationModel
+from gncitizen.core.observations.routes import obs_keys
+from gncitizen.utils.env import db, load_config
+from gncitizen.utils.sqlalchemy import Projection
+from gncitizen.utils.taxonomy import get_list_cd_noms, get_species_from_cd_noms
 from server import get_app
 from tests.common import getrequest
 
 
+def observation_ids(data):
+    return [feature["properties"]["id_observation"] for feature in data["features"]]
+
+
 class ObservationsTestCase(unittest.TestCase):
     def setUp(self):
         """Define test variables and initialize app."""
@@ -27,9 +38,185 @@ class ObservationsTestCase(unittest.TestCase):
         self.assertEqual(data["type"], "FeatureCollection")
         self.assertIsInstance(data["features"], list)
 
+    def test_get_all_observations(self):
+        response = getrequest("programs/all/observations")
+        self.assertEqual(response.status_code, 200)
+        features = response.json()["features"]
+        ids = [feature["properties"]["id_observation"] for feature in features]
+        # One feature per observation, whatever its number of medias
+        self.assertEqual(len(ids), len(set(ids)))
+        for feature in features:
+            self.assertEqual(feature["geometry"]["type"], "Point")
+            for key in obs_keys:
+                self.assertIn(key, feature["properties"])
+
+    def test_get_program_observations(self):
+        response = getrequest("programs/1/observations")
+        self.assertEqual(response.status_code, 200)
+        for feature in response.json()["features"]:
+            properties = feature["properties"]
+            self.assertEqual(properties["id_program"], 1)
+            self.assertEqual(set(properties["municipality"]), {"name", "code"})
+            self.assertEqual(set(properties["observer"]), {"username", "userAvatar"})
+            self.assertIn("image", properties)
+
+    def test_observations_pages(self):
+        response = getrequest("observations?per_page=2")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data["page"], data["per_page"]), (1, 2))
+        self.assertLessEqual(len(data["features"]), 2)
+        dates = [f["properties"]["timestamp_create"] for f in data["features"]]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        if not data["has_next"]:
+            return
+        self.assertEqual(len(data["features"]), 2)
+        response = getrequest("observations?per_page=2&page=2")
+        self.assertEqual(response.status_code, 200)
+        next_page = response.json()
+        self.assertEqual(next_page["page"], 2)
+        first_pages = observation_ids(data) + observation_ids(next_page)
+        self.assertEqual(len(set(first_pages)), len(first_pages))
+        data = getrequest("observations?per_page=4").json()
+        self.assertEqual(observation_ids(data)[: len(first_pages)], first_pages)
+
+    def test_observations_page_bounds(self):
+        conf = self.app.config.get("PAGINATION", {})
+        data = getrequest("observations").json()
+        self.assertEqual(
+            (data["page"], data["per_page"]), (1, conf.get("PER_PAGE", 100))
+        )
+        max_per_page = conf.get("MAX_PER_PAGE", 1000)
+        data = getrequest("observations?per_page={}".format(max_per_page + 1)).json()
+        self.assertEqual(data["per_page"], max_per_page)
+        data = getrequest("observations?per_page=0&page=0").json()
+        self.assertEqual((data["page"], data["per_page"]), (1, 1))
+
+    def test_observations_filters(self):
+        data = getrequest("observations?id_program=1").json()
+        for feature in data["features"]:
+            self.assertEqual(feature["properties"]["id_program"], 1)
+
+        data = getrequest("observations?per_page=2").json()
+        if not data["features"]:
+            self.skipTest("no observation")
+        properties = data["features"][0]["properties"]
+        cd_noms = {f["properties"]["cd_nom"] for f in data["features"]}
+        data = getrequest(
+            "observations?" + "&".join("cd_nom={}".format(c) for c in cd_noms)
+        ).json()
+        self.assertIn(properties["id_observation"], observation_ids(data))
+        for feature in data["features"]:
+            self.assertIn(feature["properties"]["cd_nom"], cd_noms)
+
+        day = properties["date"][:10]
+        data = getrequest("observations?date_min={0}&date_max={0}".format(day)).json()
+        self.assertIn(properties["id_observation"], observation_ids(data))
+        for feature in data["features"]:
+            self.assertEqual(feature["properties"]["date"][:10], day)
+
+        response = getrequest("observations?date_min=31/01/2021")
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_species_from_cd_noms(self):
+        with self.app.app_context():
+            self.assertEqual(get_species_from_cd_noms([None]), {})
+            cd_nom = self.observations_post_data["cd_nom"]
+            species = get_species_from_cd_noms([cd_nom, cd_nom, None])
+            self.assertEqual(list(species), [cd_nom])
+            for key in ("common_name", "sci_name", "cd_nom", "cd_ref"):
+                self.assertIn(key, species[cd_nom])
+
+    def test_get_observations_from_list(self):
+        with self.app.app_context():
+            program = ProgramsModel.query.filter(
+                ProgramsModel.taxonomy_list.isnot(None)
+            ).first()
+            if program is None:
+                self.skipTest("no program with a taxonomy list")
+            id_list = program.taxonomy_list
+            cd_noms = get_list_cd_noms(id_list)
+            if not isinstance(cd_noms, list):
+                cd_noms = [cd_nom for cd_nom, in db.session.execute(cd_noms)]
+            db.session.remove()
+
+        response = getrequest("observations/lists/{}?per_page=5".format(id_list))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data["page"], data["per_page"]), (1, 5))
+        self.assertIn("has_next", data)
+        for feature in data["features"]:
+            self.assertIn(feature["properties"]["cd_nom"], cd_noms)
+        dates = [f["properties"]["timestamp_create"] for f in data["features"]]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+        # Same page as the cd_nom filter
+        if cd_noms and len(cd_noms) <= 100:
+            filtered = getrequest(
+                "observations?per_page=5&"
+                + "&".join("cd_nom={}".format(c) for c in cd_noms)
+            ).json()
+            self.assertEqual(observation_ids(data), observation_ids(filtered))
+
     # def test_post_observation(self):
     #     response = self.client().post(
     #         mainUrl + 'observations', data=self.observations_post_data)
     #     data = response.json()
     #     print(data)
     #     self.assertEqual(response.status_code, 200)
+
+
+class ProjectionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.projection = Projection(
+            {
+                "id_observation": ObservationModel.id_observation,
+                "date": ObservationModel.date,
+                "timestamp_create": ObservationModel.timestamp_create,
+                "program": {
+                    "id_program": ProgramsModel.id_program,
+                    "title": ProgramsModel.title,
+                },
+            },
+            geometry=ObservationModel.geom,
+        )
+
+    def test_columns(self):
+        labels = [column.name for column in self.projection.columns]
+        self.assertEqual(
+            labels,
+            [
+                "id_observation",
+                "date",
+                "timestamp_create",
+                "program__id_program",
+                "program__title",
+                Projection.GEOMETRY_LABEL,
+            ],
+        )
+
+    def test_feature(self):
+        Row = namedtuple("Row", [column.name for column in self.projection.columns])
+        geometry = {"type": "Point", "coordinates": [5, 45]}
+        row = Row(1, date(2021, 1, 31), datetime(2021, 2, 1, 12, 0), 2, "P", geometry)
+        self.assertEqual(
+            self.projection.feature(row),
+            {
+                "type": "Feature",
+                "geometry": geometry,
+                "properties": {
+                    "id_observation": 1,
+                    "date": "2021-01-31",
+                    "timestamp_create": "2021-02-01 12:00:00",
+                    "program": {"id_program": 2, "title": "P"},
+                },
+            },
+        )
+        row = Row(1, None, None, None, None, None)
+        properties = self.projection.feature(row)["properties"]
+        self.assertIsNone(properties["date"])
+        self.assertEqual(properties["program"], {"id_program": None, "title": None})
+
+
+if __name__ == "__main__":
+    unittest.main()
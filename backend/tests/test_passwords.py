@@ -0,0 +1,86 @@
+import json
+import unittest
+
+from gncitizen.core.users.models import UserModel
+from gncitizen.utils.env import db, load_config
+from gncitizen.utils.passwords import hash_password, password_hasher, verify_password
+from server import get_app
+from tests.common import auth, email, postrequest, pwd
+
+# Hash of the test user (c.f. 'common.py'), scheme of previous versions
+LEGACY_HASH = "$pbkdf2-sha256$29000$BeAcw7hXqrXW2rvXuhdC6A$UMDBikxvbEXz8VhqAYQZDcS6BG6QUXbYi/EjCpvWVW0"  # noqa: S105,E501
+
+
+class PasswordsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+
+    def test_hash_password(self):
+        hash = hash_password(pwd)
+        context = password_hasher.context
+        self.assertEqual(context.identify(hash), context.default_scheme())
+        self.assertEqual(verify_password(pwd, hash), (True, None))
+
+    def test_verify_legacy_hash(self):
+        valid, new_hash = verify_password(pwd, LEGACY_HASH)
+        self.assertTrue(valid)
+        if password_hasher.context.needs_update(LEGACY_HASH):
+            self.assertIsNotNone(new_hash)
+            self.assertFalse(password_hasher.context.needs_update(new_hash))
+            self.assertEqual(verify_password(pwd, new_hash), (True, None))
+        else:
+            self.assertIsNone(new_hash)
+
+    def test_verify_invalid(self):
+        self.assertEqual(verify_password("wrong", LEGACY_HASH), (False, None))
+        self.assertEqual(verify_password(pwd, "not a hash"), (False, None))
+
+
+class LoginRehashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.context = self.app.app_context()
+        self.context.push()
+        self.set_password(LEGACY_HASH)
+
+    def tearDown(self):
+        self.set_password(LEGACY_HASH)
+        db.session.remove()
+        self.context.pop()
+
+    def set_password(self, hash):
+        UserModel.query.filter_by(email=email).update({"password": hash})
+        db.session.commit()
+
+    def get_password(self):
+        db.session.expire_all()
+        return UserModel.query.filter_by(email=email).one().password
+
+    def test_login_upgrades_hash(self):
+        response = postrequest("login", auth())
+        self.assertEqual(response.status_code, 200)
+        password = self.get_password()
+        self.assertFalse(password_hasher.context.needs_update(password))
+        self.assertTrue(verify_password(pwd, password)[0])
+
+        # Upgraded hash
+        response = postrequest("login", auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_password(), password)
+
+    def test_login_wrong_password_keeps_hash(self):
+        response = postrequest(
+            "login", json.dumps({"email": email, "password": "wrong"})
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get_password(), LEGACY_HASH)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from sqlalchemy import inspect
+
+from gncitizen.core.commons.models import ProgramsModel
+from gncitizen.utils.env import db, load_config
+from server import get_app
+from tests.common import getrequest
+
+GEOMETRY_COLUMNS = ("geom", "geom_low", "geom_medium", "geom_high", "bbox", "centroid")
+
+
+class ProgramsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+
+    def test_loader_options_skip_geometries(self):
+        programs = (
+            ProgramsModel.query.options(*ProgramsModel.as_dict_options(True))
+            .filter(ProgramsModel.id_geom.isnot(None))
+            .all()
+        )
+        if not programs:
+            self.skipTest("no program with a geometry")
+        for program in programs:
+            geometry = inspect(program).attrs.geometry.loaded_value
+            loaded = inspect(geometry).dict
+            self.assertIn("name", loaded)
+            for column in GEOMETRY_COLUMNS:
+                self.assertNotIn(column, loaded)
+            properties = program.as_dict(True)
+            self.assertEqual(properties["geometry"]["id_geom"], program.id_geom)
+            # Still not loaded by as_dict
+            self.assertNotIn("geom", inspect(geometry).dict)
+
+    def test_get_programs(self):
+        response = getrequest("programs")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], len(data["features"]))
+        for feature in data["features"]:
+            geometry = feature["properties"].get("geometry")
+            if geometry is not None:
+                # Encoded by get_programs_geometries
+                self.assertIn("bbox", feature)
+                self.assertIn("centroid", feature)
+                for column in GEOMETRY_COLUMNS:
+                    self.assertNotIn(column, geometry)
+
+
+if __name__ == "__main__":
+    unittest.main()
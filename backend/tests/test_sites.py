@@ -1,6 +1,9 @@
 import json
 import unittest
 
+from gncitizen.core.sites.models import SiteTypeModel
+from gncitizen.utils.env import load_config
+from server import get_app
 from tests.common import postrequest, getrequest
 
 
@@ -15,6 +18,17 @@ CREATE_SITE_BODY = {
 }
 
 
+def typed_site_body():
+    """CREATE_SITE_BODY with the id of an existing site type"""
+    body = CREATE_SITE_BODY.copy()
+    del body["site_type"]
+    with get_app(load_config()).app_context():
+        body["id_type"] = (
+            SiteTypeModel.query.order_by(SiteTypeModel.id_typesite).first().id_typesite
+        )
+    return body
+
+
 class SitesTestCase(unittest.TestCase):
     def test_get_sites(self):
         resp = getrequest("sites")
@@ -59,6 +73,31 @@ class SitesTestCase(unittest.TestCase):
         sites_ids = [f["properties"]["id_site"] for f in data["features"]]
         self.assertIn(site_id, sites_ids)
 
+    def test_site_properties(self):
+        body = typed_site_body()
+        response = postrequest("sites/", json.dumps(body))
+        self.assertEqual(response.status_code, 200)
+        site_id = response.json()["features"][0]["properties"]["id_site"]
+
+        response = getrequest("sites/programs/{}".format(body["id_program"]))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], len(data["features"]))
+        site = next(
+            f for f in data["features"] if f["properties"]["id_site"] == site_id
+        )
+        self.assertEqual(site["geometry"]["type"], "Point")
+        properties = site["properties"]
+        self.assertNotIn("geom", properties)
+        self.assertEqual(properties["name"], body["name"])
+        self.assertEqual(properties["site_type"]["id_typesite"], body["id_type"])
+        self.assertEqual(
+            set(properties["site_type"]),
+            {"id_typesite", "category", "type", "pictogram"},
+        )
+        self.assertEqual(properties["program"]["id_program"], body["id_program"])
+        self.assertIn("title", properties["program"])
+
 
 class VisitsTestCase(unittest.TestCase):
     create_visit_body = {"date": "2019-03-06", "data": {}}
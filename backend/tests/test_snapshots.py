@@ -0,0 +1,175 @@
+import json
+import unittest
+
+from gncitizen.core.observations.models import ObservationModel
+from gncitizen.core.observations.routes import user_observations_fingerprint
+from gncitizen.core.users.models import UserModel
+from gncitizen.utils.env import db, load_config
+from gncitizen.utils.snapshots import UserSnapshots
+from server import get_app
+from tests.common import (
+    deleterequest,
+    email,
+    formrequest,
+    getrequest,
+    login,
+    set_tokens,
+)
+
+OBSERVATION_FORM = {
+    "id_program": 1,
+    "cd_nom": 3582,
+    "obs_txt": "Tada",
+    "count": 1,
+    "date": "2021-07-01",
+    "geometry": json.dumps({"x": 5, "y": 45}),
+}
+
+
+def post_observation():
+    """Post an observation as the logged in user, return its id"""
+    response = formrequest("observations", OBSERVATION_FORM)
+    response.raise_for_status()
+    return response.json()["features"][0]["properties"]["id_observation"]
+
+
+class UserSnapshotsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.app.config["USER_SNAPSHOTS"] = {"SIZE": 2}
+        self.context = self.app.app_context()
+        self.context.push()
+        self.snapshots = UserSnapshots("test")
+        self.builds = []
+
+    def tearDown(self):
+        self.context.pop()
+
+    def get(self, user_id, fingerprint):
+        def build():
+            self.builds.append(user_id)
+            return [user_id, fingerprint]
+
+        return self.snapshots.get(user_id, fingerprint, build)
+
+    def test_fingerprint(self):
+        self.assertEqual(self.get(1, (1, "a")), [1, (1, "a")])
+        self.assertEqual(self.get(1, (1, "a")), [1, (1, "a")])
+        self.assertEqual(self.builds, [1])
+        # Written through another worker
+        self.assertEqual(self.get(1, (2, "b")), [1, (2, "b")])
+        self.assertEqual(self.builds, [1, 1])
+
+    def test_invalidate(self):
+        self.get(1, (1,))
+        self.snapshots.invalidate(1)
+        self.snapshots.invalidate(2)
+        self.get(1, (1,))
+        self.assertEqual(self.builds, [1, 1])
+
+    def test_size(self):
+        self.get(1, (1,))
+        self.get(2, (1,))
+        # Most recently used
+        self.get(1, (1,))
+        self.get(3, (1,))
+        self.assertEqual(self.builds, [1, 2, 3])
+        self.get(1, (1,))
+        self.get(2, (1,))
+        self.assertEqual(self.builds, [1, 2, 3, 2])
+
+        self.app.config["USER_SNAPSHOTS"] = {"SIZE": 0}
+        self.snapshots.clear()
+        self.get(1, (1,))
+        self.get(1, (1,))
+        self.assertEqual(self.builds, [1, 2, 3, 2, 1, 1])
+
+
+class UserObservationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.context = self.app.app_context()
+        self.context.push()
+        self.user_id = UserModel.query.filter_by(email=email).one().id_user
+        db.session.remove()
+        login()
+        self.url = "observations/users/{}".format(self.user_id)
+
+    def tearDown(self):
+        set_tokens(None, None)
+        db.session.remove()
+        self.context.pop()
+
+    def get_dashboard(self):
+        response = getrequest(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_dashboard_follows_writes(self):
+        count = self.get_dashboard()["count"]
+
+        id_observation = post_observation()
+        data = self.get_dashboard()
+        self.assertEqual(data["count"], count + 1)
+        self.assertEqual(
+            data["features"][0]["properties"]["id_observation"], id_observation
+        )
+
+        response = deleterequest("observations/{}".format(id_observation))
+        self.assertEqual(response.status_code, 200)
+        data = self.get_dashboard()
+        self.assertEqual(data["count"], count)
+        self.assertNotIn(
+            id_observation,
+            [feature["properties"]["id_observation"] for feature in data["features"]],
+        )
+
+    def test_fingerprint_follows_updates(self):
+        id_observation = post_observation()
+        try:
+            fingerprint = user_observations_fingerprint(self.user_id)
+            self.assertEqual(user_observations_fingerprint(self.user_id), fingerprint)
+            # Snapshot built by the API
+            self.get_dashboard()
+            # Updated outside of the API (admin)
+            ObservationModel.query.filter_by(id_observation=id_observation).update(
+                {"count": 2, "timestamp_update": db.func.now()},
+                synchronize_session=False,
+            )
+            db.session.commit()
+            self.assertNotEqual(
+                user_observations_fingerprint(self.user_id), fingerprint
+            )
+            data = self.get_dashboard()
+            observation = next(
+                feature["properties"]
+                for feature in data["features"]
+                if feature["properties"]["id_observation"] == id_observation
+            )
+            self.assertEqual(observation["count"], 2)
+        finally:
+            deleterequest("observations/{}".format(id_observation))
+
+    def test_dashboard_pages(self):
+        ids = [post_observation(), post_observation(), post_observation()]
+        try:
+            response = getrequest(self.url + "?page=1&per_page=2")
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual((data["page"], data["per_page"]), (1, 2))
+            self.assertTrue(data["has_next"])
+            self.assertEqual(
+                [
+                    feature["properties"]["id_observation"]
+                    for feature in data["features"]
+                ],
+                ids[::-1][:2],
+            )
+            self.assertEqual(data["count"], self.get_dashboard()["count"])
+        finally:
+            for id_observation in ids:
+                deleterequest("observations/{}".format(id_observation))
+
+
+if __name__ == "__main__":
+    unittest.main()
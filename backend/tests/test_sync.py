@@ -0,0 +1,168 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from gncitizen.core.commons.models import DeletionModel
+from gncitizen.core.observations.models import ObservationModel
+from gncitizen.core.sites.models import VisitModel
+from gncitizen.core.sync.routes import DEFAULT_SYNC_CONFIG, VERSION_FORMAT
+from gncitizen.utils.env import db, load_config
+from server import get_app
+from tests.common import deleterequest, getrequest, login, postrequest, set_tokens
+from tests.test_sites import typed_site_body
+from tests.test_snapshots import OBSERVATION_FORM, post_observation
+
+
+def feature_ids(collection, key):
+    return [feature["properties"][key] for feature in collection["features"]]
+
+
+class SyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.context = self.app.app_context()
+        self.context.push()
+        login()
+
+    def tearDown(self):
+        set_tokens(None, None)
+        db.session.remove()
+        self.context.pop()
+
+    def get_changes(self, id_program, since=None):
+        url = "programs/{}/changes".format(id_program)
+        if since is not None:
+            url += "?since={}".format(since)
+        response = getrequest(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_all_rows(self):
+        data = self.get_changes(OBSERVATION_FORM["id_program"])
+        self.assertTrue(data["reset"])
+        datetime.strptime(data["version"], VERSION_FORMAT)
+        self.assertEqual(data["observations"]["type"], "FeatureCollection")
+        self.assertEqual(data["sites"]["type"], "FeatureCollection")
+        self.assertIsInstance(data["visits"], list)
+        self.assertEqual(
+            data["deleted"], {"observations": [], "sites": [], "visits": []}
+        )
+        for feature in data["observations"]["features"]:
+            self.assertEqual(
+                feature["properties"]["id_program"], OBSERVATION_FORM["id_program"]
+            )
+
+        # Next call
+        data = self.get_changes(OBSERVATION_FORM["id_program"], data["version"])
+        self.assertFalse(data["reset"])
+
+    def test_invalid_version(self):
+        response = getrequest("programs/1/changes?since=yesterday")
+        self.assertEqual(response.status_code, 400)
+
+    def test_expired_version(self):
+        retention_days = self.app.config.get("SYNC", {}).get(
+            "RETENTION_DAYS", DEFAULT_SYNC_CONFIG["RETENTION_DAYS"]
+        )
+        since = datetime.utcnow() - timedelta(days=retention_days + 1)
+        data = self.get_changes(1, since.strftime(VERSION_FORMAT))
+        self.assertTrue(data["reset"])
+        self.assertEqual(
+            data["deleted"], {"observations": [], "sites": [], "visits": []}
+        )
+
+    def test_observation_changes(self):
+        id_program = OBSERVATION_FORM["id_program"]
+        version = self.get_changes(id_program)["version"]
+        id_observation = post_observation()
+        data = self.get_changes(id_program, version)
+        self.assertFalse(data["reset"])
+        self.assertIn(
+            id_observation, feature_ids(data["observations"], "id_observation")
+        )
+        self.assertNotIn(id_observation, data["deleted"]["observations"])
+
+        response = deleterequest("observations/{}".format(id_observation))
+        self.assertEqual(response.status_code, 200)
+        data = self.get_changes(id_program, version)
+        self.assertNotIn(
+            id_observation, feature_ids(data["observations"], "id_observation")
+        )
+        self.assertIn(id_observation, data["deleted"]["observations"])
+        # Other programs
+        data = self.get_changes(id_program + 1, version)
+        self.assertNotIn(id_observation, data["deleted"]["observations"])
+
+    def test_site_changes(self):
+        body = typed_site_body()
+        version = self.get_changes(body["id_program"])["version"]
+        response = postrequest("sites/", json.dumps(body))
+        self.assertEqual(response.status_code, 200)
+        id_site = response.json()["features"][0]["properties"]["id_site"]
+        visits = []
+        for _i in range(2):
+            response = postrequest(
+                "sites/{}/visits".format(id_site),
+                json.dumps({"date": "2021-07-01", "data": {}}),
+            )
+            self.assertEqual(response.status_code, 200)
+            visits.append(response.json()["features"][0]["id_visit"])
+
+        data = self.get_changes(body["id_program"], version)
+        self.assertIn(id_site, feature_ids(data["sites"], "id_site"))
+        self.assertTrue(set(visits) <= {visit["id_visit"] for visit in data["visits"]})
+
+        # Visit deleted alone (admin)
+        VisitModel.query.filter_by(id_visit=visits[0]).delete()
+        db.session.commit()
+        data = self.get_changes(body["id_program"], version)
+        self.assertIn(visits[0], data["deleted"]["visits"])
+        self.assertNotIn(visits[1], data["deleted"]["visits"])
+
+        response = deleterequest("sites/{}".format(id_site))
+        self.assertEqual(response.status_code, 200)
+        data = self.get_changes(body["id_program"], version)
+        self.assertIn(id_site, data["deleted"]["sites"])
+        self.assertNotIn(id_site, feature_ids(data["sites"], "id_site"))
+        # Visits deleted with their site are not logged, clients drop them
+        self.assertNotIn(visits[1], data["deleted"]["visits"])
+        self.assertNotIn(visits[1], [visit["id_visit"] for visit in data["visits"]])
+
+
+class DeletionLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = get_app(load_config())
+        self.context = self.app.app_context()
+        self.context.push()
+        login()
+        self.id_observation = post_observation()
+
+    def tearDown(self):
+        deleterequest("observations/{}".format(self.id_observation))
+        set_tokens(None, None)
+        db.session.remove()
+        self.context.pop()
+
+    def get_deletions(self):
+        return DeletionModel.query.filter_by(
+            entity="observation", id_entity=self.id_observation
+        ).all()
+
+    def test_trigger(self):
+        ObservationModel.query.filter_by(id_observation=self.id_observation).delete()
+        db.session.commit()
+        deletions = self.get_deletions()
+        self.assertEqual(len(deletions), 1)
+        self.assertEqual(deletions[0].id_program, OBSERVATION_FORM["id_program"])
+        self.assertIsNotNone(deletions[0].timestamp_delete)
+
+    def test_moved_rows_not_logged(self):
+        # Rows moved to another partition are deleted then inserted
+        db.session.execute("SET LOCAL gnc.log_deletions = 'off'")
+        ObservationModel.query.filter_by(id_observation=self.id_observation).delete()
+        db.session.commit()
+        self.assertEqual(self.get_deletions(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
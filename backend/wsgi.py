@@ -3,6 +3,7 @@
 """
 
 from gncitizen.utils.env import load_config
+from gncitizen.utils.preload import warm_caches
 from server import get_app
 
 # get the app config file
@@ -10,6 +11,9 @@ config = load_config()
 
 # give the app context from server.py in a app object
 app = get_app(config)
+# Shared copy-on-write by workers when gunicorn preloads the app
+if config.get("STARTUP", {}).get("WARM_CACHES", False):
+    warm_caches(app)
 port = app.config["API_PORT"] if app.config.get("API_PORT", False) else 5002
 
 if __name__ == "__main__":
@@ -43,6 +43,7 @@ export class UserDashboardComponent implements OnInit {
     userAvatar: string | ArrayBuffer;
     extentionFile: any;
     newAvatar: string | ArrayBuffer;
+    avatarFile: File;
     idObsToDelete: number;
     idSiteToDelete: number;
     tab = 'observations';
@@ -310,14 +311,21 @@ export class UserDashboardComponent implements OnInit {
     onUpdatePersonalData(userForm) {
         userForm = _.omitBy(userForm, _.isNil);
         delete userForm.username;
-        if (this.newAvatar && this.extentionFile) {
-            userForm.avatar = this.userAvatar;
-            userForm.extention = this.extentionFile;
+        let personalData: any = userForm;
+        if (this.newAvatar && this.avatarFile) {
+            // Avatar is sent as a multipart upload
+            personalData = new FormData();
+            Object.keys(userForm).forEach((key) =>
+                personalData.append(key, userForm[key])
+            );
+            personalData.append('avatar', this.avatarFile);
         }
-        this.userService.updatePersonalData(userForm).subscribe((user: any) => {
-            localStorage.setItem('userAvatar', user.features.avatar);
-            this.modalRef.close();
-        });
+        this.userService
+            .updatePersonalData(personalData)
+            .subscribe((user: any) => {
+                localStorage.setItem('userAvatar', user.features.avatar);
+                this.modalRef.close();
+            });
     }
 
     onUploadAvatar($event) {
@@ -329,6 +337,7 @@ export class UserDashboardComponent implements OnInit {
                 reader.onload = () => {
                     this.userAvatar = reader.result;
                     this.newAvatar = reader.result;
+                    this.avatarFile = file;
                     this.extentionFile = $event.target.files[0].type
                         .split('/')
                         .pop();
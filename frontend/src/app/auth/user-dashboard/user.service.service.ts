@@ -32,7 +32,11 @@ export class UserService {
 
         return this.http
             .patch(`${AppConfig.API_ENDPOINT}/user/info`, personalInfo, {
-                headers: this.headers,
+                // let the browser set the multipart boundary for FormData
+                headers:
+                    personalInfo instanceof FormData
+                        ? new HttpHeaders()
+                        : this.headers,
             })
             .pipe(
                 catchError((error) => {
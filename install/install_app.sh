@@ -220,6 +220,8 @@ fi
 source $venv_path/bin/activate
 pip install --upgrade pip
 pip install -r backend/requirements.txt
+# Création des schémas et tables de la base
+(cd backend && FLASK_APP=wsgi flask db-init)
 deactivate
 
 # Copy main medias to media
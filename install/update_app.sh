@@ -30,6 +30,8 @@ venv_path=$FLASKDIR/backend/$venv_dir
 source $venv_path/bin/activate
 echo $(pwd)
 pip install -r backend/requirements.txt
+# Migration du schéma de la base (flask db-upgrade)
+(cd backend && FLASK_APP=wsgi flask db-init)
 
 #Reload Supervisor pour l'api
 echo "Reloading Api ..."